@@ -26,24 +26,42 @@
     This version is specific to our school's captive portal, but it was designed to be very easily adapted to automatically connect to any captive portal. You may only need to change ConnectionManager's connect() and disconnect() functions, and the INI file. 
 '''
 
-import re
+import startup
 import time
 import datetime
-import socket
 import sys
 import os
-import platform
-from multiprocessing import Process
-from threading import Thread
+import collections
+import argparse
+from threading import Thread, Event
+from concurrent.futures import Future, ThreadPoolExecutor
+import traceback
 from functools import partial
-import pickle
 
-import tempfile
 import configparser
-import requests
-from pydispatch import dispatcher
 
 from getch import getch
+from clock import SystemClock
+from probe import ProbeRace
+from resolver import DNSCache
+from reachability import ReachabilityChecker
+from session_store import SessionStore
+import history
+from history import HistoryLog
+import lifetime
+from lifetime import LifetimeEstimator
+import portal_client
+from portal_client import PortalClient
+from login_parser import LoginResponseParser
+from netwatch import NetworkChangeMonitor
+from scheduler import RenewalScheduler
+from metrics import Metrics, MetricsServer, timed
+from commands import CommandQueue
+from renderer import TerminalRenderer, HeadlessRenderer
+from eventbus import EventBus, StateChanged, SessionRenewed, ProbeCompleted
+from leader import LeaderElection, private_directory
+
+startup.mark('imports')
 
 __author__ = "Nicolas Perez"
 __copyright__ = "Copyright 2016"
@@ -55,17 +73,57 @@ __state__ = "Production"
 
 class ConnectionModel:
 
-    def __init__(self):
-        self.INI_FILE_NAME = 'INSAConnect.ini'
-        self.DAT_FILE_NAME = 'INSAConnectSession.dat'
+    def __init__(self, iniFile='INSAConnect.ini', sessionDir=None, clock=None, interface=None):
+        self._init_settings(iniFile, sessionDir, interface)
+        self.clock = clock or SystemClock()
+        self.events = EventBus()
         
-        self._init_from_config_file()
-        self.currentSession = {'captive_portal': None, 'ID': None, 'end_timestamp': float('inf'), 'end_time': float('inf')}
+        self.sessionStore = SessionStore(os.path.join(self.SESSION_DIRECTORY, self.DAT_FILE_NAME))
+        #L'historique et les durées de session ne touchent au disque qu'à leur première utilisation, après la première sonde
+        self.history = HistoryLog(self.HISTORY_DIRECTORY, self.HISTORY_BASENAME,
+                                  segment_bytes=self.HISTORY['SEGMENT_SIZE'],
+                                  max_segments=self.HISTORY['SEGMENTS'], heartbeat=self.HISTORY['HEARTBEAT'],
+                                  clock=self.clock) if self.HISTORY['ENABLED'] else None
+        self.lifetimes = self._lifetime_estimator()
+        self.renewalScheduler = RenewalScheduler(lead=self.RENEWAL['LEAD'], jitter=self.RENEWAL['JITTER'], prewarm_lead=self.RENEWAL['PREWARM_LEAD'],
+                                                 retry_delay=self.RENEWAL['RETRY_DELAY'], max_retry_delay=self.RENEWAL['MAX_RETRY_DELAY'],
+                                                 clock=self.clock)
+        self.currentSession = {'captive_portal': None, 'ID': None, 'start_timestamp': None, 'end_timestamp': float('inf'), 'end_time': float('inf')}
         self._read_session_dat_file()
         self.connectionStateText = "Bonjour !\n\nVérification de l'état de la connexion..."
         self.connectedThroughCaptivePortal = False
-
-        self._connectionStateCounter = 0
+        self._sessionLostAt = None
+        self.renewalGaps = collections.deque(maxlen=100)
+        self.portalStatus = portal_client.OK
+
+    @classmethod
+    def settings(cls, iniFile='INSAConnect.ini', sessionDir=None, interface=None):
+        """Model reduced to the INI parameters and the locations of its files, none of which is opened
+            (for the subcommands that only read the history or the lifetimes).
+        """
+        model = cls.__new__(cls)
+        model._init_settings(iniFile, sessionDir, interface, create=False)
+        return model
+
+    def _init_settings(self, iniFile, sessionDir, interface, create=True):
+        self.INI_FILE_NAME = iniFile
+        #Avec une interface, le modèle ne décrit que ce lien : sa session et son historique ont leurs propres fichiers
+        self.interface = interface
+        suffix = '' if interface is None else '-' + interface
+        self.DAT_FILE_NAME = 'INSAConnectSession' + suffix + '.dat'
+        self._init_from_config_file()
+        self.SESSION_DIRECTORY = sessionDir or private_directory(create=create)
+        self.HISTORY_DIRECTORY = self.HISTORY['DIRECTORY'] or self.SESSION_DIRECTORY
+        self.HISTORY_BASENAME = 'INSAConnectHistory' + suffix
+        self.LIFETIMES_FILE_NAME = os.path.join(self.SESSION_DIRECTORY, 'INSAConnectLifetimes.json')
+
+    def _lifetime_estimator(self):
+        """LifetimeEstimator of the INI's [Renewal] settings, None if learning is disabled."""
+        if not self.RENEWAL['LEARN_LIFETIME']:
+            return None
+        #Une session apprise dure au moins deux fois la marge de renouvellement
+        return LifetimeEstimator(self.LIFETIMES_FILE_NAME, quantile=self.RENEWAL['LIFETIME_QUANTILE'], min_deaths=self.RENEWAL['LIFETIME_MIN_DEATHS'],
+                                 min_lifetime=2 * (self.RENEWAL['LEAD'] + self.RENEWAL['JITTER']))
 
     def _init_from_config_file(self):
         """Reads the parameters from the config file."""
@@ -80,164 +138,478 @@ class ConnectionModel:
                                                             DOMAIN = config['Captive_portal:'+captive_portal]['domain'],
                                                             PORT = int(config['Captive_portal:'+captive_portal]['port']),
                                                             TIMEOUT = int(config['Captive_portal:'+captive_portal]['timeout']))
+            self.MONITOR = dict(MODE = config.get('Monitor', 'mode', fallback='netlink'),
+                                POLL_INTERVAL = config.getfloat('Monitor', 'poll_interval', fallback=1),
+                                MAX_POLL_INTERVAL = config.getfloat('Monitor', 'max_poll_interval', fallback=15),
+                                TAKEOVER_INTERVAL = config.getfloat('Monitor', 'takeover_interval', fallback=2))
+            self.RENEWAL = dict(LEAD = config.getfloat('Renewal', 'lead', fallback=60),
+                                JITTER = config.getfloat('Renewal', 'jitter', fallback=10),
+                                PREWARM_LEAD = config.getfloat('Renewal', 'prewarm_lead', fallback=5),
+                                RETRY_DELAY = config.getfloat('Renewal', 'retry_delay', fallback=5),
+                                MAX_RETRY_DELAY = config.getfloat('Renewal', 'max_retry_delay', fallback=60),
+                                LEARN_LIFETIME = config.getboolean('Renewal', 'learn_lifetime', fallback=True),
+                                LIFETIME_QUANTILE = config.getfloat('Renewal', 'lifetime_quantile', fallback=0.05),
+                                LIFETIME_MIN_DEATHS = config.getint('Renewal', 'lifetime_min_deaths', fallback=2))
+            self.PORTAL_HTTP = dict(CONNECT_TIMEOUT = config.getfloat('Portal_HTTP', 'connect_timeout', fallback=3),
+                                    READ_TIMEOUT = config.getfloat('Portal_HTTP', 'read_timeout', fallback=10),
+                                    RETRIES = config.getint('Portal_HTTP', 'retries', fallback=2),
+                                    BACKOFF = config.getfloat('Portal_HTTP', 'backoff', fallback=0.5),
+                                    BREAKER_THRESHOLD = config.getint('Portal_HTTP', 'breaker_threshold', fallback=3),
+                                    BREAKER_RESET = config.getfloat('Portal_HTTP', 'breaker_reset', fallback=30))
+            self.PROBES = dict(EXTERNAL_HOST = config.get('Probes', 'external_host', fallback='google.com'),
+                               EXTERNAL_PORT = config.getint('Probes', 'external_port', fallback=80),
+                               REACHABILITY_METHODS = config.get('Probes', 'reachability_methods', fallback='icmp,http').split(','),
+                               REACHABILITY_HOSTS = config.get('Probes', 'reachability_hosts', fallback='8.8.8.8,1.1.1.1').split(','),
+                               REACHABILITY_URLS = config.get('Probes', 'reachability_urls', fallback='http://clients3.google.com/generate_204').split(','),
+                               REACHABILITY_PORT = config.getint('Probes', 'reachability_port', fallback=443),
+                               REACHABILITY_TIMEOUT = config.getfloat('Probes', 'reachability_timeout', fallback=0.5))
+            self.DISPLAY = dict(HEADLESS = config.getboolean('Display', 'headless', fallback=False),
+                                COALESCE = config.getfloat('Display', 'coalesce', fallback=0.05),
+                                MAX_FPS = config.getfloat('Display', 'max_fps', fallback=10))
+            self.METRICS = dict(ENABLED = config.getboolean('Metrics', 'enabled', fallback=False),
+                                PORT = config.getint('Metrics', 'port', fallback=9737))
+            self.DAEMON = dict(SOCKET_MODE = int(config.get('Daemon', 'socket_mode', fallback='600'), 8),
+                               SOCKET_GROUP = config.get('Daemon', 'socket_group', fallback='').strip())
+            self.HISTORY = dict(ENABLED = config.getboolean('History', 'enabled', fallback=True),
+                                DIRECTORY = config.get('History', 'directory', fallback=''),
+                                SEGMENT_SIZE = config.getint('History', 'segment_size', fallback=1048576),
+                                SEGMENTS = config.getint('History', 'segments', fallback=8),
+                                HEARTBEAT = config.getfloat('History', 'heartbeat', fallback=300))
         except:
             input('ERREUR: Le fichier INI est mal formé ou inexistant.')
             raise
 
     def _write_session_dat_file(self):
         """Stores the session's info in a file so that the program can remember it if the user restarts the program or reboots their computer."""
-        with open(os.path.join(tempfile.gettempdir(), self.DAT_FILE_NAME), 'wb') as file:
-            pickler = pickle.Pickler(file)
-            pickler.dump(self.currentSession)
-
-    def _read_session_dat_file(self):
         try:
-            with open(os.path.join(tempfile.gettempdir(), self.DAT_FILE_NAME), 'rb') as file:
-                unpickler = pickle.Unpickler(file)
-                unpickledSession = unpickler.load()
-                if (unpickledSession['captive_portal'] == self.currentSession['captive_portal'] and unpickledSession['end_timestamp'] > time.time()):
-                    self.currentSession = unpickledSession
-        except:
+            self.sessionStore.write(self.currentSession)
+        except OSError:
             pass
 
+    def _read_session_dat_file(self):
+        """Picks up a session saved by a previous run or another instance. Only touches the disk when the file has changed."""
+        storedSession = self.sessionStore.read()
+        if (storedSession and storedSession != self.currentSession
+                and storedSession['captive_portal'] == self.currentSession['captive_portal'] and storedSession['end_timestamp'] > self.clock.time()):
+            self.currentSession = dict(storedSession)
+            self.renewalScheduler.schedule(self.currentSession['captive_portal'], self.currentSession['end_timestamp'])
+
+    def followStoredSession(self):
+        """Adopts whatever session the leader instance stored (see LeaderElection), whatever its captive portal."""
+        storedSession = self.sessionStore.read()
+        if storedSession and storedSession != self.currentSession:
+            self.currentSession = dict(storedSession)
+            self.renewalScheduler.schedule(self.currentSession['captive_portal'], self.currentSession['end_timestamp'])
+        return self.currentSession
+
     def setConnectionStateText(self, text):
         """Changes the text that describes the connection's state in the model and informs the view."""
-        if self.connectionStateText != text and self._connectionStateCounter >= 0: #XXX
+        if self.connectionStateText != text:
             self.connectionStateText = text
             #Prévient la vue que le texte a changé
-            dispatcher.send(signal='view_display_update', sender=self)
-            self._connectionStateCounter = 0
-        else:
-            self._connectionStateCounter += 1
+            self.events.publish(StateChanged('connectionStateText', text))
 
     def getCurrentSession(self):
         self._read_session_dat_file()
         return self.currentSession
 
+    def sessionLifetime(self, captive_portal):
+        """How long a new session of captive_portal is expected to last: learnt from the previous ones (see LifetimeEstimator), or the INI timeout."""
+        timeout = self.CAPTIVE_PORTALS[captive_portal]['TIMEOUT']
+        return self.lifetimes.estimate(captive_portal, timeout) if self.lifetimes else timeout
+
+    def _end_session(self, died, end=None):
+        """Gives the current session's duration to the lifetime estimator, once."""
+        session = self.currentSession
+        if self.lifetimes and session['ID'] and session['start_timestamp'] is not None:
+            self.lifetimes.observe(session['captive_portal'], session['start_timestamp'], end or self.clock.time(), died, session['end_timestamp'])
+            session['start_timestamp'] = None
+            self._write_session_dat_file()
+
+    def sessionLost(self):
+        """We got cut off behind the captive portal. It only counts as the session's death if the next login gives a new session."""
+        if self._sessionLostAt is None:
+            self._sessionLostAt = self.clock.time()
+
+    def sessionClosed(self):
+        """We logged the current session out ourselves."""
+        self._end_session(died=False)
+
     def setCurrentSession(self, captive_portal, currentSessionID):
-        """Saves data about the current session in a variable and in a file."""
+        """Saves data about the current session in a variable and in a file.
+            Its expiry is planned with the lifetime learnt from the previous sessions of the portal.
+        """
         if currentSessionID != self.getCurrentSession()['ID']:
+            self._end_session(died=self._sessionLostAt is not None, end=self._sessionLostAt)
+            self._sessionLostAt = None
             self.currentSession['captive_portal'] = captive_portal
             self.currentSession['ID'] = currentSessionID
-            self.currentSession['end_timestamp'] = time.time() + self.CAPTIVE_PORTALS[captive_portal]['TIMEOUT']
+            lifetime = self.sessionLifetime(captive_portal)
+            self.currentSession['start_timestamp'] = self.clock.time()
+            self.currentSession['end_timestamp'] = self.currentSession['start_timestamp'] + lifetime
             self.currentSession['end_time'] = datetime.datetime.fromtimestamp(self.currentSession['end_timestamp']).strftime('%H:%M')
             self._write_session_dat_file()
+            self.renewalScheduler.schedule(captive_portal, self.currentSession['end_timestamp'])
+            if self.history:
+                self.history.recordSession(captive_portal, lifetime)
+            self.events.publish(SessionRenewed(captive_portal, currentSessionID, self.currentSession['end_timestamp']))
+
+    def setPortalStatus(self, status):
+        """Remembers the outcome of the last portal request (see portal_client) and informs the view when it changes."""
+        if self.portalStatus != status:
+            self.portalStatus = status
+            self.events.publish(StateChanged('portalStatus', status))
+
+    def recordRenewal(self, captive_portal, latency, gap):
+        """Remembers how long the renewal took (None if it failed) and how long we were offline (None if the connection didn't come back)."""
+        self.renewalGaps.append((self.clock.time(), gap))
+        if self.history:
+            self.history.recordRenewal(captive_portal, latency, gap)
 
     def setConnectedThroughCaptivePortal(self, connectedThroughCaptivePortal):
         """Just sets that value so the view knows what to display."""
+        if connectedThroughCaptivePortal:
+            self._sessionLostAt = None  # Fausse alerte : la session a survécu
         if self.connectedThroughCaptivePortal != connectedThroughCaptivePortal:
             self.connectedThroughCaptivePortal = connectedThroughCaptivePortal
-            dispatcher.send(signal='view_display_update', sender=self)
+            self.events.publish(StateChanged('connectedThroughCaptivePortal', connectedThroughCaptivePortal))
 
 
 class ConnectionManager:
 
-    def __init__(self):
-        self.model = ConnectionModel()
-        self.view = ConnectionView(self.model, self)
+    def __init__(self, headless=False, model=None, fastStart=False):
+        self.model = model or ConnectionModel()
+        startup.mark('model')
+        self.clock = self.model.clock
+        self.view = ConnectionView(self.model, self, headless)
         self.currentCaptivePortal = None
 
         self.thread = None
         self.monitorConnectionState = True
         self.autoManageConnection = True
         self.shouldVerifySession = True
-        
+        self.fastStart = fastStart
+        self.state = None
+
+        self.metrics = Metrics(self.clock)
+        self.metricsServer = MetricsServer(self.metrics, self.model.METRICS['PORT']) if self.model.METRICS['ENABLED'] else None
+
+        self.EXTERNAL_HOST = (self.model.PROBES['EXTERNAL_HOST'], self.model.PROBES['EXTERNAL_PORT'])
+        self._externalReachable = None
+        self.probeResults = {}
+        self._open_network()
+
+        self.portalClients = {}
+        self.portalClientFactory = PortalClient
+        self.commands = CommandQueue(self.clock)
+        self._gapWatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='offline-gap')
+
+        self.leader = LeaderElection(self.model.sessionStore.path + '.lock')
+
+        self._pollInterval = self.model.MONITOR['POLL_INTERVAL']
+        self._lastObservedState = None
+        startup.mark('manager')
+
+    def _open_network(self):
+        """Creates what talks to the network: resolver, probes, reachability checker and network change monitor (a replay swaps them all, see replay.py)."""
+        self.resolver = DNSCache(interface=self.model.interface)
+        self._probeRace = ProbeRace(max_workers=2 * (len(self.model.CAPTIVE_PORTALS) + 1), resolver=self.resolver, interface=self.model.interface)
+        self._reachability = ReachabilityChecker(hosts=self.model.PROBES['REACHABILITY_HOSTS'],
+                                                 timeout=self.model.PROBES['REACHABILITY_TIMEOUT'],
+                                                 methods=self.model.PROBES['REACHABILITY_METHODS'],
+                                                 http_urls=self.model.PROBES['REACHABILITY_URLS'],
+                                                 tcp_port=self.model.PROBES['REACHABILITY_PORT'],
+                                                 resolver=self.resolver,
+                                                 interface=self.model.interface)
+        self.networkMonitor = NetworkChangeMonitor(use_netlink=self.model.MONITOR['MODE'] == 'netlink')
+
+    @timed('internet')
     def _internet(self, host='google.com', port=80, timeout=3):
-        """Checks internet and DNS connectivity."""
-        try:
-            socket.setdefaulttimeout(timeout)
-            socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
-            return True
-        except Exception:
-            return False
-
-    def _detect_captive_portal(self):
-        """Checks whether or not we see one of the captive portals from where we're connected."""
-        for captive_portal in self.model.CAPTIVE_PORTALS.keys():
-            if self._internet(host=self.model.CAPTIVE_PORTALS[captive_portal]['DOMAIN'], port=self.model.CAPTIVE_PORTALS[captive_portal]['PORT']):
-                self.model.currentSession['captive_portal'] = captive_portal
-                return captive_portal
-        return None
-
-    def _ping(self, host='8.8.8.8'):
-        """Returns True if host responds to a ping request (works on Windows and Linux)."""
-        if platform.system().lower() == "windows":
-            pingCMD = "ping -n 1 -w 1000 "+host+" > NUL"
+        """Checks internet and DNS connectivity. The result is falsy on failure, and its stage tells whether DNS or TCP failed."""
+        return self._probeRace.probe(host, port, timeout)
+
+    @timed('detect_captive_portal')
+    def _detect_captive_portal(self, timeout=3):
+        """Checks whether or not we see one of the captive portals from where we're connected.
+            All the portals and the external host are probed at once, so this takes about one round trip whatever the number of portals.
+            The external host's result is kept in self._externalReachable when no portal answers.
+        """
+        targets = {captive_portal: (self.model.CAPTIVE_PORTALS[captive_portal]['DOMAIN'], self.model.CAPTIVE_PORTALS[captive_portal]['PORT'])
+                   for captive_portal in self.model.CAPTIVE_PORTALS.keys()}
+        targets[None] = self.EXTERNAL_HOST
+        captive_portal, results = self._probeRace.run(targets, winners=self.model.CAPTIVE_PORTALS.keys(), timeout=timeout)
+        self.probeResults = results
+        self.model.events.publish(ProbeCompleted(captive_portal, results))
+        for result in results.values():
+            if not result:
+                self.metrics.increment('probe_failure_' + result.stage)
+        self._externalReachable = results[None].ok if None in results else None
+        if captive_portal is not None:
+            self.model.currentSession['captive_portal'] = captive_portal
+        return captive_portal
+
+    @timed('ping')
+    def _ping(self):
+        """Returns True if the internet is reachable past the captive portal (in-process, no ping subprocess)."""
+        return self._reachability.check()
+
+    def _portal_client(self, captive_portal):
+        """Returns the persistent HTTP client of a captive portal."""
+        if captive_portal not in self.portalClients:
+            self.portalClients[captive_portal] = self.portalClientFactory(self.model.CAPTIVE_PORTALS[captive_portal]['URL'],
+                                                              connect_timeout=self.model.PORTAL_HTTP['CONNECT_TIMEOUT'],
+                                                              read_timeout=self.model.PORTAL_HTTP['READ_TIMEOUT'],
+                                                              retries=self.model.PORTAL_HTTP['RETRIES'],
+                                                              backoff=self.model.PORTAL_HTTP['BACKOFF'],
+                                                              breaker_threshold=self.model.PORTAL_HTTP['BREAKER_THRESHOLD'],
+                                                              breaker_reset=self.model.PORTAL_HTTP['BREAKER_RESET'],
+                                                              interface=self.model.interface,
+                                                              clock=self.clock)
+        return self.portalClients[captive_portal]
+
+    def _on_renewal_due(self, captive_portal, kind):
+        """Called by the renewal scheduler: pre-warms the portal connection a few seconds ahead, then renews the session."""
+        if not self.leader.isLeader:
+            return
+        if not (self.autoManageConnection and self.model.connectedThroughCaptivePortal and captive_portal == self.currentCaptivePortal):
+            if kind == 'renew':
+                # On réessaiera plus tard : la boucle de surveillance se charge de la connexion si la session a expiré
+                self.model.renewalScheduler.failed(captive_portal)
+            return
+        if kind == 'prewarm':
+            self._portal_client(captive_portal).prewarm()
+            return
+        previousSessionID = self.model.getCurrentSession()['ID']
+        self.model.setConnectionStateText("Reconnexion automatique en cours...")
+        self.reconnect(captive_portal).result()
+        if self.model.getCurrentSession()['ID'] == previousSessionID:
+            self.model.renewalScheduler.failed(captive_portal)
+        self.networkMonitor.wakeup()
+
+    def _wait_for_next_tick(self):
+        """Sleeps until the next check. Returns early if the network changes (netlink mode).
+            While the state stays the same, the netlink mode doubles the interval up to MAX_POLL_INTERVAL. Renewals don't depend on it (see RenewalScheduler).
+        """
+        state = (self.currentCaptivePortal, self.model.connectedThroughCaptivePortal, self._externalReachable, self.autoManageConnection)
+        if state != self._lastObservedState or not self.networkMonitor.available:
+            self._pollInterval = self.model.MONITOR['POLL_INTERVAL']
         else:
-            pingCMD = "ping -c 1 -W 1 "+host+" > /dev/null"
-        return os.system(pingCMD) == 0
-
-    def connect(self):
+            self._pollInterval = min(self._pollInterval * 2, self.model.MONITOR['MAX_POLL_INTERVAL'])
+        self._lastObservedState = state
+        if self.networkMonitor.wait(self._pollInterval):
+            self._lastObservedState = None
+
+    def _login(self, captive_portal):
+        """Posts the login form. Returns the new session ID, or None if the login failed (the cause goes to the model's portalStatus).
+            The page is parsed while it downloads: the rest of it isn't waited for once the logout_id field has arrived.
+        """
+        login_data = {'auth_user': self.model.LOGIN,
+                      'auth_pass': self.model.PASSWORD,
+                      'accept': 'Connexion'}
+        result = self._portal_client(captive_portal).request(login_data, parser=LoginResponseParser)
+        if result.status != portal_client.OK:
+            self.model.setPortalStatus(result.status)
+            return None
+        if result.parsed.error:
+            self.model.setPortalStatus(portal_client.AUTH_ERROR)
+            self.model.setConnectionStateText("Erreur d'authentification sur le portail captif.\nVeuillez vérifier vos identifiants dans le fichier\nINSAConnect.ini.")
+            return None
+        if not result.parsed.sessionID:
+            self.model.setPortalStatus(portal_client.PARSE_ERROR)
+            return None
+        self.model.setPortalStatus(portal_client.OK)
+        return result.parsed.sessionID
+
+    def _logout(self, captive_portal, sessionID):
+        """Posts the logout form for sessionID. Returns True if the portal answered."""
+        logout_data = {'logout_id': sessionID}
+        result = self._portal_client(captive_portal).request(logout_data)
+        self.model.setPortalStatus(result.status)
+        return result.status == portal_client.OK
+
+    @timed('connect')
+    def _connect(self, captive_portal):
         """Logs in on the captive portal to get access to the interwebz."""
-        try:
-            login_data = {'auth_user': self.model.LOGIN,
-                          'auth_pass': self.model.PASSWORD,
-                          'accept': 'Connexion'}
-            r = requests.post(self.model.CAPTIVE_PORTALS[self.currentCaptivePortal]['URL'], data=login_data)
-            if 'erreur' in r.text:
-                self.model.setConnectionStateText("Erreur d'authentification sur le portail captif.\nVeuillez vérifier vos identifiants dans le fichier\nINSAConnect.ini.")
-            else:
-                sessionID = str(re.search('<input name="logout_id" type="hidden" value="(.*)" />', r.text).group(1))
-                self.model.setCurrentSession(self.currentCaptivePortal, sessionID)
-        except: #(KeyError, )
-            pass
+        sessionID = self._login(captive_portal)
+        if sessionID:
+            self.model.setCurrentSession(captive_portal, sessionID)
 
-    def disconnect(self):
+    @timed('disconnect')
+    def _disconnect(self, captive_portal):
         """Logs out from the captive portal (before it logs you out)."""
-        self.connect()
-        logout_data = {'logout_id': self.model.currentSession['ID']}
+        self._connect(captive_portal)
+        if self._logout(captive_portal, self.model.currentSession['ID']):
+            self.model.sessionClosed()
+
+    @timed('reconnect')
+    def _reconnect(self, captive_portal):
+        """Logs out from the captive portal and immediately back in to renew the session.
+            The logout and the login are sent back-to-back over the same portal connection, without the extra login _disconnect() does.
+            The session is only updated if the portal hands out a new logout_id, and the offline gap is recorded in the model.
+        """
+        previousSessionID = self.model.getCurrentSession()['ID']
+        if not previousSessionID:
+            self._connect(captive_portal)
+            return
+        logoutSent = self.clock.time()
+        if self._logout(captive_portal, previousSessionID):
+            #Une coupure vue par le monitor avant le login n'est pas la mort de la session : c'est nous qui l'avons fermée
+            self.model.sessionClosed()
+        #Le retour du réseau est guetté pendant le login : un login lent n'empêche pas de mesurer la coupure
+        loginDone = Event()
+        if not self.clock.virtual:
+            gapFuture = self._gapWatcher.submit(self._measure_offline_gap, logoutSent, loginDone)
         try:
-            logout_data['logout_id'] = self.model.currentSession['ID']
-            r = requests.post(self.model.CAPTIVE_PORTALS[self.currentCaptivePortal]['URL'], data=logout_data)
-        except:
-            pass
+            sessionID = self._login(captive_portal)
+        finally:
+            loginDone.set()
+        latency = None
+        if sessionID and sessionID != previousSessionID:
+            latency = self.clock.time() - logoutSent
+            self.model.setCurrentSession(captive_portal, sessionID)
+        gap = self._measure_offline_gap(logoutSent, loginDone) if self.clock.virtual else gapFuture.result()
+        self.model.recordRenewal(captive_portal, latency, gap)
+        if gap is not None:
+            self.metrics.observe('renewal_offline_gap', gap)
+
+    def _submit(self, name, operation, captive_portal):
+        """Queues operation(captive_portal). The portal is the current one when the command is given, not when it runs:
+            the monitor thread may have changed currentCaptivePortal in between.
+        """
+        captive_portal = self.currentCaptivePortal if captive_portal is None else captive_portal
+        if captive_portal is None:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.commands.submit(name, operation, captive_portal)
+
+    def connect(self, captive_portal=None):
+        """Queues a login on the captive portal (the current one by default). Returns a Future (an identical pending request is reused)."""
+        return self._submit('connect', self._connect, captive_portal)
+
+    def disconnect(self, captive_portal=None):
+        """Queues a logout from the captive portal. Returns a Future."""
+        return self._submit('disconnect', self._disconnect, captive_portal)
+
+    def reconnect(self, captive_portal=None):
+        """Queues a session renewal. Returns a Future."""
+        return self._submit('reconnect', self._reconnect, captive_portal)
+
+    def _measure_offline_gap(self, since, loginDone, timeout=5, probeTimeout=0.2):
+        """Returns the time between since and the first packet that gets through, or None if nothing got through within
+            timeout seconds after the login ended (loginDone set). The checks start every probeTimeout seconds: a portal
+            that rejects the packets at once doesn't make this spin. The end of the login cuts that wait short, so that
+            the network is checked again as soon as the new session exists.
+        """
+        deadline = None
+        while deadline is None or self.clock.time() < deadline:
+            if deadline is None and loginDone.is_set():
+                deadline = self.clock.time() + timeout
+            checkStart = self.clock.time()
+            if self._reachability.check(timeout=probeTimeout):
+                return self.clock.time() - since
+            pause = max(0, probeTimeout - (self.clock.time() - checkStart))
+            if deadline is None:
+                loginDone.wait(pause)
+            else:
+                self.clock.sleep(pause)
+        return None
 
-    def reconnect(self):
-        """Logs out from the captive portal and immediately back in to renew the session."""
-        self.disconnect()
-        self.connect()
+    def _setState(self, state):
+        """Counts the time spent in state (metrics), logs the transition in the history and announces it (see links.MultiLinkManager)."""
+        self.metrics.setState(state)
+        if self.model.history and self.leader.isLeader:
+            self.model.history.recordState(state)
+        if self.state != state:
+            self.state = state
+            self.model.events.publish(StateChanged('state', state))
+
+    def _follow_leader(self):
+        """What a follower instance does instead of probing: shows the session the leader stored, and tries to take over."""
+        self.currentCaptivePortal = None
+        session = self.model.followStoredSession()
+        text = "Une autre instance d'INSAConnect"+(" (PID "+str(self.leader.leaderPID())+")" if self.leader.leaderPID() else "")+"\nsurveille la connexion."
+        if session['ID'] and session['end_timestamp'] > self.clock.time():
+            text += "\n\nSession "+str(session['ID'])+" sur "+str(session['captive_portal'])+"\nexpire à "+str(session['end_time'])
+        self.model.setConnectionStateText(text)
+        self._setState('follower')
+        #Le verrou est libéré par le noyau si le leader meurt : on retente régulièrement
+        self.networkMonitor.wait(self.model.MONITOR['TAKEOVER_INTERVAL'])
 
     def run(self, parent):
-        """Monitors the connection's state and automatically connects/reconnects to the captive portal when required."""
+        """Monitors the connection's state and automatically connects/reconnects to the captive portal when required.
+            Only one instance per machine (the leader) does so, the others follow the session it stores.
+        """
         self = parent
         while self.monitorConnectionState:
             try:
+                if not self.leader.isLeader:
+                    if not self.leader.try_acquire():
+                        self._follow_leader()
+                        continue
+                    session = self.model.followStoredSession()
+                    self.model.renewalScheduler.schedule(session['captive_portal'], session['end_timestamp'])
+                    self._lastObservedState = None
                 self.currentCaptivePortal = self._detect_captive_portal()
+                startup.mark('first_probe')
                 if self.currentCaptivePortal is None:
-                    if self._internet():
+                    if self._externalReachable if self._externalReachable is not None else self._internet():
                         self.model.setConnectionStateText("Vous êtes connecté à internet depuis l'extérieur.")
+                        self._setState('exterior')
                     else:
                         self.model.setConnectionStateText("Vous n'êtes pas connecté à internet.")
+                        self._setState('offline')
                     self.model.setConnectedThroughCaptivePortal(False) #Utile pour que la vue soit au courant de l'état de la connexion
                     self.shouldVerifySession = True
                 elif self.currentCaptivePortal and not self._ping():
+                    if self.model.connectedThroughCaptivePortal:
+                        #Le portail vient de nous couper : la durée réelle de la session sert à prévoir les suivantes
+                        self.model.sessionLost()
                     self.model.setConnectionStateText("Vous êtes sur le réseau "+str(self.model.getCurrentSession()['captive_portal'])
                                                       +"\n(non-connecté au portail captif)"
                                                       +("\nConnexion en cours..." if self.autoManageConnection else ""))
                     self.model.setConnectedThroughCaptivePortal(False)
+                    self._setState('captive_portal_disconnected')
                     self.shouldVerifySession = True
                     if self.autoManageConnection: 
-                        self.connect()
+                        self.connect().result()
                 else:
                     if not self.model.getCurrentSession()['ID']:
-                            self.connect()
-                    elif self.shouldVerifySession:
-                        self.connect()
+                            self.connect().result()
+                    elif self.shouldVerifySession and not (self.fastStart and not portal_client.http_stack_loaded()):
+                        #En démarrage rapide, la session en cache est d'abord crue sur parole : on la vérifie au tour suivant,
+                        #une fois la pile HTTP chargée en arrière-plan
+                        self.connect().result()
                         self.shouldVerifySession = False
                     self.model.setConnectionStateText("Vous êtes connecté à internet depuis le réseau : \n"
                                                       +str(self.model.getCurrentSession()['captive_portal'])
                                                       +"\nVotre session ("+str(self.model.getCurrentSession()['ID'])+") expire à "+str(self.model.getCurrentSession()['end_time']))
                     self.model.setConnectedThroughCaptivePortal(True) #Utile pour que la vue soit au courant de l'état de la connexion
-                    if self.autoManageConnection and self.model.getCurrentSession()['end_timestamp'] - time.time() < 60:
-                        self.model.setConnectionStateText("Reconnexion automatique en cours...")
-                        self.reconnect()
-                time.sleep(1)
+                    self._setState('captive_portal_connected')
+                if 'first_state' not in startup.milestones:
+                    startup.mark('first_state')
+                    for name, seconds in startup.milestones.items():
+                        self.metrics.observe('startup_' + name, seconds)
+                self._wait_for_next_tick()
             except (KeyboardInterrupt, SystemExit):
                 break
+            except Exception:
+                #Une erreur imprévue (y compris celle d'une commande, relancée par .result()) ne doit pas arrêter la surveillance
+                traceback.print_exc()
+                self.metrics.increment('monitor_errors')
+                self._lastObservedState = None
+                self.networkMonitor.wait(self.model.MONITOR['POLL_INTERVAL'])
 
     def start_monitoring(self):
         """Activates connection state monitoring."""
         self.monitorConnectionState = True
+        self.resolver.prefetch([self.EXTERNAL_HOST[0]] + [p['DOMAIN'] for p in self.model.CAPTIVE_PORTALS.values()])
+        self.model.renewalScheduler.start(self._on_renewal_due)
+        if self.metricsServer:
+            try:
+                self.metricsServer.start()
+            except OSError:
+                self.metricsServer = None
         if not self.thread:
             self.thread = Thread(target=self.run, args=(self,))
             self.thread.daemon = True
@@ -246,9 +618,13 @@ class ConnectionManager:
     def _stop_monitoring(self):
         """Deactivates connection state monitoring. This function is not really supposed to be called at any point."""
         self.monitorConnectionState = False
+        self.model.renewalScheduler.stop()
+        self.networkMonitor.wakeup()
         if self.thread:
             self.thread.join()
             self.thread = None
+        self._setState('stopped')
+        self.leader.release()
 
     def setAutoConnectionManagement(self, bool_=None):
         """Toggles/sets automatic reconnection when the computer is disconnected from the captive portal or the session is close to expiration."""
@@ -258,22 +634,33 @@ class ConnectionManager:
             self.autoManageConnection = False
         else:
             self.autoManageConnection = True
-        dispatcher.send(signal='view_display_update', sender=self)
+        self.networkMonitor.wakeup()
+        self.model.events.publish(StateChanged('autoManageConnection', self.autoManageConnection))
 
 
 class ConnectionView:
 
-    def __init__(self, model, controller):
+    def __init__(self, model, controller, headless=False):
         self.model = model
         self.controller = controller
         self.TERM_WIDTH = 55
         self.TERM_HEIGHT = 27
         self.activeCommands = []
-        dispatcher.connect(self.display_update, signal='view_display_update', sender=dispatcher.Any)
+        self.headless = headless or self.model.DISPLAY['HEADLESS']
+        if self.headless:
+            self.renderer = HeadlessRenderer()
+        else:
+            self.renderer = TerminalRenderer(coalesce=self.model.DISPLAY['COALESCE'], max_fps=self.model.DISPLAY['MAX_FPS'])
+        self.PORTAL_STATUS_MESSAGES = {portal_client.TIMEOUT: "(Le portail captif ne répond pas à temps)",
+                                       portal_client.CONNECTION_ERROR: "(Impossible de joindre le portail captif)",
+                                       portal_client.HTTP_ERROR: "(Le portail captif a renvoyé une erreur)",
+                                       portal_client.CIRCUIT_OPEN: "(Portail captif indisponible, nouvel essai bientôt)",
+                                       portal_client.PARSE_ERROR: "(Réponse du portail captif incomprise)"}
+        self.model.events.subscribe(StateChanged, self.display_update)
 
     def _prepare_console(self):
         """Adjusts the console window's look.'"""
-        if platform.system().lower() == "windows":
+        if sys.platform == 'win32':
             _ = os.system('mode con: cols='+str(self.TERM_WIDTH)+' lines='+str(self.TERM_HEIGHT))
             _ = os.system('color F0')
             _ = os.system('title INSAConnect')
@@ -283,26 +670,29 @@ class ConnectionView:
 
     def _clear(self):
         """Clears the text in the terminal (works on Windows and Linux)."""
-        if platform.system().lower() == "windows":
+        if sys.platform == 'win32':
             _ = os.system('cls')
         else:
             print('\x1b[H\x1b[2J')
 
-    def _printConnectionStateText(self):
-        """Prints the connection state text. Makes it centered and adds separators above and below."""
+    def _connectionStateLines(self):
+        """Returns the connection state text's lines. Makes it centered and adds separators above and below."""
         separator = self._centerline("-"*33) + "\n"
         text = self.model.connectionStateText
-        print(separator)
+        lines = [separator]
         for line in text.split('\n'):
-            print(self._centerline(line))
-        print("\n" + separator)
+            lines.append(self._centerline(line))
+        lines.append("\n" + separator)
+        if self.model.portalStatus in self.PORTAL_STATUS_MESSAGES:
+            lines.append(self._centerline(self.PORTAL_STATUS_MESSAGES[self.model.portalStatus]))
+        return lines
 
     def _centerline(self, line):
         """Centers a line of text in the terminal (provided its length is lower than the terminal's width)."""
         return " "*int((self.TERM_WIDTH-len(line))/2) + line
 
-    def _displayMenu(self):
-        """Dynamically displays the menu and sets which commands are active."""
+    def _menuLines(self):
+        """Dynamically builds the menu and sets which commands are active."""
         noInternetConnection = not self.model.connectedThroughCaptivePortal and not self.controller.currentCaptivePortal
         menu = []
         if not noInternetConnection:
@@ -310,37 +700,40 @@ class ConnectionView:
             menu.append(" r: Reconnexion" if self.model.connectedThroughCaptivePortal else "")
         menu.append(" t: Désactiver la reconnexion automatique" if self.controller.autoManageConnection else " t: Activer la reconnexion automatique")
         self.activeCommands = [c[1] for c in [el for el in menu if len(el) > 2]]
-        for choice in menu:
-            print(choice)
+        return menu
 
-    def display_update(self, sender):
+    def display_update(self, event):
         """Just updates the view"""
         self._display()
 
-    def _display(self, messageTemporaire="", menu=True):
-        """Displays/refreshes the view as text in the console."""
-        self._clear()
-        print("\n"*4)
-        print(self._centerline("   ___ _   _ ____    _ ***                   \n")+
-              self._centerline("  |_ _| \ | / ___|  / \ ** INSTITUT NATIONAL \n")+
-              self._centerline("   | ||  \| \___ \ / _ \ * DES SCIENCES      \n")+
-              self._centerline("   | || |\  |___) / ___ \  APPLIQUEES        \n")+
-              self._centerline("  |___|_| \_|____/_/   \_\ TOULOUSE          \n")+
-              self._centerline("                                             \n"))
-        print("\n")
-        self._printConnectionStateText()
-        print("\n"*2)
+    def _frame(self, messageTemporaire="", menu=True):
+        """Builds the view as a list of terminal lines."""
+        out = ["\n"*4]
+        out.append(self._centerline("   ___ _   _ ____    _ ***                   \n")+
+                   self._centerline("  |_ _| \ | / ___|  / \ ** INSTITUT NATIONAL \n")+
+                   self._centerline("   | ||  \| \___ \ / _ \ * DES SCIENCES      \n")+
+                   self._centerline("   | || |\  |___) / ___ \  APPLIQUEES        \n")+
+                   self._centerline("  |___|_| \_|____/_/   \_\ TOULOUSE          \n")+
+                   self._centerline("                                             \n"))
+        out.append("\n")
+        out += self._connectionStateLines()
+        out.append("\n"*2)
         if menu:
-            self._displayMenu()
+            out += self._menuLines()
         elif not messageTemporaire:
-            print("\n"*2)
+            out.append("\n"*2)
         if messageTemporaire:
-            print(messageTemporaire)
+            out.append(messageTemporaire)
+        return "\n".join(out).split("\n")
+
+    def _display(self, messageTemporaire="", menu=True):
+        """Displays/refreshes the view as text in the console (only the lines that changed are redrawn)."""
+        self.renderer.submit(partial(self._frame, messageTemporaire, menu))
 
     def run(self):
         """This is the function you need to call to run the view indefinitely."""
         self._prepare_console()
-        self._display(menu=False)
+        self.renderer.submit(partial(self._frame, menu=False), full=True)
         self._listen_input()
 
     def _listen_input(self):
@@ -366,16 +759,121 @@ class ConnectionView:
                 self._display(messageTemporaire=inputCommand[1]+"\n"*2, menu=False)
                 if justDisplayMessage:
                     time.sleep(0.5)
-                inputCommand[0]()
+                future = inputCommand[0]()
                 if justDisplayMessage:
                     self._display()
                 else:
                     self._display(messageTemporaire=inputCommand[1]+"\n"*2, menu=False)
+                    #Les opérations sur le portail captif tournent en arrière-plan, on réaffiche le menu quand elles sont terminées
+                    future.add_done_callback(lambda f: self._display())
             except (KeyboardInterrupt, SystemExit):
                 break
 
 
+def _report_startup_timing(timeout=30):
+    """Writes the startup milestones to stderr once the first connection state is known."""
+    deadline = time.monotonic() + timeout
+    while 'first_state' not in startup.milestones and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sys.stderr.write(startup.report() + '\n')
+    sys.stderr.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Se connecte automatiquement au portail captif de l'INSA Toulouse.")
+    parser.add_argument('--daemon', action='store_true', help="lance la surveillance sans interface, pilotable par un socket UNIX")
+    parser.add_argument('--client', action='store_true', help="affiche l'interface d'un démon déjà lancé")
+    parser.add_argument('--standalone', action='store_true', help="lance la surveillance et l'interface dans ce processus")
+    parser.add_argument('--socket', default=None, help="chemin du socket de contrôle du démon")
+    parser.add_argument('--record', metavar='TRACE', default=None, help="enregistre les sondes et les échanges avec le portail dans TRACE")
+    parser.add_argument('--replay', metavar='TRACE', default=None, help="rejoue TRACE en temps virtuel et affiche un résumé")
+    parser.add_argument('--fast-start', action='store_true',
+                        help="démarrage rapide (lancement par un hook de connexion) : sonde tout de suite, la pile HTTP se charge en arrière-plan")
+    parser.add_argument('--startup-timing', action='store_true', help="affiche la durée de chaque étape du démarrage sur la sortie d'erreur")
+    subparsers = parser.add_subparsers(dest='command')
+    summaryParser = subparsers.add_parser('summary', help="résume l'historique de la connexion (disponibilité, coupures, renouvellements)")
+    summaryParser.add_argument('--since', default='7d', help="début de la période : durée (90m, 24h, 7d) ou date (2016-10-17 08:30)")
+    summaryParser.add_argument('--until', default=None, help="fin de la période (maintenant par défaut)")
+    summaryParser.add_argument('--interface', default=None, help="historique de cette interface (voir la section [Interfaces] du fichier INI)")
+    subparsers.add_parser('lifetimes', help="durée réelle des sessions de chaque portail captif, prévue et constatée")
+    args = parser.parse_args()
+
+    if args.command == 'lifetimes':
+        settings = ConnectionModel.settings()
+        lifetimes = settings._lifetime_estimator()
+        for captive_portal, portal in settings.CAPTIVE_PORTALS.items():
+            if lifetimes:
+                lifetime.print_report(lifetimes.report(captive_portal, portal['TIMEOUT']))
+            else:
+                print(captive_portal + " : durée du fichier INI, " + str(portal['TIMEOUT']) + " s (apprentissage désactivé)")
+        return
+
+    if args.command == 'summary':
+        settings = ConnectionModel.settings(interface=args.interface)
+        if not settings.HISTORY['ENABLED']:
+            print("L'historique est désactivé dans INSAConnect.ini.")
+            return
+        now = time.time()
+        until = history.parse_when(args.until, now) if args.until else now
+        reader = history.HistoryReader(settings.HISTORY_DIRECTORY, settings.HISTORY_BASENAME)
+        #Un silence de plus de deux battements : le programme ne tournait plus
+        history.print_summary(history.summarize(reader, history.parse_when(args.since, until), until, max_silence=2 * settings.HISTORY['HEARTBEAT']))
+        return
+    if args.fast_start:
+        portal_client.preload_http_stack()
+    if args.startup_timing:
+        Thread(target=_report_startup_timing, daemon=True).start()
+    if args.replay:
+        import replay
+        replay.print_report(replay.Player(args.replay).replay(ConnectionModel, ConnectionManager))
+        return
+    recorder = None
+    if args.record:
+        import replay
+    import links
+    import daemon
+    #Avec des interfaces dans le fichier INI, chacune est surveillée séparément, avec sa propre session
+    interfaceNames = links.monitored_interfaces()
+    if args.daemon:
+        if interfaceNames:
+            cm = links.MultiLinkManager(interfaceNames, ConnectionModel, ConnectionManager, fastStart=args.fast_start)
+        else:
+            cm = ConnectionManager(headless=True, fastStart=args.fast_start)
+        settings = getattr(cm, 'primary', cm).model.DAEMON
+        try:
+            server = daemon.ControlServer(cm, args.socket, mode=settings['SOCKET_MODE'], group=settings['SOCKET_GROUP'] or None)
+        except (OSError, KeyError) as e:
+            #Avant de lancer la surveillance : un démon sans socket ne serait pilotable par personne
+            sys.exit("Impossible d'ouvrir le socket de contrôle : " + str(e))
+        if args.record:
+            recorder = replay.Recorder(args.record)
+            #Une trace ne suit qu'un lien : celui de la première interface
+            recorder.attach(getattr(cm, 'primary', cm))
+        cm.start_monitoring()
+        try:
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            server.server_close()
+    elif args.client or (not args.standalone and daemon.is_daemon_running(args.socket)):
+        #Un démon tourne déjà : cette interface n'est qu'un client, elle ne surveille rien elle-même
+        model = daemon.RemoteModel(args.socket)
+        ConnectionView(model, daemon.RemoteController(model)).run()
+    else:
+        if interfaceNames:
+            cm = links.MultiLinkManager(interfaceNames, ConnectionModel, ConnectionManager, fastStart=args.fast_start)
+            view = ConnectionView(cm.model, cm)
+        else:
+            cm = ConnectionManager(fastStart=args.fast_start)
+            view = cm.view
+        if args.record:
+            recorder = replay.Recorder(args.record)
+            recorder.attach(getattr(cm, 'primary', cm))
+        cm.start_monitoring()
+        view.run()
+    if recorder:
+        recorder.close()
+
 if __name__ == "__main__":
-    cm = ConnectionManager()
-    cm.start_monitoring()
-    cm.view.run()
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the cost of publishing an event on the EventBus (and on pydispatch, if it is installed, for comparison).
+
+Usage: python bench_eventbus.py [--events 100000] [--subscribers 1]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eventbus import EventBus, StateChanged
+
+
+def bench_eventbus(events, subscribers):
+    bus = EventBus()
+    for _ in range(subscribers):
+        bus.subscribe(StateChanged, lambda event: None)
+    start = time.perf_counter()
+    for i in range(events):
+        bus.publish(StateChanged('connectionStateText', i))
+    return (time.perf_counter() - start) / events
+
+
+def bench_pydispatch(events, subscribers):
+    try:
+        from pydispatch import dispatcher
+    except ImportError:
+        return None
+
+    class Receiver:
+        def display_update(self, sender):
+            pass
+
+    receivers = [Receiver() for _ in range(subscribers)]
+    for receiver in receivers:
+        dispatcher.connect(receiver.display_update, signal='view_display_update', sender=dispatcher.Any)
+    sender = object()
+    start = time.perf_counter()
+    for _ in range(events):
+        dispatcher.send(signal='view_display_update', sender=sender)
+    return (time.perf_counter() - start) / events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--subscribers', type=int, default=1)
+    args = parser.parse_args()
+    for name, bench in (('eventbus', bench_eventbus), ('pydispatch', bench_pydispatch)):
+        perEvent = bench(args.events, args.subscribers)
+        print('%-12s %s' % (name, 'not installed' if perEvent is None else '%.2f µs/event' % (perEvent * 1e6)))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local stand-in for the INSA captive portal, so that INSAConnect can be measured without being on campus.
+
+It speaks the same form protocol as the real portal:
+    - POST auth_user/auth_pass/accept -> page with <input name="logout_id" type="hidden" value="..." /> (or 'erreur')
+    - POST logout_id                  -> ends the session
+    - GET /generate_204               -> 204 while a session is active, 302 to the portal otherwise
+Admin endpoints (used by the benchmark harness):
+    - POST /_admin/expire             -> forces every session to expire now
+    - GET  /_admin/stats              -> JSON log of logins, logouts and expiries
+
+Usage: python fake_portal.py [--port 8003] [--latency 0.05] [--error-rate 0.1] [--session-timeout 21600]
+                             [--page-padding 200000 --trickle-rate 100000] [--cert c.pem --key k.pem]
+"""
+
+import argparse
+import json
+import random
+import ssl
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+LOGIN_PAGE = '''<html><body>
+<form method="post" action="/">
+<input name="logout_id" type="hidden" value="%s" />
+<input name="logout" type="submit" value="Logout" />
+</form>
+%s
+</body></html>'''
+
+ERROR_PAGE = '<html><body><p>Une erreur est survenue : identifiants invalides.</p></body></html>'
+
+
+class FakePortal:
+    """State of the fake portal: at most one active session (the benchmark runs a single client)."""
+
+    def __init__(self, login='login', password='pass', latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                 session_timeout=21600, page_padding=0, trickle_rate=0):
+        self.login = login
+        self.password = password
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.session_timeout = session_timeout
+        self.page_padding = page_padding
+        self.trickle_rate = trickle_rate
+        self.sessionID = None
+        self.sessionEnd = 0
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _log(self, event, **kwargs):
+        kwargs.update(event=event, time=time.time())
+        self.events.append(kwargs)
+
+    def is_connected(self):
+        with self._lock:
+            if self.sessionID and time.time() >= self.sessionEnd:
+                self._log('expired', logout_id=self.sessionID)
+                self.sessionID = None
+            return self.sessionID is not None
+
+    def handle_form(self, form):
+        """Returns (HTTP status, body) for a POST of the portal form."""
+        if 'logout_id' in form:
+            with self._lock:
+                if self.sessionID and form['logout_id'][0] == self.sessionID:
+                    self._log('logout', logout_id=self.sessionID)
+                    self.sessionID = None
+            return 200, '<html><body>Déconnecté.</body></html>'
+        if form.get('auth_user', [''])[0] != self.login or form.get('auth_pass', [''])[0] != self.password:
+            self._log('auth_error')
+            return 200, ERROR_PAGE
+        with self._lock:
+            if not self.sessionID or time.time() >= self.sessionEnd:
+                self.sessionID = uuid.uuid4().hex[:16]
+                self.sessionEnd = time.time() + self.session_timeout
+                self._log('login', logout_id=self.sessionID)
+            return 200, LOGIN_PAGE % (self.sessionID, ' ' * self.page_padding)
+
+    def expire(self):
+        with self._lock:
+            if self.sessionID:
+                self._log('expired', logout_id=self.sessionID, forced=True)
+            self.sessionID = None
+
+    def delay(self):
+        if self.latency or self.latency_jitter:
+            time.sleep(max(0, self.latency + random.uniform(-self.latency_jitter, self.latency_jitter)))
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+
+def make_handler(portal):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status, body='', contentType='text/html; charset=utf-8', headers=()):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', contentType)
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            if not portal.trickle_rate:
+                self.wfile.write(data)
+                return
+            # Portail saturé : le début de la page arrive tout de suite, la suite au débit trickle_rate
+            self.wfile.write(data[:512])
+            for offset in range(512, len(data), 4096):
+                self.wfile.flush()
+                time.sleep(4096 / portal.trickle_rate)
+                self.wfile.write(data[offset:offset + 4096])
+
+        def do_HEAD(self):
+            self._reply(200)
+
+        def do_GET(self):
+            if self.path == '/generate_204':
+                if portal.is_connected():
+                    self._reply(204)
+                else:
+                    self._reply(302, headers=[('Location', '/')])
+            elif self.path == '/_admin/stats':
+                self._reply(200, json.dumps({'events': portal.events, 'connected': portal.is_connected()}), 'application/json')
+            else:
+                self._reply(200, '<html><body>Portail captif</body></html>')
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            if self.path == '/_admin/expire':
+                portal.expire()
+                self._reply(200, 'ok', 'text/plain')
+                return
+            portal.delay()
+            if portal.should_fail():
+                self._reply(503, 'Service Unavailable', 'text/plain')
+                return
+            self._reply(*portal.handle_form(form))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class FakePortalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Les sondes ferment la connexion dès qu'elles ont lu le code de statut
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(portal, host='127.0.0.1', port=0, certfile=None, keyfile=None):
+    """Starts the fake portal in a background thread. Returns the server (server.server_port is the actual port)."""
+    server = FakePortalServer((host, port), make_handler(portal))
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--login', default='login')
+    parser.add_argument('--password', default='pass')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every portal POST')
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of answering 503')
+    parser.add_argument('--session-timeout', type=float, default=21600)
+    parser.add_argument('--page-padding', type=int, default=0, help='bytes appended after the logout_id field')
+    parser.add_argument('--trickle-rate', type=float, default=0, help='bytes/s at which the page is sent after its first 512 bytes (0: at once)')
+    parser.add_argument('--cert')
+    parser.add_argument('--key')
+    args = parser.parse_args()
+    portal = FakePortal(args.login, args.password, args.latency, args.latency_jitter, args.error_rate,
+                        args.session_timeout, args.page_padding, args.trickle_rate)
+    server = serve(portal, args.host, args.port, args.cert, args.key)
+    print(server.server_port, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Drives ConnectionManager against the local fake portal and reports its performance.
+
+Measured:
+    - time to first connect (monitor start -> connected through the portal)
+    - detection latency (_detect_captive_portal durations)
+    - renewal offline gap, as seen by the client (model.renewalGaps) and by the portal (logout -> login)
+    - recovery after a forced expiry (portal drops the session -> new login)
+    - CPU seconds per hour of steady-state monitoring
+
+Usage: python run_benchmark.py [--session-timeout 20] [--renewals 2] [--steady 30] [--latency 0.02]
+                               [--output result.json] [--baseline baseline.json]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.dirname(HERE)
+
+INI_TEMPLATE = """[DEFAULT]
+login = login
+pass = pass
+
+[Monitor]
+mode = {mode}
+poll_interval = 1
+max_poll_interval = {max_poll_interval}
+
+[Probes]
+external_host = 127.0.0.1
+external_port = 9
+reachability_methods = http
+reachability_urls = {url}generate_204
+reachability_timeout = 0.5
+
+[Renewal]
+lead = {lead}
+jitter = 1
+prewarm_lead = 2
+
+[Captive_portal:BENCH]
+url = {url}
+domain = 127.0.0.1
+port = {port}
+timeout = {session_timeout}
+"""
+
+
+def load_insaconnect():
+    """Imports INSAConnect_v1.0.py (its name isn't a valid module name)."""
+    sys.path.insert(0, SOURCE_DIR)
+    spec = importlib.util.spec_from_file_location('insaconnect', os.path.join(SOURCE_DIR, 'INSAConnect_v1.0.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def wait_for(predicate, timeout, step=0.01):
+    """Polls predicate until it's true. Returns the time it took, or None on timeout."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if predicate():
+            return time.perf_counter() - start
+        time.sleep(step)
+    return None
+
+
+def histogram_summary(histogram):
+    """Mean and approximate p50/p95 (upper bucket bounds) of a metrics.Histogram."""
+    if histogram is None or not histogram.count:
+        return None
+    summary = {'count': histogram.count, 'mean': histogram.sum / histogram.count}
+    for name, q in (('p50', 0.5), ('p95', 0.95)):
+        summary[name] = next(bound for bound, count in histogram.cumulative_counts() if count >= q * histogram.count)
+    return summary
+
+
+class PortalProcess:
+    """Runs fake_portal.py in a subprocess, so that its CPU time isn't charged to the client."""
+
+    def __init__(self, args):
+        command = [sys.executable, os.path.join(HERE, 'fake_portal.py'), '--port', '0',
+                   '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+                   '--session-timeout', str(args.session_timeout),
+                   '--page-padding', str(args.page_padding), '--trickle-rate', str(args.trickle_rate)]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+        self.port = int(self.process.stdout.readline())
+        self.url = 'http://127.0.0.1:%d/' % self.port
+
+    def stats(self):
+        with urllib.request.urlopen(self.url + '_admin/stats') as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def expire(self):
+        urllib.request.urlopen(urllib.request.Request(self.url + '_admin/expire', data=b'', method='POST')).close()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def portal_gaps(events):
+    """Offline gaps seen by the portal: each logout (or expiry) followed by the next login."""
+    gaps, offlineSince = [], None
+    for event in events:
+        if event['event'] in ('logout', 'expired'):
+            offlineSince = event['time']
+        elif event['event'] == 'login' and offlineSince is not None:
+            gaps.append(event['time'] - offlineSince)
+            offlineSince = None
+    return gaps
+
+
+def run(args):
+    result = {'config': vars(args).copy()}
+    result['config'].pop('output', None)
+    result['config'].pop('baseline', None)
+    with tempfile.TemporaryDirectory(prefix='insaconnect-bench-', ignore_cleanup_errors=True) as workdir:
+        portal = PortalProcess(args)
+        previousTempdir, previousDirectory = tempfile.tempdir, os.getcwd()
+        tempfile.tempdir = workdir  # Fichier de session isolé de celui de l'utilisateur
+        try:
+            with open(os.path.join(workdir, 'INSAConnect.ini'), 'w') as file:
+                file.write(INI_TEMPLATE.format(url=portal.url, port=portal.port, session_timeout=args.session_timeout,
+                                               lead=args.lead, mode=args.mode, max_poll_interval=args.max_poll_interval))
+            os.chdir(workdir)
+            insaconnect = load_insaconnect()
+            with contextlib.redirect_stdout(io.StringIO()):
+                cm = insaconnect.ConnectionManager()
+                cm.start_monitoring()
+                result['time_to_first_connect'] = wait_for(lambda: cm.model.connectedThroughCaptivePortal, 30)
+
+                # Renouvellements programmés
+                renewalTimeout = args.session_timeout * (args.renewals + 1)
+                wait_for(lambda: len([e for e in portal.stats()['events'] if e['event'] == 'logout']) >= args.renewals,
+                         renewalTimeout, step=0.5)
+                wait_for(lambda: portal.stats()['connected'], 10)
+                result['renewal_gap_client'] = [gap for _, gap in cm.model.renewalGaps]
+                result['renewal_gap_portal'] = portal_gaps(portal.stats()['events'])
+
+                # Expiration forcée par le portail
+                portal.expire()
+                loginsBefore = len([e for e in portal.stats()['events'] if e['event'] == 'login'])
+                result['recovery_after_forced_expiry'] = wait_for(
+                    lambda: len([e for e in portal.stats()['events'] if e['event'] == 'login']) > loginsBefore, 60, step=0.05)
+
+                # Régime établi
+                wait_for(lambda: cm.model.connectedThroughCaptivePortal, 10)
+                cpuStart, wallStart = time.process_time(), time.perf_counter()
+                time.sleep(args.steady)
+                cpu, wall = time.process_time() - cpuStart, time.perf_counter() - wallStart
+                result['cpu_seconds_per_hour'] = cpu / wall * 3600
+
+                result['detection_latency'] = histogram_summary(cm.metrics.histograms.get('detect_captive_portal'))
+                result['connect_latency'] = histogram_summary(cm.metrics.histograms.get('connect'))
+                result['reconnect_latency'] = histogram_summary(cm.metrics.histograms.get('reconnect'))
+                cm._stop_monitoring()
+        finally:
+            os.chdir(previousDirectory)
+            tempfile.tempdir = previousTempdir
+            portal.stop()
+    return result
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def headline(result):
+    """Flattens a result into the numbers compared against a baseline (lower is better)."""
+    return {'time_to_first_connect': result.get('time_to_first_connect'),
+            'detection_latency_mean': (result.get('detection_latency') or {}).get('mean'),
+            'renewal_gap_client_mean': _mean(result.get('renewal_gap_client', [])),
+            'renewal_gap_portal_mean': _mean(result.get('renewal_gap_portal', [])),
+            'recovery_after_forced_expiry': result.get('recovery_after_forced_expiry'),
+            'cpu_seconds_per_hour': result.get('cpu_seconds_per_hour')}
+
+
+def print_report(result, baseline=None):
+    current = headline(result)
+    reference = headline(baseline) if baseline else {}
+    print('%-32s %14s %14s %9s' % ('metric', 'value', 'baseline', 'delta'))
+    for name, value in current.items():
+        base = reference.get(name)
+        delta = '%+.1f%%' % ((value - base) / base * 100) if value is not None and base else ''
+        print('%-32s %14s %14s %9s' % (name, '-' if value is None else '%.4f' % value,
+                                       '' if base is None else '%.4f' % base, delta))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--session-timeout', type=int, default=20, help='portal session lifetime in seconds')
+    parser.add_argument('--lead', type=float, default=5, help='renewal lead time in seconds')
+    parser.add_argument('--renewals', type=int, default=2)
+    parser.add_argument('--steady', type=float, default=30, help='seconds of steady-state monitoring for the CPU measure')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--page-padding', type=int, default=0, help='bytes appended to the login page after the logout_id field')
+    parser.add_argument('--trickle-rate', type=float, default=0, help='bytes/s at which the portal sends the login page (0: at once)')
+    parser.add_argument('--mode', default='netlink', choices=['netlink', 'poll'])
+    parser.add_argument('--max-poll-interval', type=float, default=15)
+    parser.add_argument('--output', help='writes the result as JSON')
+    parser.add_argument('--baseline', help='JSON result of a previous run to compare with')
+    args = parser.parse_args()
+
+    result = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Clocks injected into the model, the manager and the scheduler, so that a recorded trace can be replayed in virtual time (see replay.py)."""
+
+import threading
+import time as _time
+
+
+class SystemClock:
+    """The real clock."""
+
+    virtual = False
+    time = staticmethod(_time.time)
+    monotonic = staticmethod(_time.monotonic)
+    sleep = staticmethod(_time.sleep)
+
+
+class VirtualClock:
+    """Clock that only moves when told to: sleep() and advance() return immediately, after moving the time forward.
+
+    time() and monotonic() give the same virtual timestamp, so days of monitoring take as long as the code that runs in between.
+    Code that would otherwise run in a thread of its own runs inline when virtual is True, so that a replay stays deterministic.
+    """
+
+    virtual = True
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    monotonic = time
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += max(0.0, seconds)
+            return self._now
+
+    def advance_to(self, timestamp):
+        """Moves the time forward to timestamp (never backwards)."""
+        with self._lock:
+            self._now = max(self._now, timestamp)
+            return self._now
+
+    sleep = advance
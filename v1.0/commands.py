@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Serialized command queue for the captive portal operations, shared by the view and the monitor."""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from clock import SystemClock
+
+
+class CommandQueue:
+    """Runs the submitted operations one at a time, on a single worker thread.
+
+    Single-flight: submitting an operation while an identical one (same name and arguments: a login on another portal
+    is another operation) is queued or running doesn't start a new one, the caller gets the future of the existing one. Callers can wait on the future or attach callbacks.
+    Operations must not submit to the queue and wait for the result themselves (that would deadlock).
+    Under a virtual clock (replay) no thread is started: the operations run in the caller's thread, before submit() returns.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
+        self._executor = None if self.clock.virtual else ThreadPoolExecutor(max_workers=1, thread_name_prefix='portal-command')
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, function, *args, **kwargs):
+        """Queues function(*args, **kwargs) under name and returns its Future. The arguments must be hashable."""
+        if self._executor is None:
+            return _run_inline(function, args, kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None and not future.done():
+                return future
+            future = self._executor.submit(function, *args, **kwargs)
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def _run_inline(function, args, kwargs):
+    """Runs function(*args, **kwargs) now and returns its (done) Future."""
+    future = Future()
+    future.set_running_or_notify_cancel()
+    try:
+        future.set_result(function(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Control socket of the headless daemon, and the thin clients that talk to it.
+
+One daemon runs the monitor; the terminal view and scripts connect to its UNIX-domain socket.
+The protocol is one JSON object per line:
+    -> {"command": "status"}                      <- {"ok": true, "status": {...}}
+    -> {"command": "connect"}                     (also "disconnect", "reconnect")
+    -> {"command": "set_auto", "value": true}     (or "toggle_auto")
+    -> {"command": "subscribe"}                   <- {"ok": true, "status": {...}}, then {"event": "state", "status": {...}} on every change
+The socket lives in the user's private directory, and a client only talks to a daemon run by the same user (or root).
+"""
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from eventbus import EventBus, StateChanged
+from leader import private_directory
+
+try:
+    import grp
+except ImportError:
+    grp = None
+
+
+def default_socket_path():
+    return os.path.join(private_directory(), 'INSAConnect.sock')
+
+
+def _trusted_uid(uid):
+    return uid == os.geteuid() or uid == 0
+
+
+def connect(path, timeout):
+    """Socket connected to the daemon at path. Raises PermissionError if the daemon isn't the user's (or root's):
+        anyone could otherwise listen on a path the user is about to connect to and show or swallow their commands.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        if hasattr(os, 'geteuid'):
+            if hasattr(socket, 'SO_PEERCRED'):
+                _, uid, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+            else:
+                uid = os.stat(path).st_uid
+            if not _trusted_uid(uid):
+                raise PermissionError("Le socket " + path + " appartient à un autre utilisateur")
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+def group_id(group):
+    """gid of group, a name or a number. Raises KeyError for an unknown group."""
+    if str(group).isdigit():
+        return int(group)
+    if grp is None:
+        raise KeyError("groupe inconnu : " + group)
+    return grp.getgrnam(group).gr_gid
+
+
+def manager_status(manager):
+    """Snapshot of everything a client needs to display the state."""
+    session = dict(manager.model.currentSession)
+    if session['end_timestamp'] == float('inf'):
+        session['end_timestamp'] = session['end_time'] = None
+    return {'connectionStateText': manager.model.connectionStateText,
+            'connectedThroughCaptivePortal': manager.model.connectedThroughCaptivePortal,
+            'currentCaptivePortal': manager.currentCaptivePortal,
+            'autoManageConnection': manager.autoManageConnection,
+            'portalStatus': manager.model.portalStatus,
+            'session': session}
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.writeLock = threading.Lock()
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                response = self.server.execute(request, self)
+            except Exception as e:
+                #Requête invalide ou commande en échec : le client garde sa connexion
+                response = {'ok': False, 'error': str(e) or e.__class__.__name__}
+            if not self.send(response):
+                break
+        self.server.unsubscribe(self)
+
+    def send(self, message):
+        try:
+            with self.writeLock:
+                self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+                self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """UNIX-domain socket API of the daemon. Every client shares the daemon's single monitor."""
+
+    daemon_threads = True
+
+    def __init__(self, manager, path=None, mode=0o600, group=None, timeout=30):
+        self.manager = manager
+        self.path = path or default_socket_path()
+        self.commandTimeout = timeout
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            if is_daemon_running(self.path):
+                raise OSError("Un démon INSAConnect tourne déjà sur " + self.path)
+            if hasattr(os, 'geteuid') and not _trusted_uid(os.lstat(self.path).st_uid):
+                raise PermissionError(self.path + " appartient à un autre utilisateur : choisir un autre chemin (--socket)")
+            os.unlink(self.path)
+        #Créé sous un umask strict (accès du seul propriétaire), le socket n'est ouvert au groupe qu'une fois ce groupe attribué
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.path, ControlHandler)
+        finally:
+            os.umask(umask)
+        try:
+            if group:
+                os.chown(self.path, -1, group_id(group))
+            os.chmod(self.path, mode)
+        except (OSError, KeyError):
+            self.server_close()
+            raise
+        manager.model.events.subscribe(StateChanged, self._broadcast, queued=True)
+
+    def execute(self, request, handler):
+        command = request['command']
+        if command == 'status':
+            pass
+        elif command in ('connect', 'disconnect', 'reconnect'):
+            try:
+                getattr(self.manager, command)().result(self.commandTimeout)
+            except FutureTimeoutError:
+                # La commande continue en arrière-plan : le client garde sa connexion et peut suivre la suite
+                return {'ok': False, 'error': 'timeout', 'status': manager_status(self.manager)}
+        elif command == 'toggle_auto':
+            self.manager.setAutoConnectionManagement()
+        elif command == 'set_auto':
+            self.manager.setAutoConnectionManagement(bool(request['value']))
+        elif command == 'subscribe':
+            with self._lock:
+                self._subscribers.add(handler)
+        else:
+            return {'ok': False, 'error': 'unknown command: ' + str(command)}
+        return {'ok': True, 'status': manager_status(self.manager)}
+
+    def unsubscribe(self, handler):
+        with self._lock:
+            self._subscribers.discard(handler)
+
+    def _broadcast(self, event):
+        message = {'event': 'state', 'status': manager_status(self.manager)}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for handler in subscribers:
+            if not handler.send(message):
+                self.unsubscribe(handler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def send_command(command, path=None, timeout=35, **kwargs):
+    """Sends one command to the daemon and returns its response (for scripts)."""
+    with connect(path or default_socket_path(), timeout) as sock:
+        request = dict(kwargs, command=command)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as stream:
+            return json.loads(stream.readline().decode('utf-8'))
+
+
+def is_daemon_running(path=None):
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    try:
+        return send_command('status', path, timeout=1).get('ok', False)
+    except (OSError, ValueError):
+        return False
+
+
+class RemoteModel:
+    """Stands in for ConnectionModel in a thin client: mirrors the daemon's state through a subscription."""
+
+    def __init__(self, path=None):
+        self.path = path or default_socket_path()
+        self.events = EventBus()
+        self.DISPLAY = dict(HEADLESS=False, COALESCE=0.05, MAX_FPS=10)
+        self.connectionStateText = "Bonjour !\n\nConnexion au service INSAConnect..."
+        self.connectedThroughCaptivePortal = False
+        self.portalStatus = 'ok'
+        self.currentSession = {'captive_portal': None, 'ID': None, 'end_timestamp': None, 'end_time': None}
+        self.controller = None
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    def _apply(self, status):
+        self.connectedThroughCaptivePortal = status['connectedThroughCaptivePortal']
+        self.portalStatus = status['portalStatus']
+        self.currentSession = status['session']
+        if self.controller is not None:
+            self.controller.currentCaptivePortal = status['currentCaptivePortal']
+            self.controller.autoManageConnection = status['autoManageConnection']
+        self.connectionStateText = status['connectionStateText']
+        self.events.publish(StateChanged('connectionStateText', self.connectionStateText))
+
+    def _follow(self):
+        """Keeps a subscription open to the daemon, and reopens it if the daemon restarts."""
+        while True:
+            try:
+                with connect(self.path, None) as sock:
+                    sock.sendall(b'{"command": "subscribe"}\n')
+                    with sock.makefile('rb') as stream:
+                        for line in stream:
+                            self._apply(json.loads(line.decode('utf-8'))['status'])
+            except (OSError, ValueError, KeyError):
+                pass
+            if self.connectionStateText != "Le service INSAConnect est injoignable.":
+                self.connectionStateText = "Le service INSAConnect est injoignable."
+                self.events.publish(StateChanged('connectionStateText', self.connectionStateText))
+            time.sleep(1)
+
+
+class RemoteController:
+    """Stands in for ConnectionManager in a thin client: forwards the commands to the daemon."""
+
+    def __init__(self, model):
+        self.model = model
+        model.controller = self
+        self.currentCaptivePortal = None
+        self.autoManageConnection = True
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='daemon-command')
+
+    def _submit(self, command, **kwargs):
+        return self._executor.submit(send_command, command, self.model.path, **kwargs)
+
+    def connect(self):
+        return self._submit('connect')
+
+    def disconnect(self):
+        return self._submit('disconnect')
+
+    def reconnect(self):
+        return self._submit('reconnect')
+
+    def setAutoConnectionManagement(self, bool_=None):
+        # Mise à jour locale immédiate pour que le menu reflète le choix sans attendre le démon
+        self.autoManageConnection = (not self.autoManageConnection) if bool_ is None else bool_
+        return self._submit('set_auto', value=self.autoManageConnection)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Small typed in-process event bus between the model, the controller and their subscribers (view, metrics, logs...)."""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+
+class Event:
+    """Base class of the events. Subscribing to Event receives every event."""
+    __slots__ = ()
+
+
+class StateChanged(collections.namedtuple('StateChanged', ['name', 'value']), Event):
+    """An attribute of the model or controller that the view displays has changed."""
+    __slots__ = ()
+
+
+class SessionRenewed(collections.namedtuple('SessionRenewed', ['captive_portal', 'ID', 'end_timestamp']), Event):
+    """A new captive portal session has been obtained."""
+    __slots__ = ()
+
+
+class ProbeCompleted(collections.namedtuple('ProbeCompleted', ['captive_portal', 'results']), Event):
+    """A detection round is over: the detected portal (or None) and the ProbeResult of every target."""
+    __slots__ = ()
+
+
+class Subscription:
+    __slots__ = ('handler', 'eventType', 'queued', 'debounce', 'batch', 'pending', 'deadline', 'active')
+
+    def __init__(self, handler, eventType, queued, debounce, batch):
+        self.handler = handler
+        self.eventType = eventType
+        self.queued = queued
+        self.debounce = debounce
+        self.batch = batch
+        self.pending = []
+        self.deadline = None
+        self.active = True
+
+
+class EventBus:
+    """Delivers published events to the subscribers of their type (or of a parent type).
+
+    Delivery modes, chosen per subscription:
+        - synchronous (default): the handler runs in the publisher's thread, before publish() returns
+        - queued: the handler runs in the bus thread, in publication order
+        - debounce=s: the handler gets the last event once no event came for s seconds
+        - batch=s: the handler gets the list of the events published during the s seconds after the first one
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._queue = collections.deque()
+        self._timers = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def subscribe(self, eventType, handler, queued=False, debounce=None, batch=None):
+        """Registers handler for eventType and returns the subscription (see unsubscribe)."""
+        subscription = Subscription(handler, eventType, queued or bool(debounce or batch), debounce, batch)
+        with self._condition:
+            subscriptions = dict(self._subscriptions)
+            subscriptions[eventType] = subscriptions.get(eventType, ()) + (subscription,)
+            self._subscriptions = subscriptions  # Copie à l'écriture : publish() lit sans verrou
+            if subscription.queued and self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._condition:
+            subscription.active = False
+            subscriptions = dict(self._subscriptions)
+            subscriptions[subscription.eventType] = tuple(s for s in subscriptions.get(subscription.eventType, ()) if s is not subscription)
+            self._subscriptions = subscriptions
+
+    def publish(self, event):
+        """Sends event to its subscribers."""
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+        for eventType in type(event).__mro__:
+            for subscription in subscriptions.get(eventType, ()):
+                if not subscription.queued:
+                    subscription.handler(event)
+                else:
+                    self._enqueue(subscription, event)
+
+    def _enqueue(self, subscription, event):
+        with self._condition:
+            if subscription.debounce:
+                subscription.pending = [event]
+                subscription.deadline = time.monotonic() + subscription.debounce
+                heapq.heappush(self._timers, (subscription.deadline, next(self._counter), subscription))
+            elif subscription.batch:
+                subscription.pending.append(event)
+                if subscription.deadline is None:
+                    subscription.deadline = time.monotonic() + subscription.batch
+                    heapq.heappush(self._timers, (subscription.deadline, next(self._counter), subscription))
+            else:
+                self._queue.append((subscription, event))
+            self._condition.notify()
+
+    def _next_delivery(self):
+        """Waits for the next delivery and returns (handler, argument)."""
+        with self._condition:
+            while True:
+                if self._queue:
+                    subscription, event = self._queue.popleft()
+                    if subscription.active:
+                        return subscription.handler, event
+                    continue
+                timeout = None
+                while self._timers:
+                    deadline, _, subscription = self._timers[0]
+                    if deadline != subscription.deadline or not subscription.active:
+                        heapq.heappop(self._timers)  # Timer remplacé par un plus récent
+                        continue
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        heapq.heappop(self._timers)
+                        pending, subscription.pending, subscription.deadline = subscription.pending, [], None
+                        return subscription.handler, (pending if subscription.batch else pending[-1])
+                    break
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            handler, argument = self._next_delivery()
+            try:
+                handler(argument)
+            except Exception:
+                pass
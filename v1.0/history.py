@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Append-only history of connection states, sessions and renewals, and the summaries computed from it.
+
+The log is a series of segment files of fixed-size records (timestamp, kind, state, two values, captive portal).
+Timestamps never go backwards, so the records of a segment are sorted: a time range is found by bisecting the
+segment with a few seeks, and the first record of each segment tells which segments a range covers.
+When the current segment reaches segment_bytes a new one is started, and only the max_segments most recent are kept.
+Each run starts with a START record, and an unchanged state is written again every heartbeat seconds: a run that was
+killed leaves no 'stopped' record, so the time after its last record is counted as unmonitored (see summarize).
+"""
+
+import collections
+import datetime
+import glob
+import math
+import os
+import re
+import struct
+
+from clock import SystemClock
+
+
+STATE, SESSION, RENEWAL, START = 1, 2, 3, 4
+
+STATES = ('stopped', 'exterior', 'offline', 'captive_portal_disconnected', 'captive_portal_connected')
+UP_STATES = ('exterior', 'captive_portal_connected')
+OUTAGE_STATES = ('offline', 'captive_portal_disconnected')
+
+RECORD = struct.Struct('<dBBxxff16s')
+
+Record = collections.namedtuple('Record', ['timestamp', 'kind', 'state', 'a', 'b', 'captive_portal'])
+
+
+def _decode(data):
+    timestamp, kind, state, a, b, captive_portal = data
+    return Record(timestamp, kind, STATES[state] if state < len(STATES) else None,
+                  None if math.isnan(a) else a, None if math.isnan(b) else b,
+                  captive_portal.rstrip(b'\x00').decode('utf-8', 'replace') or None)
+
+
+class HistoryLog:
+    """Writer of the history. Each record is one write() on a file opened in append mode, on the first record.
+        The START record is only written with the first record of the run, so that an instance that never writes
+        (a follower) doesn't cut the run of the one that does.
+    """
+
+    def __init__(self, directory, basename='INSAConnectHistory', segment_bytes=1 << 20, max_segments=8, heartbeat=300, clock=None):
+        self.directory = directory
+        self.basename = basename
+        self.segment_bytes = max(RECORD.size, segment_bytes - segment_bytes % RECORD.size)
+        self.max_segments = max(1, max_segments)
+        self.heartbeat = heartbeat
+        self.clock = clock or SystemClock()
+        self.currentState = None
+        self._started = False
+        self._fd = None
+        self._size = 0
+        self._lastTimestamp = 0.0
+        self._segment = 0  # Le dernier segment n'est ouvert qu'au premier enregistrement
+
+    def _open_last_segment(self):
+        segments = segment_paths(self.directory, self.basename)
+        if segments:
+            self._segment = segment_number(segments[-1])
+            path = segments[-1]
+            size = os.path.getsize(path)
+            if size % RECORD.size:
+                os.truncate(path, size - size % RECORD.size)  # Dernier enregistrement incomplet (arrêt brutal)
+            last = _read_record(path, os.path.getsize(path) // RECORD.size - 1)
+            if last is not None:
+                self._lastTimestamp = last.timestamp
+        self._open_segment(self._segment or 1)
+
+    def _open_segment(self, number):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._segment = number
+        path = os.path.join(self.directory, '%s.%06d' % (self.basename, number))
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._size = os.fstat(self._fd).st_size
+        for old in segment_paths(self.directory, self.basename)[:-self.max_segments]:
+            try:
+                os.unlink(old)
+            except OSError:
+                pass
+
+    def append(self, kind, state=None, a=None, b=None, captive_portal=None):
+        """Appends a record stamped with the current time (never earlier than the previous record), after the run's START record."""
+        if not self._started:
+            self._started = True
+            self.append(START)
+        try:
+            if self._fd is None:
+                self._open_last_segment()
+            elif self._size >= self.segment_bytes:
+                self._open_segment(self._segment + 1)
+            self._lastTimestamp = max(self._lastTimestamp, self.clock.time())
+            data = RECORD.pack(self._lastTimestamp, kind, STATES.index(state) if state in STATES else 255,
+                               float('nan') if a is None else a, float('nan') if b is None else b,
+                               ('' if captive_portal is None else str(captive_portal)).encode('utf-8')[:16])
+            os.write(self._fd, data)
+            self._size += len(data)
+        except OSError:
+            pass
+
+    def recordState(self, state):
+        """Records a state transition. An unchanged state is only written again once heartbeat seconds went by without any record."""
+        if state != self.currentState or self.clock.time() - self._lastTimestamp >= self.heartbeat:
+            self.currentState = state
+            self.append(STATE, state)
+
+    def recordSession(self, captive_portal, lifetime):
+        self.append(SESSION, a=lifetime, captive_portal=captive_portal)
+
+    def recordRenewal(self, captive_portal, latency, gap):
+        """latency: duration of the logout/login exchange, None if no new session was obtained. gap: offline time, None if unknown."""
+        self.append(RENEWAL, a=latency, b=gap, captive_portal=captive_portal)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def segment_paths(directory, basename='INSAConnectHistory'):
+    """Segment files, oldest first."""
+    return sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(basename) + '.[0-9]*')), key=segment_number)
+
+
+def segment_number(path):
+    return int(path.rsplit('.', 1)[1])
+
+
+def _read_record(path, index):
+    if index < 0:
+        return None
+    try:
+        with open(path, 'rb') as file:
+            file.seek(index * RECORD.size)
+            data = file.read(RECORD.size)
+    except OSError:
+        return None
+    return _decode(RECORD.unpack(data)) if len(data) == RECORD.size else None
+
+
+def _bisect(file, count, timestamp):
+    """Index of the first record of the open segment file whose timestamp is >= timestamp."""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        file.seek(middle * RECORD.size)
+        if struct.unpack('<d', file.read(8))[0] < timestamp:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _records_backwards(directory, basename, before=None):
+    """Yields the records older than before (all of them if None), most recent first."""
+    for path in reversed(segment_paths(directory, basename)):
+        try:
+            with open(path, 'rb') as file:
+                count = os.fstat(file.fileno()).st_size // RECORD.size
+                index = count if before is None else _bisect(file, count, before)
+                while index > 0:
+                    start = max(0, index - 256)
+                    file.seek(start * RECORD.size)
+                    chunk = file.read((index - start) * RECORD.size)
+                    for data in reversed(list(RECORD.iter_unpack(chunk))):
+                        yield _decode(data)
+                    index = start
+        except OSError:
+            continue
+
+
+class HistoryReader:
+    """Streams the records of a time range, a chunk at a time."""
+
+    def __init__(self, directory, basename='INSAConnectHistory', chunk_records=4096):
+        self.directory = directory
+        self.basename = basename
+        self.chunk_records = chunk_records
+
+    def records(self, since=None, until=None):
+        """Yields the records with since <= timestamp < until, oldest first."""
+        segments = segment_paths(self.directory, self.basename)
+        for i, path in enumerate(segments):
+            if since is not None and i + 1 < len(segments):
+                nextFirst = _read_record(segments[i + 1], 0)
+                if nextFirst is not None and nextFirst.timestamp <= since:
+                    continue  # Tout ce segment est avant la fenêtre
+            try:
+                with open(path, 'rb') as file:
+                    count = os.fstat(file.fileno()).st_size // RECORD.size
+                    index = 0 if since is None else _bisect(file, count, since)
+                    file.seek(index * RECORD.size)
+                    while index < count:
+                        chunk = file.read(min(self.chunk_records, count - index) * RECORD.size)
+                        if not chunk:
+                            break
+                        index += len(chunk) // RECORD.size
+                        for data in RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % RECORD.size]):
+                            if until is not None and data[0] >= until:
+                                return
+                            yield _decode(data)
+            except OSError:
+                continue
+
+    def last_before(self, timestamp):
+        """Last record (of any kind) before timestamp, or None."""
+        return next(_records_backwards(self.directory, self.basename, timestamp), None)
+
+    def state_at(self, timestamp):
+        """State in effect at timestamp (from the last state record before it), or None if a run started after it."""
+        for record in _records_backwards(self.directory, self.basename, timestamp):
+            if record.kind == STATE:
+                return record.state
+            if record.kind == START:
+                return None
+        return None
+
+
+def summarize(reader, since, until, max_silence=None):
+    """Uptime, outages and renewals between the since and until timestamps, in one pass over the records.
+        The time between the last record of a run and the START of the next one is unmonitored (the program was killed,
+        or the computer off), and so is any silence longer than max_silence seconds (see HistoryLog.heartbeat), which
+        also covers a run that is over without a START after it.
+    """
+    stateSeconds = collections.defaultdict(float)
+    outages = []
+    renewalLatencies, renewalGaps = [], []
+    summary = {'since': since, 'until': until, 'sessions': 0, 'renewal_failures': 0}
+    state, cursor = reader.state_at(since), since
+    last = reader.last_before(since)
+    lastSeen = last.timestamp if last is not None else since
+    outageStart = since if state in OUTAGE_STATES else None
+
+    def close(end, runOver=False):
+        """Counts state from cursor to end, up to where the program was last known to run. Returns where it stopped counting."""
+        horizon = end
+        if runOver:
+            horizon = min(horizon, lastSeen)
+        if max_silence is not None:
+            horizon = min(horizon, lastSeen + max_silence)
+        horizon = max(horizon, cursor)
+        stateSeconds[state] += horizon - cursor
+        stateSeconds[None] += end - horizon
+        return horizon
+
+    for record in reader.records(since, until):
+        if record.kind in (STATE, START):
+            horizon = close(record.timestamp, runOver=record.kind == START)
+            if outageStart is not None and (horizon < record.timestamp or record.state not in OUTAGE_STATES):
+                outages.append(horizon - outageStart)
+                outageStart = None
+            if record.state in OUTAGE_STATES and outageStart is None:
+                outageStart = record.timestamp
+            state, cursor = record.state, record.timestamp
+        elif record.kind == SESSION:
+            summary['sessions'] += 1
+        elif record.kind == RENEWAL:
+            if record.a is None:
+                summary['renewal_failures'] += 1
+            else:
+                renewalLatencies.append(record.a)
+                if record.b is not None:
+                    renewalGaps.append(record.b)
+        lastSeen = record.timestamp
+    horizon = close(until)
+    if outageStart is not None:
+        outages.append(horizon - outageStart)
+    monitored = sum(seconds for s, seconds in stateSeconds.items() if s not in (None, 'stopped'))
+    up = sum(stateSeconds[s] for s in UP_STATES)
+    summary.update(state_seconds={s: seconds for s, seconds in stateSeconds.items() if seconds > 0},
+                   monitored_seconds=monitored,
+                   uptime=up / monitored if monitored else None,
+                   outages=len(outages), outage_seconds=sum(outages), outage_max=max(outages, default=0),
+                   renewals=len(renewalLatencies),
+                   renewal_latency_mean=sum(renewalLatencies) / len(renewalLatencies) if renewalLatencies else None,
+                   renewal_latency_p95=_percentile(renewalLatencies, 95),
+                   renewal_gap_mean=sum(renewalGaps) / len(renewalGaps) if renewalGaps else None)
+    return summary
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+_RELATIVE = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhdj])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'j': 86400}
+
+
+def parse_when(text, now):
+    """Timestamp from '90m', '24h', '7d' (before now) or from an ISO date such as '2016-10-17' or '2016-10-17 08:30'."""
+    match = _RELATIVE.match(text.strip())
+    if match:
+        return now - float(match.group(1)) * _UNITS[match.group(2)]
+    return datetime.datetime.fromisoformat(text.strip()).timestamp()
+
+
+def _duration(seconds):
+    if seconds < 120:
+        return '%.1f s' % seconds
+    if seconds < 7200:
+        return '%.0f min' % (seconds / 60)
+    if seconds < 172800:
+        return '%.1f h' % (seconds / 3600)
+    return '%.1f j' % (seconds / 86400)
+
+
+def print_summary(summary):
+    fmt = lambda t: datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M')
+    print("Historique du %s au %s (%s)" % (fmt(summary['since']), fmt(summary['until']), _duration(summary['until'] - summary['since'])))
+    if summary['uptime'] is None:
+        print("Aucune surveillance enregistrée sur cette période.")
+        return
+    print("Connecté à internet : %.2f %% du temps surveillé (%s)" % (summary['uptime'] * 100, _duration(summary['monitored_seconds'])))
+    if summary['outages']:
+        print("Coupures : %d, durée totale %s, moyenne %s, max %s"
+              % (summary['outages'], _duration(summary['outage_seconds']),
+                 _duration(summary['outage_seconds'] / summary['outages']), _duration(summary['outage_max'])))
+    else:
+        print("Coupures : aucune")
+    print("Sessions obtenues : %d" % summary['sessions'])
+    if summary['renewals'] or summary['renewal_failures']:
+        print("Renouvellements : %d, %d échoués" % (summary['renewals'], summary['renewal_failures']))
+    if summary['renewals']:
+        print("  latence moyenne %.3f s, p95 %.3f s" % (summary['renewal_latency_mean'], summary['renewal_latency_p95']))
+    if summary['renewal_gap_mean'] is not None:
+        print("  coupure moyenne pendant le renouvellement %.3f s" % summary['renewal_gap_mean'])
+    for state, seconds in sorted(summary['state_seconds'].items(), key=lambda item: -item[1]):
+        print("  %-28s %s" % (state or 'inconnu', _duration(seconds)))
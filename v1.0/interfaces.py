@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Network interfaces, and the binding of sockets to one of them so that probes and logins go through a given link."""
+
+import errno
+import socket
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+SIOCGIFFLAGS = 0x8913
+SIOCGIFADDR = 0x8915
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+
+_deviceBinding = {}
+
+
+def _ifreq(sock, request, name):
+    return fcntl.ioctl(sock.fileno(), request, struct.pack('256s', name.encode('utf-8')[:15]))
+
+
+def interface_address(name):
+    """IPv4 address of the interface name, or None (down, no address, not Linux)."""
+    if fcntl is None:
+        return None
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            return socket.inet_ntoa(_ifreq(sock, SIOCGIFADDR, name)[20:24])
+    except OSError:
+        return None
+
+
+def list_interfaces():
+    """Names of the interfaces that are up, have an IPv4 address and aren't a loopback, in index order (Linux only, [] elsewhere)."""
+    if fcntl is None or not hasattr(socket, 'if_nameindex'):
+        return []
+    names = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            try:
+                flags = struct.unpack('H', _ifreq(sock, SIOCGIFFLAGS, name)[16:18])[0]
+            except OSError:
+                continue
+            if flags & IFF_UP and not flags & IFF_LOOPBACK and interface_address(name):
+                names.append(name)
+    return names
+
+
+def device_option(name):
+    """(level, option, value) of setsockopt() that binds a socket to the interface name."""
+    return socket.SOL_SOCKET, SO_BINDTODEVICE, name.encode('utf-8')
+
+
+def can_bind_to_device(name):
+    """Whether SO_BINDTODEVICE is allowed on name: Linux only, unprivileged since Linux 5.7 (CAP_NET_RAW before)."""
+    if name not in _deviceBinding:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.setsockopt(*device_option(name))
+            _deviceBinding[name] = True
+        except OSError as e:
+            if e.errno == errno.ENODEV:
+                return False  # Interface absente pour l'instant (clé USB, VPN...) : on réessaiera
+            _deviceBinding[name] = False
+    return _deviceBinding[name]
+
+
+def source_address(name):
+    """Address that bind_socket() binds the sockets of name to, None when it uses SO_BINDTODEVICE (or name has no address).
+        Long-lived sockets bound to an address must be rebuilt when it changes (DHCP renewal...): see portal_client, reachability.
+    """
+    if name is None or can_bind_to_device(name):
+        return None
+    return interface_address(name)
+
+
+def bind_socket(sock, name):
+    """Sends sock's traffic through the interface name (no-op if name is None). Raises OSError if that's impossible.
+        SO_BINDTODEVICE is used when allowed. Otherwise the socket is bound to the interface's address, which only picks the
+        link if the routing follows the source address (ip rule from <address> table ...), or if the kernel would pick it anyway.
+    """
+    if name is None:
+        return
+    if can_bind_to_device(name):
+        sock.setsockopt(*device_option(name))
+        return
+    address = interface_address(name)
+    if address is None:
+        raise OSError(errno.EADDRNOTAVAIL, "L'interface " + name + " n'a pas d'adresse IPv4")
+    sock.bind((address, 0))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Leader election between the INSAConnect instances of a user, with a lock next to their shared session file."""
+
+import getpass
+import os
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def _check_owned(st, path):
+    """Refuses a file or directory that another user owns or may write to (it could hold the lock forever, or swap the file)."""
+    if hasattr(os, 'geteuid') and (st.st_uid != os.geteuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        raise PermissionError("%s n'appartient pas à l'utilisateur ou est modifiable par d'autres" % path)
+
+
+def private_directory(base=None, create=True):
+    """Directory of the current user for the session file, its lock and the history: <tmp>/INSAConnect-<user>.
+        Created with mode 0700; an existing one must be a real directory owned by the user and not writable by others.
+        With create=False a missing directory isn't created (for the readers: it has nothing to read).
+    """
+    path = os.path.join(base or tempfile.gettempdir(), 'INSAConnect-' + getpass.getuser())
+    if create:
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+    elif not os.path.lexists(path):
+        return path
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(path + " n'est pas un répertoire")
+    _check_owned(st, path)
+    return path
+
+
+class LeaderElection:
+    """Only the instance holding the lock (the leader) probes and talks to the portal.
+
+    The lock is a flock() (msvcrt.locking() on Windows) on lockPath: the kernel releases it when the leader dies,
+    so a follower calling try_acquire() every few seconds takes over within that delay.
+    The instances sharing a lock are those of one user: lockPath belongs in a private directory (see private_directory),
+    and a lock file owned or writable by someone else is never used.
+    """
+
+    def __init__(self, lockPath):
+        self.lockPath = lockPath
+        self.isLeader = False
+        self._fd = None
+
+    def _open(self):
+        fd = os.open(self.lockPath, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        try:
+            _check_owned(os.fstat(fd), self.lockPath)
+        except OSError:
+            os.close(fd)
+            raise
+        return fd
+
+    def try_acquire(self):
+        """Becomes the leader if nobody else is. Returns isLeader."""
+        if self.isLeader:
+            return True
+        try:
+            if self._fd is None:
+                self._fd = self._open()
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        self.isLeader = True
+        try:
+            os.ftruncate(self._fd, 0)
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.write(self._fd, str(os.getpid()).encode('ascii'))
+        except OSError:
+            pass
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if self.isLeader and fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            elif self.isLeader:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        os.close(self._fd)
+        self._fd = None
+        self.isLeader = False
+
+    def leaderPID(self):
+        """PID written by the current leader, or None."""
+        try:
+            with open(self.lockPath) as file:
+                return int(file.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
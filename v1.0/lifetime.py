@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Learns how long the captive portals' sessions really last, instead of trusting the timeout of the INI file."""
+
+import datetime
+import json
+import os
+import tempfile
+import threading
+
+
+def survival_quantile(samples, quantile):
+    """Kaplan-Meier estimate of the duration before which a fraction quantile of the sessions die.
+        samples is a list of (duration, died): sessions that were renewed or logged out before dying only tell that the
+        lifetime is longer than their duration. Returns None if the observed deaths don't reach that fraction.
+    """
+    survival = 1.0
+    atRisk = len(samples)
+    # À durée égale, les morts passent avant les sessions censurées (convention de Kaplan-Meier)
+    for duration, died in sorted(samples, key=lambda sample: (sample[0], not sample[1])):
+        if died:
+            survival *= (atRisk - 1) / atRisk
+            if survival <= 1 - quantile:
+                return duration
+        atRisk -= 1
+    return None
+
+
+class LifetimeEstimator:
+    """Per captive portal model of the session lifetime, kept in a small JSON file next to the session file.
+
+    Every session ends up as a sample: a death (the portal cut us off) or a censored duration (we renewed it or logged
+    out first). estimate() returns the quantile of the lifetime distribution, or the INI timeout until min_deaths deaths
+    have been seen. A learnt lifetime is never shorter than min_lifetime (nor than the INI timeout, when that is shorter):
+    a few sessions cut off early must not make the renewals follow each other without end.
+    Each death also records the expiry that was predicted for that session, for the report.
+    """
+
+    def __init__(self, path, quantile=0.05, min_deaths=2, min_lifetime=0, max_samples=50, max_predictions=20):
+        self.path = path
+        self.quantile = quantile
+        self.min_deaths = min_deaths
+        self.min_lifetime = min_lifetime
+        self.max_samples = max_samples
+        self.max_predictions = max_predictions
+        self._lock = threading.Lock()
+        self._portals = None
+
+    @property
+    def portals(self):
+        """Samples and predictions per captive portal, read from the file on first use."""
+        if self._portals is None:
+            self._portals = self._load()
+        return self._portals
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                portals = json.load(file)
+            return portals if isinstance(portals, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            fd, tmpPath = tempfile.mkstemp(prefix='.' + os.path.basename(self.path) + '.', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(self.portals, file)
+            os.replace(tmpPath, self.path)
+        except OSError:
+            pass
+
+    def _portal(self, captive_portal):
+        return self.portals.setdefault(captive_portal, {'samples': [], 'predictions': []})
+
+    def observe(self, captive_portal, start, end, died, predicted_end=None):
+        """Adds a session that lasted from start to end. died is False if we ended it ourselves (renewal, logout)."""
+        if start is None or end <= start:
+            return
+        with self._lock:
+            portal = self._portal(captive_portal)
+            portal['samples'] = (portal['samples'] + [[end - start, bool(died)]])[-self.max_samples:]
+            if died and predicted_end is not None:
+                portal['predictions'] = (portal['predictions'] + [[start, predicted_end, end]])[-self.max_predictions:]
+            self._save()
+
+    def estimate(self, captive_portal, default):
+        """Lifetime to plan the session's renewal with: the learnt quantile, or default if too few sessions died.
+            The learnt lifetime never exceeds default (the INI's timeout) nor falls below min_lifetime.
+        """
+        with self._lock:
+            samples = self.portals.get(captive_portal, {}).get('samples', [])
+            if sum(1 for _, died in samples if died) < self.min_deaths:
+                return default
+            return min(default, max(survival_quantile(samples, self.quantile) or default, self.min_lifetime))
+
+    def report(self, captive_portal, default):
+        """Summary of what is known about captive_portal's sessions (see print_report)."""
+        with self._lock:
+            portal = self.portals.get(captive_portal, {'samples': [], 'predictions': []})
+            samples = list(portal['samples'])
+            predictions = list(portal['predictions'])
+        deaths = sorted(duration for duration, died in samples if died)
+        return {'captive_portal': captive_portal, 'timeout': default, 'samples': len(samples), 'deaths': len(deaths),
+                'shortest': deaths[0] if deaths else None, 'median': survival_quantile(samples, 0.5),
+                'estimate': self.estimate(captive_portal, default), 'predictions': predictions}
+
+
+def print_report(report):
+    print("%s : %d sessions observées dont %d coupées par le portail" % (report['captive_portal'], report['samples'], report['deaths']))
+    print("  durée prévue par le fichier INI : %.0f s, durée retenue : %.0f s" % (report['timeout'], report['estimate']))
+    if report['shortest'] is not None:
+        print("  plus courte : %.0f s%s" % (report['shortest'], ", médiane : %.0f s" % report['median'] if report['median'] else ""))
+    for start, predicted, actual in report['predictions']:
+        print("  session du %s : fin prévue %s, coupée à %s (%+.0f s)"
+              % (datetime.datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M'),
+                 datetime.datetime.fromtimestamp(predicted).strftime('%H:%M:%S'),
+                 datetime.datetime.fromtimestamp(actual).strftime('%H:%M:%S'), actual - predicted))
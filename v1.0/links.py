@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Monitoring of several network interfaces at once (Ethernet and Wi-Fi...), each link with its own probes and session."""
+
+import configparser
+import threading
+from functools import partial
+
+import interfaces
+import portal_client
+from eventbus import EventBus, StateChanged
+
+
+# Les liens qui donnent accès à internet passent avant les autres, à égalité l'ordre du fichier INI l'emporte
+STATE_RANKS = {'captive_portal_connected': 3, 'exterior': 3, 'captive_portal_disconnected': 1, 'offline': 0}
+STATE_LABELS = {'captive_portal_connected': "connectée au portail captif",
+                'exterior': "connectée à internet",
+                'captive_portal_disconnected': "non-connectée au portail captif",
+                'offline': "pas d'accès à internet",
+                'follower': "surveillée par une autre instance",
+                'stopped': "surveillance arrêtée"}
+
+
+def monitored_interfaces(iniFile='INSAConnect.ini'):
+    """Interfaces listed in the [Interfaces] section of the INI file ('auto': every interface that is up), [] for none."""
+    config = configparser.ConfigParser()
+    config.read(iniFile)
+    names = config.get('Interfaces', 'names', fallback='').strip()
+    if names == 'auto':
+        return interfaces.list_interfaces()
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
+class LinksModel:
+    """Stands in for ConnectionModel in the view and the daemon: the state of the active link, and a line per other link."""
+
+    def __init__(self, display):
+        self.events = EventBus()
+        self.DISPLAY = display
+        self.connectionStateText = "Bonjour !\n\nVérification de l'état de la connexion..."
+        self.connectedThroughCaptivePortal = False
+        self.portalStatus = portal_client.OK
+        self.currentSession = {'captive_portal': None, 'ID': None, 'start_timestamp': None, 'end_timestamp': float('inf'), 'end_time': float('inf')}
+
+
+class MultiLinkManager:
+    """Stands in for ConnectionManager when several interfaces are monitored.
+
+    Every interface gets its own ConnectionModel and ConnectionManager, bound to it: they probe and log in concurrently,
+    each with its own session file, renewals and history, so that every link stays logged in to its portal.
+    The active link is the first one with internet access; it only changes when another link is strictly better, as soon as
+    a link announces its new state (no need to wait for the next tick). The commands go to the active link.
+    """
+
+    def __init__(self, names, modelClass, managerClass, iniFile='INSAConnect.ini', fastStart=False):
+        self.links = {}
+        for name in names:
+            model = modelClass(iniFile, interface=name)
+            if self.links:
+                primary = next(iter(self.links.values())).model
+                # Un seul serveur de métriques (celui de la première interface), et une seule estimation des durées de session par portail
+                model.METRICS['ENABLED'] = False
+                model.lifetimes = primary.lifetimes
+            self.links[name] = managerClass(headless=True, model=model, fastStart=fastStart)
+        self.primary = next(iter(self.links.values()))
+        self.active = next(iter(self.links))
+        self.model = LinksModel(self.primary.model.DISPLAY)
+        self._lock = threading.Lock()
+        self._subscriptions = [(manager.model.events, manager.model.events.subscribe(StateChanged, partial(self._on_link_changed, name)))
+                               for name, manager in self.links.items()]
+
+    @property
+    def currentCaptivePortal(self):
+        return self.links[self.active].currentCaptivePortal
+
+    @property
+    def autoManageConnection(self):
+        return self.links[self.active].autoManageConnection
+
+    def _rank(self, name):
+        return STATE_RANKS.get(self.links[name].state, -1)
+
+    def _text(self):
+        lines = ["Interface " + self.active, self.links[self.active].model.connectionStateText]
+        others = [name + " : " + STATE_LABELS.get(manager.state, "vérification...") for name, manager in self.links.items() if name != self.active]
+        if others:
+            lines += [""] + others
+        return "\n".join(lines)
+
+    def _on_link_changed(self, name, event):
+        """Called in the thread of the link that changed: elects the active link and updates the model shown to the view."""
+        with self._lock:
+            previous = self.active
+            best = max(self.links, key=self._rank)
+            if self._rank(best) > self._rank(self.active):
+                self.active = best
+            elif name == self.active and event.name == 'state' and self._rank(name) < STATE_RANKS['exterior']:
+                #Le lien actif vient de tomber : les autres, peut-être en attente pour plusieurs secondes, sont revérifiés tout de suite
+                for other, manager in self.links.items():
+                    if other != name:
+                        manager.networkMonitor.wakeup()
+            activeModel = self.links[self.active].model
+            changes = []
+            for attribute, value in (('connectionStateText', self._text()),
+                                     ('connectedThroughCaptivePortal', activeModel.connectedThroughCaptivePortal),
+                                     ('portalStatus', activeModel.portalStatus)):
+                if getattr(self.model, attribute) != value:
+                    setattr(self.model, attribute, value)
+                    changes.append(StateChanged(attribute, value))
+            self.model.currentSession = activeModel.currentSession
+            if self.active != previous:
+                changes.append(StateChanged('activeInterface', self.active))
+            elif name == self.active and event.name == 'autoManageConnection':
+                changes.append(event)
+        for change in changes:
+            self.model.events.publish(change)
+
+    def connect(self):
+        """Queues a login on the active link's captive portal. Returns a Future."""
+        return self.links[self.active].connect()
+
+    def disconnect(self):
+        return self.links[self.active].disconnect()
+
+    def reconnect(self):
+        return self.links[self.active].reconnect()
+
+    def setAutoConnectionManagement(self, bool_=None):
+        """Toggles/sets automatic reconnection on every link at once."""
+        value = (not self.autoManageConnection) if bool_ is None else bool_
+        for manager in self.links.values():
+            manager.setAutoConnectionManagement(value)
+
+    def start_monitoring(self):
+        for manager in self.links.values():
+            manager.start_monitoring()
+
+    def _stop_monitoring(self):
+        #Les liens s'arrêtent un par un : l'affichage garde le dernier lien actif
+        for events, subscription in self._subscriptions:
+            events.unsubscribe(subscription)
+        for manager in self.links.values():
+            manager._stop_monitoring()
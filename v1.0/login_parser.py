@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Incremental parser of the captive portal's login page: the answer is known as soon as the logout_id field has arrived."""
+
+import collections
+import re
+
+
+LOGOUT_FIELD = b'<input name="logout_id" type="hidden" value="'
+# Ancrée sur le début du champ (match(), pas search()), valeur bornée : pas de retour arrière sur toute la page
+LOGOUT_ID = re.compile(re.escape(LOGOUT_FIELD) + rb'([^"<>]{1,64})" />')
+LOGOUT_ID_MAX_LENGTH = len(LOGOUT_FIELD) + 64 + len(b'" />')
+ERROR_MARKER = b'erreur'
+
+LoginPage = collections.namedtuple('LoginPage', ['sessionID', 'error'])
+LoginPage.__doc__ = """What the login page says: the session's logout_id (or None), and whether it is an error page."""
+
+
+class LoginResponseParser:
+    """Fed with the body's chunks as they arrive, feed() returns a LoginPage as soon as the logout_id field or the error
+    marker has been seen (whichever comes first), and None while it needs more data. finish() gives the verdict at the
+    end of the body. Only the last few bytes of the previous chunk are kept, for the fields split between two chunks.
+    """
+
+    def __init__(self, max_bytes=1 << 20):
+        self.max_bytes = max_bytes
+        self.bytesRead = 0
+        self._tail = b''
+
+    def feed(self, chunk):
+        data = self._tail + chunk
+        self.bytesRead += len(chunk)
+        field = data.find(LOGOUT_FIELD)
+        error = data.find(ERROR_MARKER)
+        if error != -1 and (field == -1 or error < field):
+            return LoginPage(None, True)
+        if field != -1:
+            match = LOGOUT_ID.match(data, field)
+            if match:
+                return LoginPage(match.group(1).decode('utf-8', 'replace'), False)
+            if len(data) - field >= LOGOUT_ID_MAX_LENGTH:
+                # Champ présent mais valeur illisible : inutile d'attendre la suite
+                return LoginPage(None, False)
+            self._tail = data[field:]
+        else:
+            self._tail = data[-(len(LOGOUT_FIELD) - 1):]
+        if self.bytesRead >= self.max_bytes:
+            return LoginPage(None, False)
+        return None
+
+    def finish(self):
+        return LoginPage(None, False)
+
+
+def parse_login_page(text):
+    """Parses a whole login page (str or bytes) at once."""
+    parser = LoginResponseParser(max_bytes=float('inf'))
+    return parser.feed(text.encode('utf-8') if isinstance(text, str) else text) or parser.finish()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Latency histograms and connection state durations, exposed on a local HTTP endpoint (Prometheus text format and JSON)."""
+
+import bisect
+import functools
+import json
+import threading
+
+from clock import SystemClock
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Fixed-bucket histogram: observe() is one bisect and a few additions."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Returns [(upper bound, cumulative count)], the last bound being +Inf."""
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Registry of operation latencies and of the time spent in each connection state."""
+
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
+        self.histograms = {}
+        self.counters = {}
+        self.stateSeconds = {}
+        self.stateTransitions = {}
+        self.currentState = None
+        self._stateSince = self.clock.monotonic()
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def setState(self, state):
+        """Closes the time slice of the current state and starts counting for state (no-op if it didn't change)."""
+        if state == self.currentState:
+            return
+        with self._lock:
+            now = self.clock.monotonic()
+            if self.currentState is not None:
+                self.stateSeconds[self.currentState] = self.stateSeconds.get(self.currentState, 0) + now - self._stateSince
+            self.currentState = state
+            self._stateSince = now
+            self.stateTransitions[state] = self.stateTransitions.get(state, 0) + 1
+
+    def _state_seconds(self):
+        seconds = dict(self.stateSeconds)
+        if self.currentState is not None:
+            seconds[self.currentState] = seconds.get(self.currentState, 0) + self.clock.monotonic() - self._stateSince
+        return seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {'operations': {name: {'count': h.count, 'sum': h.sum,
+                                          'buckets': [[str(bound), count] for bound, count in h.cumulative_counts()]}
+                                   for name, h in self.histograms.items()},
+                    'counters': dict(self.counters),
+                    'state_seconds': self._state_seconds(),
+                    'state_transitions': dict(self.stateTransitions),
+                    'current_state': self.currentState}
+
+    def prometheus_text(self):
+        with self._lock:
+            lines = ['# HELP insaconnect_operation_duration_seconds Duration of probes and portal operations.',
+                     '# TYPE insaconnect_operation_duration_seconds histogram']
+            for name, h in sorted(self.histograms.items()):
+                for bound, count in h.cumulative_counts():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('insaconnect_operation_duration_seconds_bucket{operation="%s",le="%s"} %d' % (name, le, count))
+                lines.append('insaconnect_operation_duration_seconds_sum{operation="%s"} %r' % (name, h.sum))
+                lines.append('insaconnect_operation_duration_seconds_count{operation="%s"} %d' % (name, h.count))
+            lines += ['# HELP insaconnect_state_seconds_total Time spent in each connection state.',
+                      '# TYPE insaconnect_state_seconds_total counter']
+            for state, seconds in sorted(self._state_seconds().items()):
+                lines.append('insaconnect_state_seconds_total{state="%s"} %r' % (state, seconds))
+            lines += ['# HELP insaconnect_state_transitions_total Number of times each connection state was entered.',
+                      '# TYPE insaconnect_state_transitions_total counter']
+            for state, count in sorted(self.stateTransitions.items()):
+                lines.append('insaconnect_state_transitions_total{state="%s"} %d' % (state, count))
+            lines += ['# HELP insaconnect_events_total Event counters (probe failures by stage...).',
+                      '# TYPE insaconnect_events_total counter']
+            for name, count in sorted(self.counters.items()):
+                lines.append('insaconnect_events_total{event="%s"} %d' % (name, count))
+            return '\n'.join(lines) + '\n'
+
+
+def timed(name):
+    """Method decorator recording the call's duration in self.metrics under name, measured with the metrics' clock (virtual in a replay)."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = self.metrics.clock.monotonic()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(name, self.metrics.clock.monotonic() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus text format) and /metrics.json on localhost, in a background thread."""
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, contentType = metrics.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, contentType = json.dumps(metrics.as_dict()).encode('utf-8'), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wakes the monitor up on network changes (rtnetlink on Linux) instead of polling every second."""
+
+import select
+import socket
+import struct
+import time
+
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+RTM_NEWLINK, RTM_DELLINK = 16, 17
+RTM_NEWADDR, RTM_DELADDR = 20, 21
+RTM_NEWROUTE, RTM_DELROUTE = 24, 25
+NETWORK_CHANGE_MESSAGES = (RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR, RTM_NEWROUTE, RTM_DELROUTE)
+
+NLMSGHDR = struct.Struct('=LHHLL')
+
+
+class NetworkChangeMonitor:
+    """Sleeps until a timeout expires, a link/address/route changes, or another thread calls wakeup().
+
+    Network changes are only seen on Linux (AF_NETLINK socket, no daemon needed). Elsewhere, or with use_netlink=False,
+    wait() is a plain interruptible sleep.
+    """
+
+    def __init__(self, use_netlink=True, settle_delay=0.05):
+        self.settle_delay = settle_delay
+        self._netlinkSocket = None
+        if use_netlink:
+            self._open_netlink_socket()
+        # Paire de sockets pour pouvoir réveiller wait() depuis un autre thread (fonctionne aussi sous Windows)
+        self._wakeupReader, self._wakeupWriter = socket.socketpair()
+        self._wakeupReader.setblocking(False)
+        self._wakeupWriter.setblocking(False)
+
+    def _open_netlink_socket(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE))
+            sock.setblocking(False)
+            self._netlinkSocket = sock
+        except (OSError, AttributeError):
+            self._netlinkSocket = None
+
+    @property
+    def available(self):
+        """True if kernel network-change notifications are received."""
+        return self._netlinkSocket is not None
+
+    def wakeup(self):
+        """Interrupts the current (or next) wait()."""
+        try:
+            self._wakeupWriter.send(b'\x00')
+        except OSError:
+            pass
+
+    def wait(self, timeout):
+        """Blocks for at most timeout seconds. Returns True if the network changed, False otherwise."""
+        sockets = [self._wakeupReader] + ([self._netlinkSocket] if self._netlinkSocket else [])
+        try:
+            readable, _, _ = select.select(sockets, [], [], max(0, timeout))
+        except (OSError, ValueError):
+            time.sleep(max(0, timeout))
+            return False
+        if self._wakeupReader in readable:
+            self._drain(self._wakeupReader)
+        if self._netlinkSocket in readable and self._drain_netlink():
+            # Les changements arrivent en rafale (lien, puis adresse, puis route) : on attend qu'ils soient tous passés
+            while select.select([self._netlinkSocket], [], [], self.settle_delay)[0]:
+                self._drain_netlink()
+            return True
+        return False
+
+    @staticmethod
+    def _drain(sock):
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            pass
+
+    def _drain_netlink(self):
+        """Reads every pending notification. Returns True if one of them is a network change."""
+        changed = False
+        while True:
+            try:
+                data = self._netlinkSocket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return changed
+            except OSError:
+                # ENOBUFS : des notifications ont été perdues, on considère que le réseau a changé
+                return True
+            if not data:
+                return changed
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, messageType, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+                if messageType in NETWORK_CHANGE_MESSAGES:
+                    changed = True
+                if length < NLMSGHDR.size:
+                    break
+                offset += (length + 3) & ~3
+
+    def close(self):
+        for sock in (self._netlinkSocket, self._wakeupReader, self._wakeupWriter):
+            if sock is not None:
+                sock.close()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Persistent and resilient HTTP(S) client for a captive portal."""
+
+import collections
+import random
+import threading
+
+import interfaces
+import startup
+from clock import SystemClock
+
+# requests (et urllib3, certifi...) prend plus de temps à importer que tout le reste du programme :
+# il n'est chargé qu'au premier PortalClient, ou en arrière-plan par preload_http_stack()
+requests = None
+HTTPAdapter = None
+NewConnectionError = None
+_httpStackLock = threading.Lock()
+
+
+# Issues possibles d'une requête au portail captif
+OK = 'ok'
+TIMEOUT = 'timeout'
+CONNECTION_ERROR = 'connection_error'
+HTTP_ERROR = 'http_error'
+CIRCUIT_OPEN = 'circuit_open'
+AUTH_ERROR = 'auth_error'
+PARSE_ERROR = 'parse_error'
+
+PortalResult = collections.namedtuple('PortalResult', ['status', 'response', 'error', 'elapsed', 'parsed'], defaults=(None,))
+PortalResult.__doc__ = """Outcome of a portal request: one of the status constants above, the response (if any), the exception (if any),
+    the time it took and what the streaming parser made of the body (see PortalClient.request)."""
+
+
+def load_http_stack():
+    """Imports requests if it isn't already."""
+    global requests, HTTPAdapter, NewConnectionError
+    with _httpStackLock:
+        if requests is None:
+            import requests as _requests
+            from requests.adapters import HTTPAdapter as _HTTPAdapter
+            from urllib3.exceptions import NewConnectionError as _NewConnectionError
+            HTTPAdapter = _HTTPAdapter
+            NewConnectionError = _NewConnectionError
+            requests = _requests
+            startup.mark('http_stack')
+
+
+def preload_http_stack():
+    """Imports requests in a background thread, while the first probes run."""
+    thread = threading.Thread(target=load_http_stack, daemon=True)
+    thread.start()
+    return thread
+
+
+def http_stack_loaded():
+    return requests is not None
+
+
+def _not_sent(error):
+    """Whether a failed request never reached the portal (no connection could be opened), so that sending it again is harmless."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if isinstance(error, requests.ConnectionError) and error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _bound_pool_options(interface):
+    """Keyword arguments of urllib3's pools that send their connections through interface (see interfaces.bind_socket)."""
+    address = interfaces.source_address(interface)
+    if address is not None:
+        return {'source_address': (address, 0)}
+    from urllib3.connection import HTTPConnection
+    # Sans adresse, le SO_BINDTODEVICE échouera à la connexion : mieux vaut une erreur qu'un login par une autre interface
+    return {'socket_options': HTTPConnection.default_socket_options + [interfaces.device_option(interface)]}
+
+
+class CircuitBreaker:
+    """Stops sending requests to a portal after failure_threshold consecutive failures.
+
+    After reset_timeout seconds a single trial request is let through (half-open): its success closes the circuit,
+    its failure opens it again. Every allowed request must end with record_success() or record_failure().
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, clock=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock or SystemClock()
+        self.failures = 0
+        self.openedAt = None
+        self._trialInProgress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.openedAt is None:
+            return 'closed'
+        return 'half-open' if self.clock.monotonic() - self.openedAt >= self.reset_timeout else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trialInProgress:
+                self._trialInProgress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.openedAt = None
+            self._trialInProgress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trialInProgress = False
+            if self.failures >= self.failure_threshold or self.openedAt is not None:
+                self.openedAt = self.clock.monotonic()
+
+
+class PortalClient:
+    """Keep-alive HTTP client for one captive portal.
+
+    The connection (and thus the TLS session) is pooled between requests, so a logout followed by a login
+    only pays for the DNS lookup and the TCP and TLS handshakes once. prewarm() opens it ahead of time.
+    request() bounds every phase with timeouts, retries with exponential backoff and jitter, and goes through a
+    circuit breaker so that a dead portal fails fast. The login and logout forms are not idempotent, so they are only
+    retried when the previous attempt never reached the portal.
+    With a parser, the body is streamed into it and the connection is closed as soon as it has its answer.
+    With an interface, the connections go through it whatever the default route. When they are bound to the interface's
+    address rather than to the device (see interfaces.bind_socket), the pool is rebuilt as soon as that address changes.
+    """
+
+    def __init__(self, url, pool_maxsize=2, connect_timeout=3, read_timeout=10, retries=2, backoff=0.5,
+                 breaker_threshold=3, breaker_reset=30, interface=None, clock=None):
+        self.url = url
+        self.interface = interface
+        self.clock = clock or SystemClock()
+        self.pool_maxsize = pool_maxsize
+        load_http_stack()
+        self.session = requests.Session()
+        self.sourceAddress = None
+        self._mountLock = threading.Lock()
+        self._mount()
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset, self.clock)
+        self._lock = threading.Lock()
+        self.lastUsed = 0
+
+    def _mount(self):
+        """Mounts a new connection pool, bound to the interface (to its current address without SO_BINDTODEVICE)."""
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        if self.interface is not None:
+            options = _bound_pool_options(self.interface)
+            adapter.init_poolmanager(1, self.pool_maxsize, **options)
+            self.sourceAddress = options.get('source_address', (None,))[0]
+        previous = self.session.adapters.get('http://')
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if previous is not None:
+            previous.close()
+
+    def _follow_address(self):
+        """Rebuilds the pool if the interface's address changed since its connections were bound to it."""
+        if self.interface is None:
+            return
+        with self._mountLock:
+            if interfaces.source_address(self.interface) != self.sourceAddress:
+                self._mount()
+
+    def post(self, data, **kwargs):
+        """POSTs the form data to the portal over the pooled connection (no retries, exceptions are raised)."""
+        self.lastUsed = self.clock.time()
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(self.url, data=data, **kwargs)
+
+    @staticmethod
+    def _parse(response, parser, chunk_size=512, drain_limit=16384):
+        """Streams the body into parser until it has its answer.
+            The rest of the body is then read, so that close() gives the keep-alive connection back to the pool instead of
+            dropping it; only when more than drain_limit bytes remain is the connection closed rather than drained.
+        """
+        chunks = response.iter_content(chunk_size)
+        try:
+            for chunk in chunks:
+                parsed = parser.feed(chunk)
+                if parsed is not None:
+                    break
+            else:
+                return parser.finish()
+            remaining = response.headers.get('Content-Length')
+            if remaining is None or not remaining.isdigit() or int(remaining) - parser.bytesRead <= drain_limit:
+                drained = 0
+                for chunk in chunks:
+                    drained += len(chunk)
+                    if drained > drain_limit:
+                        break
+            return parsed
+        finally:
+            response.close()
+
+    def _attempt(self, data, parser=None):
+        """One POST. Returns a PortalResult."""
+        start = self.clock.monotonic()
+        stream = parser is not None
+        try:
+            response = self.post(data, stream=stream)
+            if response.status_code >= 400:
+                if stream:
+                    response.close()
+                return PortalResult(HTTP_ERROR, response, None, self.clock.monotonic() - start)
+            parsed = self._parse(response, parser()) if stream else None
+        except requests.Timeout as e:
+            return PortalResult(TIMEOUT, None, e, self.clock.monotonic() - start)
+        except requests.RequestException as e:
+            return PortalResult(CONNECTION_ERROR, None, e, self.clock.monotonic() - start)
+        return PortalResult(OK, response, None, self.clock.monotonic() - start, parsed)
+
+    def _retryable(self, result, idempotent):
+        if result.status == OK:
+            return False
+        if not idempotent:
+            # Un login ou un logout parvenu au portail ne doit pas être renvoyé, même sans réponse
+            return result.error is not None and _not_sent(result.error)
+        return result.status in (TIMEOUT, CONNECTION_ERROR) or (result.status == HTTP_ERROR and result.response.status_code >= 500)
+
+    def request(self, data, parser=None, idempotent=False):
+        """POSTs the form data with timeouts, retries and the circuit breaker. Never raises, returns a PortalResult.
+            parser is a class like login_parser.LoginResponseParser: a new instance parses the body of each attempt
+            as it arrives, and the result goes to PortalResult.parsed.
+            Unless idempotent is True, the form is never sent twice (see the class docstring).
+        """
+        if not self.breaker.allow():
+            return PortalResult(CIRCUIT_OPEN, None, None, 0)
+        self._follow_address()
+        result = None
+        try:
+            for attempt in range(self.retries + 1):
+                result = self._attempt(data, parser)
+                if attempt == self.retries or not self._retryable(result, idempotent):
+                    break
+                self.clock.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        finally:
+            # Toujours conclure, sinon un essai en demi-ouverture bloquerait le disjoncteur pour de bon
+            if result is not None and result.status == OK:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+        return result
+
+    def prewarm(self, timeout=5):
+        """Opens (or refreshes) the pooled connection without logging in or out. Returns True on success."""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._follow_address()
+            self.session.head(self.url, timeout=timeout, allow_redirects=False)
+            self.lastUsed = self.clock.time()
+            return True
+        except requests.RequestException:
+            return False
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Concurrent TCP probes used to find out where we are connected from."""
+
+import collections
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from interfaces import bind_socket
+from resolver import ResolveError
+
+
+class ProbeResult(collections.namedtuple('ProbeResult', ['ok', 'stage', 'elapsed'])):
+    """Outcome of a probe. stage tells where it failed ('dns' or 'tcp', None on success). Truthy when the probe succeeded."""
+
+    def __bool__(self):
+        return self.ok
+
+
+def _connect(address, timeout, interface=None):
+    """socket.create_connection(), through interface if it isn't None (see interfaces.bind_socket)."""
+    if interface is None:
+        return socket.create_connection(address, timeout=timeout)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        bind_socket(sock, interface)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def tcp_probe(host, port, timeout=3, resolver=None, interface=None):
+    """Tries a TCP handshake with host:port within timeout seconds. Returns a ProbeResult.
+        With a resolver (see resolver.DNSCache), the name lookup is served from its cache.
+        With an interface, the handshake goes through it whatever the default route.
+    """
+    start = time.monotonic()
+    if resolver is None:
+        try:
+            # Timeout sur la socket elle-même : socket.setdefaulttimeout() est global au processus
+            sock = _connect((host, port), timeout, interface)
+            sock.close()
+            return ProbeResult(True, None, time.monotonic() - start)
+        except socket.gaierror:
+            return ProbeResult(False, 'dns', time.monotonic() - start)
+        except (OSError, ValueError):
+            return ProbeResult(False, 'tcp', time.monotonic() - start)
+    try:
+        addresses = resolver.resolve(host, timeout)
+    except ResolveError:
+        return ProbeResult(False, 'dns', time.monotonic() - start)
+    stage = 'dns'  # Si la résolution a mangé tout le budget, c'est le DNS qui est en cause
+    for address in addresses:
+        remaining = timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        stage = 'tcp'
+        try:
+            sock = _connect((address, port), remaining, interface)
+            sock.close()
+            return ProbeResult(True, None, time.monotonic() - start)
+        except (OSError, ValueError):
+            pass
+    return ProbeResult(False, stage, time.monotonic() - start)
+
+
+class ProbeRace:
+    """Races TCP handshakes against several targets at once.
+
+    The threads are kept around between calls so that a monitor tick doesn't pay for spawning them.
+    The losers of a race that returned early can't be interrupted and finish in the background (within timeout), so
+    max_workers should cover two rounds of targets: the next tick's probes then never queue behind them.
+    With an interface, every probe goes through it (see tcp_probe).
+    """
+
+    def __init__(self, max_workers=8, resolver=None, interface=None):
+        self.resolver = resolver
+        self.interface = interface
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='probe')
+
+    def run(self, targets, winners, timeout=3):
+        """Probes every (host, port) of the targets dict concurrently.
+            Returns (winner, results) as soon as one of the winners keys succeeds, or once every probe has settled.
+            results maps each settled target name to its ProbeResult.
+        """
+        pending = {self._executor.submit(tcp_probe, host, port, timeout, self.resolver, self.interface): name for name, (host, port) in targets.items()}
+        results = {}
+        order = list(targets.keys())
+        try:
+            while pending:
+                done, _ = wait(pending.keys(), timeout=timeout + 1, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+                # Le premier gagnant dans l'ordre du fichier INI l'emporte parmi ceux qui ont déjà répondu
+                for name in order:
+                    if name in winners and results.get(name):
+                        return name, results
+            return None, results
+        finally:
+            # Les sondes pas encore lancées sont annulées, celles en cours se terminent d'elles-mêmes
+            for future in pending:
+                future.cancel()
+
+    def probe(self, host, port, timeout=3):
+        """Single tcp_probe() with the race's resolver and interface, in the caller's thread."""
+        return tcp_probe(host, port, timeout, self.resolver, self.interface)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
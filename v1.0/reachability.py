@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-process reachability checks, so that we don't have to fork a ping process every second."""
+
+import socket
+import struct
+import selectors
+import threading
+import time
+from urllib.parse import urlsplit
+
+from interfaces import bind_socket, source_address
+from resolver import ResolveError
+
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def _checksum(data):
+    """Internet checksum (RFC 1071)."""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _dns_query(query_id):
+    """Builds a minimal DNS query (type NS for the root zone) that any resolver answers."""
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + b'\x00' + struct.pack('!HH', 2, 1)
+
+
+class ReachabilityChecker:
+    """Tells whether the internet is reachable, without any subprocess.
+
+    methods is the order of preference: the first one available on this machine is used.
+        - 'icmp': unprivileged ICMP datagram sockets (Linux with net.ipv4.ping_group_range, MAC OS)
+        - 'http': GET on http_urls, expecting a 204 that a captive portal would hijack (the fallback)
+        - 'udp':  DNS query to the hosts (captive portals usually let DNS through: only use it where they don't)
+        - 'tcp':  TCP handshake with the hosts on tcp_port (only meaningful on a port the portal blocks before login)
+    Every host is probed at once and check() returns as soon as one of them answers.
+    Each calling thread (monitor, renewal...) has its own ICMP socket and sequence numbers, so that concurrent checks
+    don't read each other's replies. With an interface, every socket is bound to it (see interfaces.bind_socket); an
+    ICMP socket bound to the interface's address is reopened when that address changes.
+    """
+
+    def __init__(self, hosts=('8.8.8.8', '1.1.1.1'), timeout=0.5, methods=('icmp', 'http'),
+                 tcp_port=443, http_urls=('http://clients3.google.com/generate_204',), resolver=None, interface=None):
+        self.resolver = resolver
+        self.interface = interface
+        self.hosts = tuple(hosts)
+        self.timeout = timeout
+        self.tcp_port = tcp_port
+        self.http_urls = tuple(http_urls)
+        self._local = threading.local()
+        self._icmpSockets = []
+        self._lock = threading.Lock()
+        self.method = None
+        for method in methods:
+            if method == 'icmp' and not self._icmp_available():
+                continue
+            self.method = method
+            break
+        if self.method is None:
+            self.method = 'http'
+
+    @staticmethod
+    def _icmp_available():
+        try:
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+            return True
+        except (OSError, AttributeError):
+            return False
+
+    def _icmp_socket(self):
+        """ICMP socket of the calling thread, opened (and bound to the interface) on its first check."""
+        sock = getattr(self._local, 'icmpSocket', None)
+        if sock is not None and self.interface is not None and source_address(self.interface) != self._local.icmpAddress:
+            #L'interface a changé d'adresse : la socket liée à l'ancienne n'envoie plus rien
+            with self._lock:
+                self._icmpSockets.remove(sock)
+            sock.close()
+            sock = None
+        if sock is None:
+            address = source_address(self.interface)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            try:
+                sock.setblocking(False)
+                bind_socket(sock, self.interface)
+            except OSError:
+                sock.close()
+                raise
+            self._local.icmpSocket = sock
+            self._local.icmpAddress = address
+            with self._lock:
+                self._icmpSockets.append(sock)
+        return sock
+
+    def _next_sequence(self):
+        self._local.sequence = (getattr(self._local, 'sequence', 0) + 1) & 0xffff
+        return self._local.sequence
+
+    def check(self, timeout=None):
+        """Returns True if at least one host answers within timeout seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            return getattr(self, '_check_' + self.method)(deadline)
+        except OSError:
+            return False
+
+    __call__ = check
+
+    @staticmethod
+    def _remaining(deadline):
+        return max(0, deadline - time.monotonic())
+
+    def _check_icmp(self, deadline):
+        sock = self._icmp_socket()
+        # On vide les réponses en retard des appels précédents
+        try:
+            while sock.recv(1024):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        sequence = self._next_sequence()
+        payload = struct.pack('!d', time.time())
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, 0, sequence)
+        packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, _checksum(header + payload), 0, sequence) + payload
+        sent = 0
+        for host in self.hosts:
+            try:
+                sock.sendto(packet, (host, 0))
+                sent += 1
+            except OSError:
+                pass
+        if not sent:
+            return False
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_READ)
+            while self._remaining(deadline) > 0:
+                if not selector.select(self._remaining(deadline)):
+                    break
+                try:
+                    data = sock.recv(1024)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    continue
+                # Les sockets ICMP datagramme ne renvoient pas l'en-tête IP
+                if len(data) >= 8:
+                    icmpType, _, _, _, replySequence = struct.unpack('!BBHHH', data[:8])
+                    if icmpType == ICMP_ECHO_REPLY and replySequence == sequence:
+                        return True
+        return False
+
+    def _check_udp(self, deadline):
+        sequence = self._next_sequence()
+        sockets = []
+        try:
+            with selectors.DefaultSelector() as selector:
+                for host in self.hosts:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sockets.append(sock)
+                    bind_socket(sock, self.interface)
+                    sock.setblocking(False)
+                    try:
+                        sock.connect((host, 53))
+                        sock.send(_dns_query(sequence))
+                        selector.register(sock, selectors.EVENT_READ)
+                    except OSError:
+                        pass
+                while selector.get_map() and self._remaining(deadline) > 0:
+                    for key, _ in selector.select(self._remaining(deadline)):
+                        try:
+                            data = key.fileobj.recv(512)
+                        except OSError:
+                            selector.unregister(key.fileobj)
+                            continue
+                        if len(data) >= 12 and struct.unpack('!H', data[:2])[0] == sequence:
+                            return True
+            return False
+        finally:
+            for sock in sockets:
+                sock.close()
+
+    def _check_tcp(self, deadline):
+        return self._race_tcp([(host, self.tcp_port, None) for host in self.hosts], deadline)
+
+    def _check_http(self, deadline):
+        targets = []
+        for url in self.http_urls:
+            parts = urlsplit(url)
+            request = ('GET ' + (parts.path or '/') + (('?' + parts.query) if parts.query else '') + ' HTTP/1.0\r\n'
+                       'Host: ' + parts.netloc + '\r\nConnection: close\r\n\r\n').encode('ascii')
+            targets.append((parts.hostname, parts.port or 80, request))
+        return self._race_tcp(targets, deadline)
+
+    def _race_tcp(self, targets, deadline):
+        """Non-blocking TCP connects to every (host, port, request) target.
+            Without a request, a completed handshake is enough; with one, the answer must be an HTTP 204.
+        """
+        sockets = []
+        try:
+            with selectors.DefaultSelector() as selector:
+                for host, port, request in targets:
+                    try:
+                        if self.resolver is not None:
+                            address = (self.resolver.resolve(host, self._remaining(deadline))[0], port)
+                        else:
+                            address = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+                    except (OSError, UnicodeError, ResolveError):
+                        continue
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    sockets.append(sock)
+                    bind_socket(sock, self.interface)
+                    sock.setblocking(False)
+                    sock.connect_ex(address)
+                    selector.register(sock, selectors.EVENT_WRITE, request)
+                while selector.get_map() and self._remaining(deadline) > 0:
+                    for key, events in selector.select(self._remaining(deadline)):
+                        sock, request = key.fileobj, key.data
+                        if events & selectors.EVENT_WRITE:
+                            if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                                selector.unregister(sock)
+                            elif request is None:
+                                return True
+                            else:
+                                try:
+                                    sock.send(request)
+                                    selector.modify(sock, selectors.EVENT_READ, request)
+                                except OSError:
+                                    selector.unregister(sock)
+                        else:
+                            try:
+                                statusLine = sock.recv(64).split(b'\r\n', 1)[0].split()
+                            except OSError:
+                                statusLine = []
+                            if len(statusLine) >= 2 and statusLine[1] == b'204':
+                                return True
+                            selector.unregister(sock)
+            return False
+        finally:
+            for sock in sockets:
+                sock.close()
+
+    def close(self):
+        with self._lock:
+            sockets, self._icmpSockets = self._icmpSockets, []
+        for sock in sockets:
+            sock.close()
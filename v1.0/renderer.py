@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Terminal renderers for the view: coalesced differential redraws, or nothing at all in headless mode."""
+
+import os
+import platform
+import sys
+import threading
+import time
+
+
+class TerminalRenderer:
+    """Draws frames (lists of lines) in the terminal, rewriting only the lines that changed.
+
+    submit() only records which frame to draw: updates arriving within coalesce seconds are merged into one frame,
+    built when it's drawn so that it shows the latest state, and at most max_fps frames are drawn per second.
+    Lines are addressed with ANSI cursor positioning, so the screen is never cleared after the first frame.
+    """
+
+    def __init__(self, coalesce=0.05, max_fps=10, stream=None):
+        self.coalesce = coalesce
+        self.minFrameInterval = 1.0 / max_fps if max_fps else 0
+        self.stream = stream or sys.stdout
+        self._previousFrame = None
+        self._pendingBuilder = None
+        self._fullRedraw = True
+        self._lastFrameTime = 0
+        self._condition = threading.Condition()
+        if platform.system().lower() == "windows":
+            # Active l'interprétation des séquences ANSI dans la console Windows 10
+            os.system('')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, builder, full=False):
+        """Schedules the drawing of the frame returned by builder(). full forces a complete redraw."""
+        with self._condition:
+            self._pendingBuilder = builder
+            self._fullRedraw = self._fullRedraw or full
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pendingBuilder is None:
+                    self._condition.wait()
+            # On laisse les mises à jour qui arrivent en rafale s'accumuler, sans dépasser max_fps
+            time.sleep(max(self.coalesce, self._lastFrameTime + self.minFrameInterval - time.monotonic()))
+            with self._condition:
+                builder, full = self._pendingBuilder, self._fullRedraw
+                self._pendingBuilder, self._fullRedraw = None, False
+            try:
+                self._draw(builder(), full)
+            except Exception:
+                self._fullRedraw = True
+            self._lastFrameTime = time.monotonic()
+
+    def _draw(self, frame, full):
+        previous = self._previousFrame
+        out = []
+        if full or previous is None:
+            out.append('\x1b[H\x1b[2J')
+            out.append('\n'.join(frame))
+        else:
+            for row in range(max(len(frame), len(previous))):
+                line = frame[row] if row < len(frame) else ''
+                if row >= len(previous) or row >= len(frame) or line != previous[row]:
+                    out.append('\x1b[%d;1H%s\x1b[K' % (row + 1, line))
+        out.append('\x1b[%d;1H' % (len(frame) + 1))
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self._previousFrame = list(frame)
+
+
+class HeadlessRenderer:
+    """Renderer that draws nothing: the frames aren't even built."""
+
+    def submit(self, builder, full=False):
+        pass
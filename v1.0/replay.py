@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Records what the monitor observes to a trace file, and replays a trace in virtual time.
+
+A trace is a gzip file of JSON lines: a header (start time, INI file, stored session), then one compact array per event:
+    ["race", t, elapsed, winner, [[target, ok, stage, elapsed], ...]]   portal detection (ProbeRace.run)
+    ["tcp", t, elapsed, host, port, ok, stage]                          external host probe (ProbeRace.probe)
+    ["reach", t, elapsed, ok]                                           reachability check past the portal
+    ["portal", t, elapsed, url, kind, status, parsed, error]            portal login/logout (PortalClient.request)
+    ["net", t]                                                          network change notification
+
+On replay, the manager runs in the caller's thread under a VirtualClock (see clock.py): waits and probe durations only
+move the clock, so days of monitoring replay in milliseconds. Probes return the last result recorded at or before the
+virtual time, portal exchanges are served in the recorded order, and network changes wake the loop up at their time.
+Code that probes more or less often than the recorded run still gets a coherent world; portal requests that the trace
+doesn't contain fail with CONNECTION_ERROR and are counted as misses.
+"""
+
+import bisect
+import collections
+import configparser
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import portal_client
+from portal_client import PortalResult
+from probe import ProbeResult
+from login_parser import LoginPage, parse_login_page
+from clock import VirtualClock
+from eventbus import Event, SessionRenewed, StateChanged
+
+
+TRACE_VERSION = 2
+
+
+class TraceWriter:
+    """Thread-safe writer of trace events. The file is flushed every flush_interval seconds, and a truncated tail is ignored on reading."""
+
+    def __init__(self, path, flush_interval=5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._lastFlush = time.monotonic()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            if time.monotonic() - self._lastFlush > self.flush_interval:
+                self._file.flush()
+                self._lastFlush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_trace(path):
+    """Returns (header, events) of a trace file."""
+    events = []
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        header = json.loads(file.readline())
+        if header.get('version') not in (1, TRACE_VERSION):
+            raise ValueError("Version de trace non supportée : " + str(header.get('version')))
+        try:
+            for line in file:
+                events.append(json.loads(line))
+        except (EOFError, OSError, ValueError):
+            pass  # Trace interrompue : on garde ce qui a été écrit
+    return header, events
+
+
+def _portal_request_kind(data):
+    return 'logout' if 'logout_id' in data else 'login'
+
+
+class _Proxy:
+    def __init__(self, target, recorder):
+        self._target = target
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class _RecordingProbeRace(_Proxy):
+
+    def run(self, targets, winners, timeout=3):
+        start = time.time()
+        winner, results = self._target.run(targets, winners, timeout)
+        self._recorder.write(['race', start, time.time() - start, winner,
+                              [[name, result.ok, result.stage, round(result.elapsed, 6)] for name, result in results.items()]])
+        return winner, results
+
+    def probe(self, host, port, timeout=3):
+        start = time.time()
+        result = self._target.probe(host, port, timeout)
+        self._recorder.write(['tcp', start, time.time() - start, host, port, result.ok, result.stage])
+        return result
+
+
+class _RecordingReachability(_Proxy):
+
+    def check(self, timeout=None):
+        start = time.time()
+        ok = self._target.check(timeout)
+        self._recorder.write(['reach', start, time.time() - start, ok])
+        return ok
+
+    __call__ = check
+
+
+class _RecordingPortalClient(_Proxy):
+
+    def request(self, data, parser=None, idempotent=False):
+        start = time.time()
+        result = self._target.request(data, parser, idempotent)
+        self._recorder.write(['portal', start, time.time() - start, self._target.url, _portal_request_kind(data),
+                              result.status, result.parsed, None if result.error is None else str(result.error)])
+        return result
+
+
+class _RecordingNetworkMonitor(_Proxy):
+
+    def wait(self, timeout):
+        changed = self._target.wait(timeout)
+        if changed:
+            self._recorder.write(['net', time.time()])
+        return changed
+
+
+class Recorder:
+    """Records every probe result, portal exchange and network change seen by a ConnectionManager."""
+
+    def __init__(self, path):
+        self.writer = TraceWriter(path)
+
+    def write(self, record):
+        self.writer.write(record)
+
+    def attach(self, manager):
+        """Wraps the manager's probes, portal clients and network monitor. Call before start_monitoring()."""
+        model = manager.model
+        try:
+            with open(model.INI_FILE_NAME, encoding='utf-8') as file:
+                ini = file.read()
+        except OSError:
+            ini = None
+        self.write({'version': TRACE_VERSION, 'start': time.time(), 'ini': ini,
+                    'session': model.sessionStore.read(), 'netlink': manager.networkMonitor.available})
+        manager._probeRace = _RecordingProbeRace(manager._probeRace, self)
+        manager._reachability = _RecordingReachability(manager._reachability, self)
+        manager.networkMonitor = _RecordingNetworkMonitor(manager.networkMonitor, self)
+        factory = manager.portalClientFactory
+        manager.portalClientFactory = lambda url, **kwargs: _RecordingPortalClient(factory(url, **kwargs), self)
+
+    def close(self):
+        self.writer.close()
+
+
+class _Observations:
+    """Recorded results of one kind of probe, looked up by time (the last one at or before t, else the first one)."""
+
+    def __init__(self):
+        self.times = []
+        self.events = []
+
+    def append(self, event):
+        self.times.append(event[1])
+        self.events.append(event)
+
+    def at(self, t):
+        if not self.events:
+            return None
+        return self.events[max(0, bisect.bisect_right(self.times, t) - 1)]
+
+
+class _ReplayProbeRace:
+
+    def __init__(self, player):
+        self._player = player
+
+    def run(self, targets, winners, timeout=3):
+        event = self._player.observe('race')
+        if event is None:
+            return None, {}
+        _, _, _, winner, results = event
+        return winner, {name: ProbeResult(ok, stage, elapsed) for name, ok, stage, elapsed in results}
+
+    def probe(self, host, port, timeout=3):
+        event = self._player.observe(('tcp', host, port))
+        if event is None:
+            return ProbeResult(False, 'tcp', 0)
+        return ProbeResult(event[5], event[6], event[2])
+
+    def shutdown(self):
+        pass
+
+
+class _ReplayReachability:
+
+    def __init__(self, player):
+        self._player = player
+
+    def check(self, timeout=None):
+        event = self._player.observe('reach')
+        return bool(event and event[3])
+
+    __call__ = check
+
+
+class _ReplayPortalClient:
+
+    def __init__(self, player, url):
+        self._player = player
+        self.url = url
+
+    def request(self, data, parser=None, idempotent=False):
+        exchanges = self._player.portalExchanges[(self.url, _portal_request_kind(data))]
+        if not exchanges:
+            self._player.misses += 1
+            return PortalResult(portal_client.CONNECTION_ERROR, None, 'absent de la trace', 0)
+        _, _, elapsed, _, _, status, parsed, error = exchanges.popleft()
+        self._player.clock.advance(elapsed)
+        return PortalResult(status, None, error, elapsed, None if parsed is None else LoginPage(*parsed))
+
+    def prewarm(self, timeout=5):
+        return True
+
+    def close(self):
+        pass
+
+
+class _ReplayNetworkMonitor:
+    """Stands in for NetworkChangeMonitor: wait() moves the virtual clock, firing the renewal timers on the way,
+        and stops early at the recorded network changes.
+    """
+
+    def __init__(self, player, manager, available):
+        self._player = player
+        self._manager = manager
+        self._woken = False
+        self._nextChange = 0
+        self.available = available
+
+    def wakeup(self):
+        self._woken = True
+
+    def wait(self, timeout):
+        clock, scheduler, changes = self._player.clock, self._manager.model.renewalScheduler, self._player.netChanges
+        if clock.time() >= self._player.end:
+            self._manager.monitorConnectionState = False
+            return False
+        until = min(clock.time() + max(0, timeout), self._player.end)
+        change = changes[self._nextChange] if self._nextChange < len(changes) else None
+        changed = change is not None and change <= until
+        stopAt = max(clock.time(), change) if changed else until
+        while not self._woken:
+            deadline = scheduler.next_deadline(kind=None)
+            if deadline is None or deadline > stopAt:
+                break
+            clock.advance_to(deadline)
+            scheduler.run_due()
+        if self._woken:
+            self._woken = False
+            return False
+        clock.advance_to(stopAt)
+        if changed:
+            self._nextChange += 1
+        return changed
+
+    def close(self):
+        pass
+
+
+def _replay_manager_class(managerClass, player):
+    """managerClass, with the player's stand-ins instead of the resolver, probes and network monitor: a replay opens no socket."""
+
+    class ReplayManager(managerClass):
+
+        def _open_network(self):
+            self.resolver = None
+            self._probeRace = _ReplayProbeRace(player)
+            self._reachability = _ReplayReachability(player)
+            self.networkMonitor = _ReplayNetworkMonitor(player, self, player.header.get('netlink', False))
+
+    return ReplayManager
+
+
+class Player:
+    """Replays a trace through a fresh ConnectionModel/ConnectionManager running under a VirtualClock."""
+
+    def __init__(self, path):
+        self.header, events = read_trace(path)
+        self.start = self.header['start']
+        self.end = max([event[1] + (event[2] if len(event) > 2 else 0) for event in events] or [self.start])
+        self.observations = collections.defaultdict(_Observations)
+        self.portalExchanges = collections.defaultdict(collections.deque)
+        self.netChanges = []
+        events.sort(key=lambda event: event[1])  # Les événements sont écrits dans l'ordre où les appels se terminent
+        for event in events:
+            if event[0] == 'race':
+                self.observations['race'].append(event)
+            elif event[0] == 'tcp':
+                self.observations[('tcp', event[3], event[4])].append(event)
+            elif event[0] == 'reach':
+                self.observations['reach'].append(event)
+            elif event[0] == 'portal':
+                if self.header['version'] == 1 and event[6] is not None:
+                    event[6] = parse_login_page(event[6]) if event[4] == 'login' else None  # Les traces v1 gardaient la page entière
+                self.portalExchanges[(event[3], event[4])].append(event)
+            elif event[0] == 'net':
+                self.netChanges.append(event[1])
+        self.netChanges.sort()
+        self.eventCount = len(events)
+        self.clock = None
+        self.misses = 0
+
+    def observe(self, key):
+        """Returns the recorded observation of key at the current virtual time, and moves the clock by its duration."""
+        event = self.observations[key].at(self.clock.time()) if key in self.observations else None
+        if event is None:
+            self.misses += 1
+            return None
+        # Au moins une milliseconde, pour que les boucles qui attendent une réponse finissent par expirer
+        self.clock.advance(max(event[2], 0.001))
+        return event
+
+    def _replay_ini(self, iniFile, workDir):
+        """Writes to workDir the INI file of the replay: the recorded one (or iniFile), with the history, the metrics server
+            and netlink turned away from the real ones. The session and lifetimes files already live in workDir.
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        if iniFile is None:
+            config.read_string(self.header['ini'] or '')
+        else:
+            config.read(iniFile)
+        for section, option, value in (('History', 'directory', workDir), ('Metrics', 'enabled', 'no'), ('Monitor', 'mode', 'poll')):
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, option, value)
+        path = os.path.join(workDir, 'INSAConnect.ini')
+        with open(path, 'w', encoding='utf-8') as file:
+            config.write(file)
+        return path
+
+    def replay(self, modelClass, managerClass, iniFile=None, seed=0, log=None):
+        """Runs the monitor loop over the whole trace and returns a report dict.
+            log, if given, is called with (virtual timestamp, event) for every event the model publishes.
+        """
+        self.clock = VirtualClock(self.start)
+        self.misses = 0
+        workDir = tempfile.mkdtemp(prefix='INSAConnect-replay-')
+        try:
+            model = modelClass(iniFile=self._replay_ini(iniFile, workDir), sessionDir=workDir, clock=self.clock)
+            if self.header.get('session'):
+                model.sessionStore.write(self.header['session'])
+            model.renewalScheduler.random.seed(seed)
+            timeline = []
+
+            def onEvent(event):
+                if isinstance(event, SessionRenewed) or (isinstance(event, StateChanged) and event.name == 'connectedThroughCaptivePortal'):
+                    timeline.append((self.clock.time(), event))
+                if log:
+                    log(self.clock.time(), event)
+            model.events.subscribe(Event, onEvent)
+
+            manager = _replay_manager_class(managerClass, self)(headless=True, model=model)
+            manager.portalClientFactory = lambda url, **kwargs: _ReplayPortalClient(self, url)
+            model.renewalScheduler.start(manager._on_renewal_due)
+
+            wallStart = time.perf_counter()
+            manager.run(manager)
+            wallSeconds = time.perf_counter() - wallStart
+            model.renewalScheduler.stop()
+            manager.leader.release()
+
+            metrics = manager.metrics.as_dict()
+            gaps = [gap for _, gap in model.renewalGaps]
+            return {'virtual_seconds': self.clock.time() - self.start,
+                    'wall_seconds': wallSeconds,
+                    'trace_events': self.eventCount,
+                    'misses': self.misses,
+                    'sessions': sum(1 for _, event in timeline if isinstance(event, SessionRenewed)),
+                    'state_seconds': metrics['state_seconds'],
+                    'state_transitions': metrics['state_transitions'],
+                    'renewal_gaps': gaps,
+                    'timeline': [(t - self.start, event) for t, event in timeline]}
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+
+def print_report(report):
+    print("Durée rejouée : %.0f s en %.3f s (x%.0f), %d événements, %d absents de la trace"
+          % (report['virtual_seconds'], report['wall_seconds'],
+             report['virtual_seconds'] / report['wall_seconds'] if report['wall_seconds'] else 0,
+             report['trace_events'], report['misses']))
+    print("Sessions obtenues : %d" % report['sessions'])
+    for state, seconds in sorted(report['state_seconds'].items()):
+        print("  %-28s %10.1f s  (%d fois)" % (state, seconds, report['state_transitions'].get(state, 0)))
+    gaps = [gap for gap in report['renewal_gaps'] if gap is not None]
+    if report['renewal_gaps']:
+        print("Renouvellements : %d, coupure moyenne %.3f s, %d sans retour de la connexion"
+              % (len(report['renewal_gaps']), sum(gaps) / len(gaps) if gaps else 0, len(report['renewal_gaps']) - len(gaps)))
+    for t, event in report['timeline']:
+        print("  +%9.1f s  %r" % (t, event))
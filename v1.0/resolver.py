@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""DNS cache for the probed hosts, so that a probe doesn't start with a blocking name lookup on every tick."""
+
+import ipaddress
+import random
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from interfaces import bind_socket
+
+
+def _read_nameservers(path='/etc/resolv.conf'):
+    nameservers = []
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    try:
+                        if ipaddress.ip_address(fields[1]).version == 4:
+                            nameservers.append(fields[1])
+                    except ValueError:
+                        pass
+    except OSError:
+        pass
+    return nameservers
+
+
+def _skip_name(data, offset):
+    """Returns the offset right after the (possibly compressed) domain name starting at offset."""
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xc0 == 0xc0:
+            return offset + 2
+        offset += length + 1
+
+
+def query_a(host, nameserver, timeout, interface=None):
+    """Asks nameserver (through interface, if not None) for the A records of host. Returns (addresses, ttl), or None if there is no usable answer."""
+    queryID = random.getrandbits(16)
+    question = b''.join(bytes([len(label)]) + label for label in host.rstrip('.').encode('idna').split(b'.')) + b'\x00'
+    packet = struct.pack('!HHHHHH', queryID, 0x0100, 1, 0, 0, 0) + question + struct.pack('!HH', 1, 1)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        bind_socket(sock, interface)
+        sock.settimeout(timeout)
+        sock.connect((nameserver, 53))
+        sock.send(packet)
+        deadline = time.monotonic() + timeout
+        while True:
+            sock.settimeout(max(0.001, deadline - time.monotonic()))
+            data = sock.recv(4096)
+            if len(data) >= 12 and struct.unpack('!H', data[:2])[0] == queryID:
+                break
+    return _parse_a_answer(data)
+
+
+def _parse_a_answer(data):
+    """(addresses, ttl) of the A records of the DNS response data, or None if there is no usable answer."""
+    flags, questions, answers = struct.unpack('!HHH', data[2:8])
+    if flags & 0x000f or flags & 0x0200:  # Erreur (NXDOMAIN...) ou réponse tronquée
+        return None
+    offset = 12
+    for _ in range(questions):
+        offset = _skip_name(data, offset) + 4
+    addresses, ttl = [], None
+    for _ in range(answers):
+        offset = _skip_name(data, offset)
+        recordType, recordClass, recordTTL, length = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        if recordClass == 1:
+            ttl = recordTTL if ttl is None else min(ttl, recordTTL)  # Chaîne de CNAME : le plus petit TTL l'emporte
+            if recordType == 1 and length == 4:
+                addresses.append(socket.inet_ntoa(data[offset:offset + 4]))
+        offset += length
+    return (addresses, ttl) if addresses else None
+
+
+def _is_loopback(nameserver):
+    try:
+        return ipaddress.ip_address(nameserver).is_loopback
+    except ValueError:
+        return False
+
+
+class ResolveError(Exception):
+    pass
+
+
+class DNSCache:
+    """TTL-respecting cache of IPv4 addresses.
+
+    Lookups are sent straight to the nameservers of /etc/resolv.conf so that the answer's TTL is known; when that
+    isn't possible (Windows, /etc/hosts names...) the system resolver is used and entries live default_ttl seconds.
+    An expired entry is still served for up to stale_ttl seconds while it is refreshed in the background, and
+    failures are cached negative_ttl seconds so that a broken DNS doesn't stall every probe.
+    A lookup never takes longer than its timeout, whatever the number of nameservers. The system resolver can't be
+    interrupted: the probes' lookups run on their own lookup_slots threads (not the ones of the background refreshes),
+    and fail at once when they are all stuck.
+    With an interface, the queries to the nameservers go through it, except those to a local resolver (systemd-resolved's
+    127.0.0.53...), which is only reachable through the loopback and picks the link to ask itself. The system resolver
+    can't be bound: it would ask whatever link the default route goes through, so it is only used when /etc/resolv.conf
+    lists no nameserver (/etc/hosts names then don't resolve on a bound link).
+    """
+
+    def __init__(self, default_ttl=300, min_ttl=5, max_ttl=3600, stale_ttl=86400, negative_ttl=5, nameservers=None, interface=None,
+                 lookup_slots=4):
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.nameservers = _read_nameservers() if nameservers is None else list(nameservers)
+        self.interface = interface
+        self._entries = {}  # host -> (addresses, expiry) ; addresses est None pour un échec
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dns')
+        self._lookupExecutor = ThreadPoolExecutor(max_workers=lookup_slots, thread_name_prefix='dns-lookup')
+        self._lookupSlots = threading.BoundedSemaphore(lookup_slots)
+
+    def _getaddrinfo(self, host):
+        try:
+            return socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+        finally:
+            self._lookupSlots.release()
+
+    def _lookup(self, host, timeout):
+        """Resolves host without the cache, within timeout seconds in all. Returns (addresses, ttl). Raises ResolveError."""
+        deadline = time.monotonic() + timeout
+        for nameserver in self.nameservers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ResolveError(host)
+            try:
+                answer = query_a(host, nameserver, remaining, None if _is_loopback(nameserver) else self.interface)
+            except (OSError, UnicodeError, struct.error, IndexError):
+                continue
+            if answer:
+                return answer
+        if self.interface is not None and self.nameservers:
+            raise ResolveError(host)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not self._lookupSlots.acquire(blocking=False):
+            # Budget épuisé, ou tous les threads coincés dans getaddrinfo() : inutile de faire la queue derrière eux
+            raise ResolveError(host)
+        future = self._lookupExecutor.submit(self._getaddrinfo, host)
+        try:
+            infos = future.result(timeout=remaining)
+        except Exception as e:
+            raise ResolveError(host) from e
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if not addresses:
+            raise ResolveError(host)
+        return addresses, self.default_ttl
+
+    def _store(self, host, addresses, ttl):
+        with self._lock:
+            self._entries[host] = (addresses, time.monotonic() + ttl)
+
+    def _refresh(self, host, timeout):
+        try:
+            addresses, ttl = self._lookup(host, timeout)
+            self._store(host, addresses, min(max(ttl, self.min_ttl), self.max_ttl))
+        except ResolveError:
+            # On garde l'ancienne réponse tant qu'elle n'est pas trop vieille
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(host)
+
+    def resolve(self, host, timeout=3):
+        """Returns the list of addresses of host. Raises ResolveError if it can't be resolved."""
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+        if entry:
+            addresses, expiry = entry
+            if now < expiry:
+                if addresses is None:
+                    raise ResolveError(host)
+                return addresses
+            if addresses is not None and now < expiry + self.stale_ttl:
+                with self._lock:
+                    refresh = host not in self._refreshing
+                    self._refreshing.add(host)
+                if refresh:
+                    self._executor.submit(self._refresh, host, timeout)
+                return addresses
+        try:
+            addresses, ttl = self._lookup(host, timeout)
+        except ResolveError:
+            self._store(host, None, self.negative_ttl)
+            raise
+        self._store(host, addresses, min(max(ttl, self.min_ttl), self.max_ttl))
+        return addresses
+
+    def prefetch(self, hosts, timeout=3):
+        """Resolves hosts in the background so that the first probes find them in the cache."""
+        for host in hosts:
+            self._executor.submit(self._prefetch_one, host, timeout)
+
+    def _prefetch_one(self, host, timeout):
+        try:
+            self.resolve(host, timeout)
+        except ResolveError:
+            pass
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Deadline scheduler for session renewals, so that the monitor loop doesn't have to check the expiry on every tick."""
+
+import heapq
+import itertools
+import random
+import threading
+
+from clock import SystemClock
+
+
+class RenewalScheduler:
+    """Heap of timers, one renewal (and one pre-warm) per captive portal session.
+
+    schedule() arms the renewal lead..lead+jitter seconds before the session expires, and the pre-warm prewarm_lead
+    seconds before that. The callback is called as callback(key, kind) from the scheduler's own thread, kind being
+    'prewarm' or 'renew', so renewals stay on time even when the monitor loop is held up.
+    After a failed renewal, failed() re-arms it with an exponential backoff until the session expires.
+    With a virtual clock (see clock.py), the thread isn't started: whoever moves the clock calls run_due().
+    """
+
+    def __init__(self, lead=60, jitter=10, prewarm_lead=5, retry_delay=5, max_retry_delay=60, clock=None):
+        self.lead = lead
+        self.jitter = jitter
+        self.prewarm_lead = prewarm_lead
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.clock = clock or SystemClock()
+        self.random = random.Random()
+        self.callback = None
+        self._heap = []
+        self._counter = itertools.count()
+        self._timers = {}  # (key, kind) -> numéro du timer actif, les entrées périmées du tas sont ignorées
+        self._expiries = {}
+        self._attempts = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def _push(self, key, kind, deadline):
+        sequence = next(self._counter)
+        self._timers[(key, kind)] = sequence
+        heapq.heappush(self._heap, (deadline, sequence, key, kind))
+
+    def schedule(self, key, expiry):
+        """Arms (or re-arms) the renewal of key's session, which expires at the expiry timestamp."""
+        if expiry == float('inf'):
+            return
+        with self._condition:
+            self._expiries[key] = expiry
+            self._attempts[key] = 0
+            deadline = expiry - self.lead - self.random.uniform(0, self.jitter)
+            if self.prewarm_lead > 0:
+                self._push(key, 'prewarm', deadline - self.prewarm_lead)
+            self._push(key, 'renew', deadline)
+            self._condition.notify()
+
+    def cancel(self, key):
+        """Forgets about key's session."""
+        with self._condition:
+            for kind in ('prewarm', 'renew'):
+                self._timers.pop((key, kind), None)
+            self._expiries.pop(key, None)
+            self._attempts.pop(key, None)
+            self._condition.notify()
+
+    def failed(self, key):
+        """Re-arms a renewal that failed, with exponential backoff and jitter. Gives up once the session has expired."""
+        with self._condition:
+            if key not in self._expiries:
+                return
+            self._attempts[key] += 1
+            delay = min(self.retry_delay * 2 ** (self._attempts[key] - 1), self.max_retry_delay) * self.random.uniform(0.5, 1)
+            if self.clock.time() + delay < self._expiries[key]:
+                self._push(key, 'renew', self.clock.time() + delay)
+                self._condition.notify()
+
+    def next_deadline(self, key=None, kind='renew'):
+        """Returns the timestamp of the next pending timer (of key and kind, any kind if kind is None), or None."""
+        with self._condition:
+            deadlines = [deadline for deadline, sequence, k, kd in self._heap
+                         if kind in (None, kd) and (key is None or k == key) and self._timers.get((k, kd)) == sequence]
+            return min(deadlines) if deadlines else None
+
+    def start(self, callback):
+        """Starts firing the timers in a background thread, or, with a virtual clock, whenever run_due() is called."""
+        self.callback = callback
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        if self.clock.virtual:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _next_due(self):
+        """Pops and returns the next live timer if it is due. Otherwise returns the delay before it (None if there is none).
+            Call with the lock held.
+        """
+        while self._heap and self._timers.get((self._heap[0][2], self._heap[0][3])) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        delay = self._heap[0][0] - self.clock.time()
+        if delay > 0:
+            return delay
+        _, _, key, kind = heapq.heappop(self._heap)
+        del self._timers[(key, kind)]
+        return key, kind
+
+    def _pop_due(self):
+        """Waits for the next live timer to be due and returns it (or None when stopping)."""
+        with self._condition:
+            while self._running:
+                due = self._next_due()
+                if isinstance(due, tuple):
+                    return due
+                self._condition.wait(due)
+            return None
+
+    def _fire(self, due):
+        try:
+            self.callback(*due)
+        except Exception:
+            if due[1] == 'renew':
+                self.failed(due[0])
+
+    def run_due(self):
+        """Fires the timers that are due, in the caller's thread (for a virtual clock)."""
+        while True:
+            with self._condition:
+                due = self._next_due()
+            if not isinstance(due, tuple):
+                break
+            self._fire(due)
+
+    def _run(self):
+        while True:
+            due = self._pop_due()
+            if due is None:
+                break
+            self._fire(due)
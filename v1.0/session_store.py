@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keeps the current session in memory and in a small fixed-layout file shared between instances."""
+
+import math
+import os
+import struct
+import sys
+import tempfile
+import datetime
+
+
+class SessionStore:
+    """In-memory copy of the session file that only goes back to the disk when the file actually changed.
+
+    The record is fixed-size: magic, version, login and end timestamps, captive portal name and session ID (UTF-8, NUL-padded,
+    FIELD_SIZE bytes at most: longer values are cut at a character boundary, with a warning on stderr).
+    Writes go to a temporary file that is renamed over the old one, so readers never see a half-written session.
+    The file is private to its user (mode 0600), like the lock next to it.
+    """
+
+    MAGIC = b'INSA'
+    VERSION = 2
+    FIELD_SIZE = 64
+    RECORD = struct.Struct('<4sHdd64s64s')
+
+    def __init__(self, path):
+        self.path = path
+        self._signature = None
+        self._session = None
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def read(self):
+        """Returns the stored session dict (or None). The file is only re-read if its inode, mtime or size changed."""
+        signature = self._stat_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self._session = self._load() if signature else None
+        return self._session
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read(self.RECORD.size + 1)
+        except OSError:
+            return None
+        if len(data) != self.RECORD.size:
+            return None
+        magic, version, start_timestamp, end_timestamp, captive_portal, sessionID = self.RECORD.unpack(data)
+        if magic != self.MAGIC or version != self.VERSION:
+            return None
+        return {'captive_portal': self._decode(captive_portal),
+                'ID': self._decode(sessionID),
+                'start_timestamp': None if math.isnan(start_timestamp) else start_timestamp,
+                'end_timestamp': end_timestamp,
+                'end_time': datetime.datetime.fromtimestamp(end_timestamp).strftime('%H:%M')}
+
+    def write(self, session):
+        """Atomically replaces the stored session."""
+        start_timestamp = session.get('start_timestamp')
+        captive_portal, sessionID = self._encode(session['captive_portal'], 'captive_portal'), self._encode(session['ID'], 'ID')
+        data = self.RECORD.pack(self.MAGIC, self.VERSION, float('nan') if start_timestamp is None else start_timestamp, session['end_timestamp'],
+                                captive_portal, sessionID)
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmpPath = tempfile.mkstemp(prefix='.' + os.path.basename(self.path) + '.', dir=directory)
+        try:
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmpPath, self.path)
+        except OSError:
+            try:
+                os.unlink(tmpPath)
+            except OSError:
+                pass
+            raise
+        self._signature = self._stat_signature()
+        #La copie en mémoire est ce qui a été écrit, pas ce qui a été demandé
+        self._session = dict(session, captive_portal=self._decode(captive_portal), ID=self._decode(sessionID))
+
+    @classmethod
+    def _encode(cls, value, field):
+        data = ('' if value is None else str(value)).encode('utf-8')
+        if len(data) > cls.FIELD_SIZE:
+            data = data[:cls.FIELD_SIZE].decode('utf-8', 'ignore').encode('utf-8')
+            sys.stderr.write("INSAConnect : " + field + " tronqué à " + str(cls.FIELD_SIZE) + " octets dans le fichier de session\n")
+        return data
+
+    @staticmethod
+    def _decode(value):
+        return value.rstrip(b'\x00').decode('utf-8', 'replace') or None
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Startup milestones (imports done, first probe, first state...), timed from the import of this module.
+
+The main script imports it first, so the times cover its own imports. Each milestone is only recorded the first time.
+"""
+
+import time
+
+ORIGIN = time.perf_counter()
+milestones = {}
+
+
+def mark(name):
+    """Records the time elapsed since startup the first time name is reached."""
+    if name not in milestones:
+        milestones[name] = time.perf_counter() - ORIGIN
+
+
+def report():
+    """Milestones as text, in the order they were reached, like python -X importtime."""
+    lines = ['startup: %10s | milestone' % 'ms']
+    for name, seconds in sorted(milestones.items(), key=lambda item: item[1]):
+        lines.append('startup: %10.1f | %s' % (seconds * 1000, name))
+    return '\n'.join(lines)
@@ -0,0 +1,33 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Les modules de v1.0 sont des fichiers à plat, importés comme par le script principal
+sys.path.insert(0, ROOT)
+
+from clock import VirtualClock  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def insaconnect():
+    """The main script, imported as a module."""
+    spec = importlib.util.spec_from_file_location('INSAConnect', os.path.join(ROOT, 'INSAConnect_v1.0.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def ini_file():
+    """The shipped INSAConnect.ini."""
+    return os.path.join(ROOT, 'INSAConnect.ini')
+
+
+@pytest.fixture
+def model(insaconnect, ini_file, tmp_path):
+    """ConnectionModel of the shipped INI, with its files in tmp_path and a VirtualClock."""
+    return insaconnect.ConnectionModel(ini_file, sessionDir=str(tmp_path), clock=VirtualClock(1700000000))
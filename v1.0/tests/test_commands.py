@@ -0,0 +1,79 @@
+import threading
+import time
+
+from clock import VirtualClock
+from commands import CommandQueue
+
+
+def test_identical_command_is_single_flight():
+    queue = CommandQueue()
+    release = threading.Event()
+    calls = []
+
+    def login(captive_portal):
+        calls.append(captive_portal)
+        release.wait(5)
+        return captive_portal
+    first = queue.submit('connect', login, 'INVITEINSA')
+    assert queue.submit('connect', login, 'INVITEINSA') is first
+    release.set()
+    assert first.result(5) == 'INVITEINSA'
+    assert calls == ['INVITEINSA']
+    # Une fois terminée, la commande peut être relancée
+    assert queue.submit('connect', login, 'INVITEINSA').result(5) == 'INVITEINSA'
+    assert calls == ['INVITEINSA', 'INVITEINSA']
+    queue.shutdown()
+
+
+def test_command_for_another_portal_is_not_merged():
+    queue = CommandQueue()
+    release = threading.Event()
+    calls = []
+
+    def login(captive_portal):
+        calls.append(captive_portal)
+        release.wait(5)
+        return captive_portal
+    first = queue.submit('connect', login, 'INSA/Promologis')
+    second = queue.submit('connect', login, 'INVITEINSA')
+    assert second is not first
+    release.set()
+    assert (first.result(5), second.result(5)) == ('INSA/Promologis', 'INVITEINSA')
+    assert calls == ['INSA/Promologis', 'INVITEINSA']
+    queue.shutdown()
+
+
+def test_commands_run_one_at_a_time_in_order():
+    queue = CommandQueue()
+    running = []
+    overlaps = []
+
+    def operation(name):
+        overlaps.append(len(running))
+        running.append(name)
+        time.sleep(0.01)
+        running.remove(name)
+        return name
+    futures = [queue.submit(name, operation, name) for name in ('disconnect', 'connect', 'reconnect')]
+    assert [future.result(5) for future in futures] == ['disconnect', 'connect', 'reconnect']
+    assert overlaps == [0, 0, 0]
+    queue.shutdown()
+
+
+def test_failed_command_is_forgotten():
+    queue = CommandQueue()
+
+    def fail():
+        raise OSError("portail injoignable")
+    future = queue.submit('connect', fail)
+    assert isinstance(future.exception(5), OSError)
+    assert queue.submit('connect', lambda: 'ok').result(5) == 'ok'
+    queue.shutdown()
+
+
+def test_virtual_clock_runs_commands_inline():
+    queue = CommandQueue(VirtualClock(0))
+    future = queue.submit('connect', threading.current_thread)
+    assert future.done() and future.result() is threading.current_thread()
+    assert isinstance(queue.submit('connect', int, 'x').exception(), ValueError)
+    queue.shutdown()
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import threading
+import time
+from threading import Event
+
+from clock import SystemClock, VirtualClock
+from metrics import Metrics
+
+
+class _Reachability:
+
+    def check(self, timeout=None):
+        return True
+
+
+def _manager(insaconnect, model, login):
+    """ConnectionManager reduced to what _reconnect() uses, with the portal requests stubbed out."""
+    manager = insaconnect.ConnectionManager.__new__(insaconnect.ConnectionManager)
+    manager.model = model
+    manager.clock = model.clock
+    manager.metrics = Metrics(model.clock)
+    manager._reachability = _Reachability()
+    manager._logout = lambda captive_portal, sessionID: True
+    manager._login = login
+    return manager
+
+
+def test_renewal_is_not_a_session_death(insaconnect, model):
+    model.setCurrentSession('INVITEINSA', 'first')
+    model.clock.advance(1000)
+
+    def login(captive_portal):
+        # Le monitor voit la coupure entre le logout et le login
+        model.sessionLost()
+        model.clock.advance(0.5)
+        return 'second'
+    _manager(insaconnect, model, login)._reconnect('INVITEINSA')
+    assert model.currentSession['ID'] == 'second'
+    assert model.lifetimes.portals['INVITEINSA']['samples'] == [[1000, False]]
+
+
+def test_session_cut_by_the_portal_is_a_death(model):
+    model.setCurrentSession('INVITEINSA', 'first')
+    model.clock.advance(700)
+    model.sessionLost()
+    model.clock.advance(30)
+    model.setCurrentSession('INVITEINSA', 'second')
+    assert model.lifetimes.portals['INVITEINSA']['samples'] == [[700, True]]
+
+
+class _Network:
+    """Reachability stand-in: every check takes delay seconds of the clock, and the network is back from back_at."""
+
+    def __init__(self, clock, back_at, delay=0.05):
+        self.clock = clock
+        self.back_at = back_at
+        self.delay = delay
+        self.checks = 0
+
+    def check(self, timeout=None):
+        self.checks += 1
+        self.clock.sleep(self.delay)
+        return self.clock.time() >= self.back_at
+
+
+def _gap_watcher(insaconnect, clock, network):
+    manager = insaconnect.ConnectionManager.__new__(insaconnect.ConnectionManager)
+    manager.clock = clock
+    manager._reachability = network
+    return manager
+
+
+def test_offline_gap_after_the_login(insaconnect):
+    clock = VirtualClock(1000)
+    loginDone = Event()
+    loginDone.set()
+    network = _Network(clock, back_at=1000.5)
+    gap = _gap_watcher(insaconnect, clock, network)._measure_offline_gap(1000, loginDone)
+    assert 0.5 <= gap < 0.7  # Vérifications espacées de probeTimeout (0.2 s)
+    assert network.checks > 1
+
+
+def test_offline_gap_gives_up_after_the_timeout(insaconnect):
+    clock = VirtualClock(1000)
+    loginDone = Event()
+    loginDone.set()
+    assert _gap_watcher(insaconnect, clock, _Network(clock, back_at=float('inf')))._measure_offline_gap(1000, loginDone, timeout=5) is None
+    assert 1005 <= clock.time() <= 1005.3
+
+
+def test_offline_gap_is_checked_as_soon_as_the_login_ends(insaconnect):
+    clock = SystemClock()
+    loginDone = Event()
+    network = _Network(clock, back_at=float('inf'), delay=0)
+    start = clock.time()
+
+    def login():
+        time.sleep(0.1)
+        network.back_at = clock.time()
+        loginDone.set()
+    threading.Thread(target=login).start()
+    gap = _gap_watcher(insaconnect, clock, network)._measure_offline_gap(start, loginDone, probeTimeout=2)
+    # Sans réveil à la fin du login, la vérification suivante n'aurait lieu qu'au bout de probeTimeout
+    assert gap < 1
+
+
+def test_settings_create_no_directory(insaconnect, ini_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    settings = insaconnect.ConnectionModel.settings(ini_file)
+    assert settings.SESSION_DIRECTORY.startswith(str(tmp_path))
+    assert os.listdir(str(tmp_path)) == []
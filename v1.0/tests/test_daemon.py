@@ -0,0 +1,145 @@
+import getpass
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import daemon
+from eventbus import EventBus, StateChanged
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="sockets UNIX indisponibles")
+
+
+class _Model:
+
+    def __init__(self):
+        self.events = EventBus()
+        self.connectionStateText = "Connecté"
+        self.connectedThroughCaptivePortal = True
+        self.portalStatus = 'ok'
+        self.currentSession = {'captive_portal': 'INVITEINSA', 'ID': 'abc', 'start_timestamp': 0, 'end_timestamp': float('inf'), 'end_time': float('inf')}
+
+
+class _Manager:
+
+    def __init__(self):
+        self.model = _Model()
+        self.currentCaptivePortal = 'INVITEINSA'
+        self.autoManageConnection = True
+        self.commands = []
+
+    def _done(self, name):
+        self.commands.append(name)
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def connect(self):
+        return self._done('connect')
+
+    def disconnect(self):
+        return self._done('disconnect')
+
+    def reconnect(self):
+        return self._done('reconnect')
+
+    def setAutoConnectionManagement(self, bool_=None):
+        self.autoManageConnection = (not self.autoManageConnection) if bool_ is None else bool_
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = daemon.ControlServer(_Manager(), str(tmp_path / 'INSAConnect.sock'))
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_socket_is_private(server):
+    assert os.stat(server.path).st_mode & 0o777 == 0o600
+    assert os.path.dirname(daemon.default_socket_path()).endswith('INSAConnect-' + getpass.getuser())
+
+
+def test_commands(server):
+    status = daemon.send_command('status', server.path)
+    assert status['ok'] and status['status']['session']['ID'] == 'abc'
+    assert status['status']['session']['end_timestamp'] is None  # inf n'est pas du JSON
+    assert daemon.send_command('reconnect', server.path)['ok']
+    assert daemon.send_command('set_auto', server.path, value=False)['status']['autoManageConnection'] is False
+    assert daemon.send_command('toggle_auto', server.path)['status']['autoManageConnection'] is True
+    assert daemon.send_command('frobnicate', server.path) == {'ok': False, 'error': 'unknown command: frobnicate'}
+    assert server.manager.commands == ['reconnect']
+
+
+def test_invalid_request_keeps_the_connection(server):
+    with daemon.connect(server.path, 5) as sock, sock.makefile('rb') as stream:
+        sock.sendall(b'not json\n{"command": "status"}\n')
+        assert not json.loads(stream.readline())['ok']
+        assert json.loads(stream.readline())['ok']
+
+
+def test_subscribers_get_the_changes(server):
+    with daemon.connect(server.path, 5) as sock, sock.makefile('rb') as stream:
+        sock.sendall(b'{"command": "subscribe"}\n')
+        assert json.loads(stream.readline())['ok']
+        server.manager.model.connectionStateText = "Déconnecté"
+        server.manager.model.events.publish(StateChanged('connectionStateText', "Déconnecté"))
+        assert json.loads(stream.readline())['status']['connectionStateText'] == "Déconnecté"
+
+
+def test_second_daemon_refuses_the_socket(server):
+    with pytest.raises(OSError):
+        daemon.ControlServer(_Manager(), server.path)
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / 'INSAConnect.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = daemon.ControlServer(_Manager(), path)
+    server.server_close()
+    assert not os.path.exists(path)
+
+
+@pytest.fixture
+def foreign_directory():
+    """World-writable directory where another user (nobody) can create a socket."""
+    if not hasattr(os, 'geteuid') or os.geteuid() != 0:
+        pytest.skip("nécessite root pour agir comme un autre utilisateur")
+    directory = tempfile.mkdtemp()
+    os.chmod(directory, 0o777)
+    yield directory
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_socket_of_another_user_is_not_trusted(foreign_directory):
+    path = os.path.join(foreign_directory, 'INSAConnect.sock')
+    listener = ("import os, socket, time\n"
+                "os.setgid(65534); os.setuid(65534)\n"
+                "s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); s.bind(%r); s.listen(1)\n"
+                "time.sleep(30)\n" % path)
+    process = subprocess.Popen([sys.executable, '-c', listener])
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        assert not daemon.is_daemon_running(path)
+        with pytest.raises(PermissionError):
+            daemon.connect(path, 1)
+        with pytest.raises(PermissionError):
+            daemon.ControlServer(_Manager(), path)
+    finally:
+        process.kill()
+        process.wait()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from eventbus import Event, EventBus, ProbeCompleted, SessionRenewed, StateChanged
+
+
+def test_synchronous_delivery_by_type_and_parent_type():
+    bus = EventBus()
+    states, everything = [], []
+    bus.subscribe(StateChanged, states.append)
+    bus.subscribe(Event, everything.append)
+    bus.publish(StateChanged('state', 'offline'))
+    bus.publish(SessionRenewed('INVITEINSA', 'abc', 0))
+    assert states == [StateChanged('state', 'offline')]
+    assert everything == [StateChanged('state', 'offline'), SessionRenewed('INVITEINSA', 'abc', 0)]
+
+
+def test_unsubscribe():
+    bus = EventBus()
+    received = []
+    subscription = bus.subscribe(StateChanged, received.append)
+    bus.unsubscribe(subscription)
+    bus.publish(StateChanged('state', 'offline'))
+    assert received == []
+
+
+def test_queued_delivery_keeps_the_order_in_the_bus_thread():
+    bus = EventBus()
+    received, threads = [], set()
+    done = threading.Event()
+
+    def handler(event):
+        received.append(event.value)
+        threads.add(threading.current_thread())
+        if event.value == 99:
+            done.set()
+    bus.subscribe(StateChanged, handler, queued=True)
+    for i in range(100):
+        bus.publish(StateChanged('state', i))
+    assert done.wait(2)
+    assert received == list(range(100))
+    assert threading.current_thread() not in threads
+
+
+def test_failing_queued_handler_doesnt_stop_the_bus():
+    bus = EventBus()
+    received = []
+    done = threading.Event()
+
+    def handler(event):
+        if event.value == 'boom':
+            raise ValueError(event.value)
+        received.append(event.value)
+        done.set()
+    bus.subscribe(StateChanged, handler, queued=True)
+    bus.publish(StateChanged('state', 'boom'))
+    bus.publish(StateChanged('state', 'ok'))
+    assert done.wait(2) and received == ['ok']
+
+
+def test_debounce_delivers_the_last_event_once_quiet():
+    bus = EventBus()
+    received = []
+    bus.subscribe(StateChanged, received.append, debounce=0.05)
+    for i in range(5):
+        bus.publish(StateChanged('state', i))
+    time.sleep(0.3)
+    assert received == [StateChanged('state', 4)]
+
+
+def test_batch_delivers_the_events_of_the_window():
+    bus = EventBus()
+    received = []
+    bus.subscribe(ProbeCompleted, received.append, batch=0.1)
+    for i in range(3):
+        bus.publish(ProbeCompleted('INVITEINSA', {'n': i}))
+    time.sleep(0.4)
+    assert received == [[ProbeCompleted('INVITEINSA', {'n': i}) for i in range(3)]]
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import history
+from clock import VirtualClock
+from history import HistoryLog, HistoryReader, segment_paths, summarize
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock(1000)
+
+
+def _log(tmp_path, clock, **kwargs):
+    return HistoryLog(str(tmp_path), clock=clock, **kwargs)
+
+
+def test_nothing_is_written_before_the_first_record(tmp_path, clock):
+    _log(tmp_path, clock)
+    assert segment_paths(str(tmp_path)) == []
+
+
+def test_bisect_finds_the_window(tmp_path, clock):
+    log = _log(tmp_path, clock, heartbeat=float('inf'))
+    for i in range(1000):
+        log.recordState('offline' if i % 2 else 'exterior')
+        clock.advance(10)
+    log.close()
+    reader = HistoryReader(str(tmp_path), chunk_records=64)
+    records = list(reader.records(5000, 6000))
+    assert [r.timestamp for r in records] == [5000 + 10 * i for i in range(100)]
+    assert reader.state_at(5005) == 'exterior' and reader.state_at(5015) == 'offline'
+    assert reader.last_before(5000).timestamp == 4990
+
+
+def test_rotation_keeps_max_segments(tmp_path, clock):
+    recordSize = history.RECORD.size
+    log = _log(tmp_path, clock, segment_bytes=10 * recordSize, max_segments=3, heartbeat=float('inf'))
+    for i in range(100):
+        log.recordRenewal('A', 0.5, 0.1)
+        clock.advance(1)
+    log.close()
+    segments = segment_paths(str(tmp_path))
+    assert len(segments) == 3
+    assert all(os.path.getsize(path) <= 10 * recordSize for path in segments)
+    records = list(HistoryReader(str(tmp_path)).records())
+    assert records[-1].timestamp == 1099
+    assert [r.timestamp for r in records] == sorted(r.timestamp for r in records)
+
+
+def test_summarize_uptime_outages_and_renewals(tmp_path, clock):
+    log = _log(tmp_path, clock)
+    log.recordState('captive_portal_connected')
+    log.recordSession('A', 21600)
+    for _ in range(10):
+        clock.advance(300)
+        log.recordState('captive_portal_connected')  # Battement
+    log.recordState('captive_portal_disconnected')
+    clock.advance(60)
+    log.recordRenewal('A', 0.4, 0.2)
+    log.recordState('captive_portal_connected')
+    clock.advance(540)
+    log.recordState('captive_portal_connected')
+    log.close()
+    summary = summarize(HistoryReader(str(tmp_path)), 1000, 4600, max_silence=600)
+    assert summary['state_seconds'] == {'captive_portal_connected': 3540, 'captive_portal_disconnected': 60}
+    assert summary['outages'] == 1 and summary['outage_seconds'] == 60
+    assert summary['uptime'] == pytest.approx(3540 / 3600)
+    assert summary['sessions'] == 1 and summary['renewals'] == 1 and summary['renewal_gap_mean'] == pytest.approx(0.2)
+
+
+def test_summarize_counts_the_time_between_runs_as_unmonitored(tmp_path, clock):
+    log = _log(tmp_path, clock, heartbeat=300)
+    log.recordState('captive_portal_connected')
+    for _ in range(12):
+        clock.advance(300)
+        log.recordState('captive_portal_connected')
+    log.close()  # Tué sans écrire 'stopped'
+    clock.advance(36000)
+    log = _log(tmp_path, clock, heartbeat=300)
+    log.recordState('offline')
+    clock.advance(100)
+    log.recordState('exterior')
+    log.close()
+    summary = summarize(HistoryReader(str(tmp_path)), 1000, clock.time(), max_silence=600)
+    assert summary['state_seconds'][None] == pytest.approx(36000)
+    assert summary['state_seconds']['captive_portal_connected'] == pytest.approx(3600)
+    assert summary['outage_seconds'] == pytest.approx(100)
+
+
+def test_segments_are_private(tmp_path, clock):
+    log = _log(tmp_path, clock)
+    log.recordState('offline')
+    log.close()
+    assert all(os.stat(path).st_mode & 0o777 == 0o600 for path in segment_paths(str(tmp_path)))
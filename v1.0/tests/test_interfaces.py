@@ -0,0 +1,39 @@
+import socket
+
+import pytest
+
+import interfaces
+
+pytestmark = pytest.mark.skipif(interfaces.fcntl is None, reason="interfaces Linux seulement")
+
+
+def test_loopback_is_not_monitored():
+    assert interfaces.interface_address('lo') == '127.0.0.1'
+    assert 'lo' not in interfaces.list_interfaces()
+    assert all(interfaces.interface_address(name) for name in interfaces.list_interfaces())
+
+
+def test_missing_interface():
+    assert interfaces.interface_address('absent0') is None
+    assert not interfaces.can_bind_to_device('absent0')
+    assert 'absent0' not in interfaces._deviceBinding  # Réessayé quand elle apparaîtra
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        with pytest.raises(OSError):
+            interfaces.bind_socket(sock, 'absent0')
+
+
+def test_no_interface_means_no_binding():
+    assert interfaces.source_address(None) is None
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        interfaces.bind_socket(sock, None)
+        assert sock.getsockname() == ('0.0.0.0', 0)
+
+
+def test_bound_socket_only_reaches_through_its_interface():
+    names = interfaces.list_interfaces()
+    if not names or not interfaces.can_bind_to_device(names[0]):
+        pytest.skip("SO_BINDTODEVICE indisponible")
+    assert interfaces.source_address(names[0]) is None
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        interfaces.bind_socket(sock, names[0])
+        assert sock.getsockopt(socket.SOL_SOCKET, interfaces.SO_BINDTODEVICE, 16).rstrip(b'\x00') == names[0].encode()
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import leader
+from leader import LeaderElection, private_directory
+
+pytestmark = pytest.mark.skipif(leader.fcntl is None, reason="flock() seulement")
+
+
+def test_one_leader_at_a_time(tmp_path):
+    path = str(tmp_path / 'INSAConnectSession.dat.lock')
+    first, second = LeaderElection(path), LeaderElection(path)
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    assert second.leaderPID() == os.getpid()
+    first.release()
+    assert second.try_acquire()
+    assert not first.try_acquire()
+    second.release()
+
+
+def test_leader_death_hands_over(tmp_path):
+    path = str(tmp_path / 'INSAConnectSession.dat.lock')
+    code = ("import sys, time\nsys.path.insert(0, %r)\nfrom leader import LeaderElection\n"
+            "assert LeaderElection(%r).try_acquire()\nprint('leader', flush=True)\ntime.sleep(30)\n"
+            % (os.path.dirname(leader.__file__), path))
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True)
+    follower = LeaderElection(path)
+    try:
+        assert process.stdout.readline().strip() == 'leader'
+        assert not follower.try_acquire()
+        assert follower.leaderPID() == process.pid
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+    # Le noyau libère le verrou du processus mort
+    assert follower.try_acquire()
+    assert follower.leaderPID() == os.getpid()
+    follower.release()
+
+
+def test_private_directory(tmp_path):
+    path = private_directory(str(tmp_path), create=False)
+    assert not os.path.exists(path)
+    assert private_directory(str(tmp_path)) == path
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    assert private_directory(str(tmp_path), create=False) == path
+
+
+def test_shared_directory_is_refused(tmp_path):
+    path = private_directory(str(tmp_path))
+    os.chmod(path, 0o777)
+    with pytest.raises(PermissionError):
+        private_directory(str(tmp_path))
+    os.rmdir(path)
+    os.symlink(str(tmp_path), path)
+    with pytest.raises(PermissionError):
+        private_directory(str(tmp_path))
+
+
+@pytest.mark.skipif(not hasattr(os, 'geteuid') or os.geteuid() != 0, reason="nécessite root pour créer un fichier d'un autre utilisateur")
+def test_lock_file_of_another_user_is_refused(tmp_path):
+    path = str(tmp_path / 'INSAConnectSession.dat.lock')
+    open(path, 'w').close()
+    os.chown(path, 65534, 65534)
+    assert not LeaderElection(path).try_acquire()
@@ -0,0 +1,41 @@
+from lifetime import LifetimeEstimator, survival_quantile
+
+
+def test_quantile_of_deaths_only():
+    samples = [(duration, True) for duration in (100, 200, 300, 400)]
+    assert survival_quantile(samples, 0.25) == 100
+    assert survival_quantile(samples, 0.5) == 200
+    assert survival_quantile(samples, 1.0) == 400
+
+
+def test_censored_samples_lower_the_risk():
+    # Les sessions renouvelées avant 150 s ne disent rien des morts suivantes : 1 mort parmi 2 restants
+    samples = [(50, False), (60, False), (100, True), (200, True)]
+    assert survival_quantile(samples, 0.5) == 100
+    assert survival_quantile(samples, 0.6) == 200
+
+
+def test_deaths_come_before_censored_at_equal_duration():
+    assert survival_quantile([(100, False), (100, True)], 0.5) == 100
+
+
+def test_not_enough_deaths():
+    assert survival_quantile([(100, False), (200, False)], 0.05) is None
+    assert survival_quantile([], 0.05) is None
+
+
+def test_estimator_falls_back_to_default_and_is_bounded(tmp_path):
+    estimator = LifetimeEstimator(str(tmp_path / 'lifetimes.json'), quantile=0.05, min_deaths=2, min_lifetime=140)
+    assert estimator.estimate('A', 21600) == 21600
+    for duration in (10, 12, 15):
+        estimator.observe('A', 1000, 1000 + duration, died=True)
+    assert estimator.estimate('A', 21600) == 140
+    assert estimator.estimate('A', 100) == 100
+    assert LifetimeEstimator(str(tmp_path / 'lifetimes.json')).portals['A']['samples'][0] == [10, True]
+
+
+def test_estimate_never_exceeds_the_ini_timeout(tmp_path):
+    estimator = LifetimeEstimator(str(tmp_path / 'lifetimes.json'), quantile=0.05, min_deaths=2, min_lifetime=140)
+    for duration in (30000, 31000, 32000):
+        estimator.observe('A', 1000, 1000 + duration, died=True)
+    assert estimator.estimate('A', 21600) == 21600
@@ -0,0 +1,79 @@
+import portal_client
+from eventbus import EventBus, StateChanged
+from links import MultiLinkManager, monitored_interfaces
+
+
+class _Model:
+
+    def __init__(self, iniFile, interface=None):
+        self.interface = interface
+        self.events = EventBus()
+        self.DISPLAY = {}
+        self.METRICS = {'ENABLED': True}
+        self.lifetimes = object()
+        self.connectionStateText = interface + " ok"
+        self.connectedThroughCaptivePortal = False
+        self.portalStatus = portal_client.OK
+        self.currentSession = {'ID': None}
+
+
+class _Monitor:
+
+    def __init__(self):
+        self.wakeups = 0
+
+    def wakeup(self):
+        self.wakeups += 1
+
+
+class _Manager:
+
+    def __init__(self, headless, model, fastStart):
+        self.model = model
+        self.state = None
+        self.networkMonitor = _Monitor()
+
+    def setState(self, state):
+        self.state = state
+        self.model.events.publish(StateChanged('state', state))
+
+
+def _links():
+    return MultiLinkManager(['eth0', 'wlan0'], _Model, _Manager)
+
+
+def test_links_share_one_lifetime_estimate_and_metrics_server():
+    links = _links()
+    assert links.links['wlan0'].model.lifetimes is links.links['eth0'].model.lifetimes
+    assert links.links['eth0'].model.METRICS['ENABLED'] and not links.links['wlan0'].model.METRICS['ENABLED']
+
+
+def test_a_strictly_better_link_becomes_active():
+    links = _links()
+    changes = []
+    links.model.events.subscribe(StateChanged, changes.append)
+    links.links['eth0'].setState('offline')
+    assert links.active == 'eth0'
+    links.links['wlan0'].setState('exterior')
+    assert links.active == 'wlan0'
+    assert StateChanged('activeInterface', 'wlan0') in changes
+    assert links.model.connectionStateText.startswith("Interface wlan0\nwlan0 ok")
+    # À égalité, le lien actif le reste
+    links.links['eth0'].setState('captive_portal_connected')
+    assert links.active == 'wlan0'
+
+
+def test_falling_active_link_wakes_the_others():
+    links = _links()
+    links.links['eth0'].setState('exterior')
+    links.links['eth0'].setState('offline')
+    assert links.links['wlan0'].networkMonitor.wakeups == 1
+    assert links.links['eth0'].networkMonitor.wakeups == 0
+
+
+def test_monitored_interfaces(tmp_path):
+    ini = tmp_path / 'INSAConnect.ini'
+    ini.write_text("[Interfaces]\nnames = eth0, wlan0\n")
+    assert monitored_interfaces(str(ini)) == ['eth0', 'wlan0']
+    ini.write_text("[Interfaces]\nnames =\n")
+    assert monitored_interfaces(str(ini)) == []
@@ -0,0 +1,69 @@
+import pytest
+
+from login_parser import LoginPage, LoginResponseParser, parse_login_page
+from portal_client import PortalClient
+
+PAGE = (b'<html><body>' + b'x' * 700 + b'<form><input name="logout_id" type="hidden" value="4f2a9c" /></form>'
+        + b'y' * 300 + b'</body></html>')
+
+
+def _feed(page, size):
+    parser = LoginResponseParser()
+    for start in range(0, len(page), size):
+        parsed = parser.feed(page[start:start + size])
+        if parsed is not None:
+            return parsed
+    return parser.finish()
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 45, 46, 64, 512, 4096])
+def test_logout_id_split_between_chunks(size):
+    assert _feed(PAGE, size) == LoginPage('4f2a9c', False)
+
+
+@pytest.mark.parametrize('size', [1, 3, 512])
+def test_error_page(size):
+    assert _feed(b'<p>Une erreur est survenue</p>' + PAGE, size) == LoginPage(None, True)
+
+
+def test_page_without_logout_id():
+    assert _feed(b'<html>' + b'z' * 2000 + b'</html>', 100) == LoginPage(None, False)
+
+
+def test_unreadable_value_does_not_wait_for_the_rest():
+    parser = LoginResponseParser()
+    assert parser.feed(b'<input name="logout_id" type="hidden" value="' + b'a' * 200) == LoginPage(None, False)
+
+
+def test_whole_page():
+    assert parse_login_page(PAGE.decode('ascii')) == LoginPage('4f2a9c', False)
+
+
+class _StreamedResponse:
+
+    def __init__(self, body, content_length=True):
+        self.body = body
+        self.headers = {'Content-Length': str(len(body))} if content_length else {}
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.read = start + chunk_size
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('content_length', [True, False])
+def test_short_page_is_drained_for_the_keep_alive(content_length):
+    response = _StreamedResponse(PAGE, content_length)
+    assert PortalClient._parse(response, LoginResponseParser()) == LoginPage('4f2a9c', False)
+    assert response.read >= len(PAGE) and response.closed
+
+
+def test_long_page_is_not_drained():
+    response = _StreamedResponse(PAGE + b'z' * 100000)
+    assert PortalClient._parse(response, LoginResponseParser()) == LoginPage('4f2a9c', False)
+    assert response.read < len(PAGE) and response.closed
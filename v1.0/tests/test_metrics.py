@@ -0,0 +1,74 @@
+import json
+import urllib.request
+
+import pytest
+
+from clock import VirtualClock
+from metrics import Histogram, Metrics, MetricsServer, timed
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [(0.1, 2), (1, 3), (float('inf'), 4)]
+    assert histogram.sum == pytest.approx(3.65)
+
+
+class _Operation:
+
+    def __init__(self, clock):
+        self.metrics = Metrics(clock)
+
+    @timed('connect')
+    def connect(self, seconds, fail=False):
+        self.metrics.clock.advance(seconds)
+        if fail:
+            raise OSError("portail injoignable")
+        return seconds
+
+
+def test_timed_uses_the_injected_clock():
+    operation = _Operation(VirtualClock(0))
+    assert operation.connect(2) == 2
+    with pytest.raises(OSError):
+        operation.connect(0.5, fail=True)
+    histogram = operation.metrics.histograms['connect']
+    assert (histogram.count, histogram.sum) == (2, 2.5)  # Les échecs sont chronométrés aussi
+
+
+def test_state_seconds_include_the_current_state():
+    clock = VirtualClock(0)
+    metrics = Metrics(clock)
+    metrics.setState('offline')
+    clock.advance(10)
+    metrics.setState('captive_portal_connected')
+    clock.advance(5)
+    metrics.setState('captive_portal_connected')
+    clock.advance(5)
+    metrics.setState('offline')
+    clock.advance(1)
+    state = metrics.as_dict()
+    assert state['state_seconds'] == {'offline': 11, 'captive_portal_connected': 10}
+    assert state['state_transitions'] == {'offline': 2, 'captive_portal_connected': 1}
+    assert state['current_state'] == 'offline'
+
+
+def test_endpoint():
+    clock = VirtualClock(0)
+    metrics = Metrics(clock)
+    metrics.observe('detect_captive_portal', 0.003)
+    metrics.increment('probe_failure_dns')
+    server = MetricsServer(metrics, 0)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:%d' % server._server.server_address[1]
+        with urllib.request.urlopen(url + '/metrics') as response:
+            text = response.read().decode('utf-8')
+        assert 'insaconnect_operation_duration_seconds_count{operation="detect_captive_portal"} 1' in text
+        assert 'insaconnect_operation_duration_seconds_bucket{operation="detect_captive_portal",le="0.005"} 1' in text
+        assert 'insaconnect_events_total{event="probe_failure_dns"} 1' in text
+        with urllib.request.urlopen(url + '/metrics.json') as response:
+            assert json.loads(response.read().decode('utf-8'))['counters'] == {'probe_failure_dns': 1}
+    finally:
+        server.stop()
@@ -0,0 +1,67 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import netwatch
+from netwatch import NetworkChangeMonitor
+
+
+def _message(messageType, payload=b'\x00' * 4):
+    return netwatch.NLMSGHDR.pack(netwatch.NLMSGHDR.size + len(payload), messageType, 0, 0, 0) + payload
+
+
+@pytest.fixture
+def monitor():
+    monitor = NetworkChangeMonitor(use_netlink=False)
+    yield monitor
+    monitor.close()
+
+
+@pytest.fixture
+def kernel(monitor):
+    """Stands in for the netlink socket: what is sent on the returned socket is read as kernel notifications."""
+    reader, writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    reader.setblocking(False)
+    monitor._netlinkSocket = reader
+    yield writer
+    writer.close()
+
+
+def test_wait_times_out(monitor):
+    start = time.monotonic()
+    assert monitor.wait(0.1) is False
+    assert time.monotonic() - start >= 0.09
+
+
+def test_wakeup_interrupts_the_wait(monitor):
+    threading.Timer(0.05, monitor.wakeup).start()
+    start = time.monotonic()
+    assert monitor.wait(5) is False
+    assert time.monotonic() - start < 1
+
+
+def test_wakeup_before_the_wait_is_not_lost_nor_repeated(monitor):
+    monitor.wakeup()
+    monitor.wakeup()
+    start = time.monotonic()
+    monitor.wait(5)
+    assert time.monotonic() - start < 1
+    start = time.monotonic()
+    monitor.wait(0.1)
+    assert time.monotonic() - start >= 0.09
+
+
+def test_network_change_ends_the_wait(monitor, kernel):
+    kernel.send(_message(netwatch.RTM_NEWLINK) + _message(netwatch.RTM_NEWADDR))
+    threading.Timer(0.01, kernel.send, args=(_message(netwatch.RTM_NEWROUTE),)).start()
+    assert monitor.wait(5) is True
+    # La rafale a été lue en entier : rien ne reste pour l'attente suivante
+    assert monitor.wait(0.05) is False
+
+
+def test_other_notifications_are_ignored(monitor, kernel):
+    kernel.send(_message(3))  # NLMSG_DONE
+    assert monitor.wait(0.1) is False
+
@@ -0,0 +1,78 @@
+import pytest
+
+import portal_client
+from clock import VirtualClock
+from portal_client import CircuitBreaker, PortalClient, PortalResult
+
+
+def test_breaker_opens_after_threshold_failures():
+    clock = VirtualClock(0)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=clock)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_trial_through_once_half_open():
+    clock = VirtualClock(0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.allow()
+    breaker.record_failure()
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
+    assert not breaker.allow()  # Un seul essai à la fois
+
+
+def test_breaker_trial_success_closes_and_failure_reopens():
+    clock = VirtualClock(0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.allow()
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+class _Response:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize('status_code', [403, 404])
+def test_client_error_during_trial_settles_the_breaker(status_code):
+    clock = VirtualClock(0)
+    client = PortalClient('http://portal.invalid/', breaker_threshold=1, breaker_reset=30, clock=clock)
+    client._attempt = lambda data, parser=None: PortalResult(portal_client.HTTP_ERROR, _Response(status_code), None, 0)
+    assert client.request({}).status == portal_client.HTTP_ERROR
+    assert client.request({}).status == portal_client.CIRCUIT_OPEN
+    clock.advance(30)
+    assert client.request({}).status == portal_client.HTTP_ERROR  # Essai en demi-ouverture, non réessayé
+    clock.advance(30)
+    # L'essai a été conclu : le disjoncteur laisse passer le suivant au lieu de rester bloqué
+    assert client.request({}).status == portal_client.HTTP_ERROR
+    client.close()
+
+
+def test_login_is_not_resent_once_it_reached_the_portal():
+    clock = VirtualClock(0)
+    client = PortalClient('http://portal.invalid/', retries=2, clock=clock)
+    attempts = []
+
+    def attempt(data, parser=None):
+        attempts.append(data)
+        return PortalResult(portal_client.TIMEOUT, None, portal_client.requests.ReadTimeout(), 0)
+    client._attempt = attempt
+    assert client.request({'login': 'x'}).status == portal_client.TIMEOUT
+    assert attempts == [{'login': 'x'}]
+    client.close()
@@ -0,0 +1,73 @@
+import socket
+import time
+
+import pytest
+
+from probe import ProbeRace, tcp_probe
+from resolver import ResolveError
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(8)
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class _Resolver:
+    """Resolves every name to 127.0.0.1, 'slow' after delay seconds; 'unknown' fails."""
+
+    def __init__(self, delay=1):
+        self.delay = delay
+
+    def resolve(self, host, timeout=3):
+        if host == 'unknown':
+            raise ResolveError(host)
+        if host == 'slow':
+            time.sleep(self.delay)
+        return ['127.0.0.1']
+
+
+def test_probe_stages(listener, closed_port):
+    assert tcp_probe('127.0.0.1', listener, timeout=1) == (True, None, pytest.approx(0, abs=1))
+    assert tcp_probe('127.0.0.1', closed_port, timeout=1).stage == 'tcp'
+    assert not tcp_probe('127.0.0.1', closed_port, timeout=1)
+
+
+def test_probe_through_the_resolver(listener):
+    resolver = _Resolver()
+    assert tcp_probe('portail', listener, timeout=1, resolver=resolver).ok
+    assert tcp_probe('unknown', listener, timeout=1, resolver=resolver).stage == 'dns'
+    # Résolution plus longue que le budget : c'est le DNS qui est en cause
+    assert tcp_probe('slow', listener, timeout=0.2, resolver=_Resolver(delay=0.3)).stage == 'dns'
+
+
+def test_race_returns_the_first_winner_in_ini_order(listener, closed_port):
+    race = ProbeRace(max_workers=4, resolver=_Resolver(delay=2))
+    start = time.monotonic()
+    winner, results = race.run({'INSA/Promologis': ('127.0.0.1', closed_port), 'slow': ('slow', listener),
+                                'INVITEINSA': ('portail', listener)}, winners={'INSA/Promologis', 'slow', 'INVITEINSA'}, timeout=3)
+    assert winner == 'INVITEINSA'
+    assert time.monotonic() - start < 1  # Sans attendre la sonde lente
+    assert 'slow' not in results
+    race.shutdown()
+
+
+def test_race_without_winner_waits_for_every_probe(listener, closed_port):
+    race = ProbeRace(max_workers=4)
+    winner, results = race.run({'INVITEINSA': ('127.0.0.1', closed_port), 'external': ('127.0.0.1', listener)},
+                               winners={'INVITEINSA'}, timeout=1)
+    assert winner is None
+    assert not results['INVITEINSA'] and results['external']
+    race.shutdown()
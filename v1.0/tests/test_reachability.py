@@ -0,0 +1,87 @@
+import http.server
+import socket
+import struct
+import threading
+
+import pytest
+
+import reachability
+from reachability import ReachabilityChecker, _checksum
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/generate_204':
+            self.send_response(204)
+        else:
+            # Ce que fait un portail captif : tout est redirigé vers sa page de login
+            self.send_response(302)
+            self.send_header('Location', 'http://portail.invalid/')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def web():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def test_checksum_of_a_checksummed_packet_is_zero():
+    header = struct.pack('!BBHHH', reachability.ICMP_ECHO_REQUEST, 0, 0, 0, 1) + b'abc'
+    packet = header[:2] + struct.pack('!H', _checksum(header)) + header[4:]
+    assert _checksum(packet) == 0
+
+
+def test_http_expects_a_204(web):
+    assert ReachabilityChecker(methods=('http',), http_urls=(web + '/generate_204',)).check(1)
+    assert not ReachabilityChecker(methods=('http',), http_urls=(web + '/hijacked',)).check(1)
+
+
+def test_http_without_answer_times_out():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    try:
+        checker = ReachabilityChecker(methods=('http',), http_urls=('http://127.0.0.1:%d/generate_204' % server.getsockname()[1],))
+        assert not checker.check(0.2)
+    finally:
+        server.close()
+
+
+def test_tcp(web):
+    port = int(web.rsplit(':', 1)[1])
+    assert ReachabilityChecker(hosts=('127.0.0.1',), methods=('tcp',), tcp_port=port).check(1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    closed = sock.getsockname()[1]
+    sock.close()
+    assert not ReachabilityChecker(hosts=('127.0.0.1',), methods=('tcp',), tcp_port=closed).check(0.5)
+
+
+def test_udp_expects_the_query_id_back():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        server.bind(('127.0.0.54', 53))
+    except OSError:
+        server.close()
+        pytest.skip("impossible d'écouter sur 127.0.0.54:53")
+
+    def answer():
+        with server:
+            query, client = server.recvfrom(512)
+            server.sendto(query[:2] + b'\x81\x80' + query[4:], client)
+    threading.Thread(target=answer, daemon=True).start()
+    assert ReachabilityChecker(hosts=('127.0.0.54',), methods=('udp',)).check(1)
+
+
+def test_falls_back_to_http_without_icmp(monkeypatch):
+    monkeypatch.setattr(ReachabilityChecker, '_icmp_available', staticmethod(lambda: False))
+    assert ReachabilityChecker(methods=('icmp', 'tcp')).method == 'tcp'
+    assert ReachabilityChecker(methods=('icmp',)).method == 'http'
@@ -0,0 +1,59 @@
+import io
+import threading
+import time
+
+from renderer import HeadlessRenderer, TerminalRenderer
+
+
+class _Stream(io.StringIO):
+    """Output stream that tells when something was flushed."""
+
+    def __init__(self):
+        super().__init__()
+        self.flushed = threading.Event()
+
+    def flush(self):
+        self.flushed.set()
+
+
+def test_first_frame_clears_the_screen_then_only_changed_lines_are_rewritten():
+    stream = _Stream()
+    renderer = TerminalRenderer(stream=stream)
+    renderer._draw(['INSAConnect', 'Connecté', 'Session abc'], full=False)
+    assert stream.getvalue() == '\x1b[H\x1b[2JINSAConnect\nConnecté\nSession abc\x1b[4;1H'
+    stream.seek(0)
+    stream.truncate()
+    renderer._draw(['INSAConnect', 'Déconnecté'], full=False)
+    # Ligne 2 réécrite, ligne 3 effacée, ligne 1 inchangée
+    assert stream.getvalue() == '\x1b[2;1HDéconnecté\x1b[K\x1b[3;1H\x1b[K\x1b[3;1H'
+
+
+def test_updates_in_a_burst_are_coalesced_into_one_frame():
+    stream = _Stream()
+    renderer = TerminalRenderer(coalesce=0.1, max_fps=10, stream=stream)
+    built = []
+    state = {'text': None}
+
+    def builder():
+        built.append(state['text'])
+        return [state['text']]
+    for i in range(20):
+        state['text'] = 'état %d' % i
+        renderer.submit(builder)
+    assert stream.flushed.wait(2)
+    time.sleep(0.2)
+    assert built == ['état 19']
+    assert 'état 19' in stream.getvalue()
+
+
+def test_failed_frame_forces_a_full_redraw():
+    stream = _Stream()
+    renderer = TerminalRenderer(coalesce=0, stream=stream)
+    renderer._draw(['a'], full=False)
+    renderer.submit(lambda: 1 / 0)
+    time.sleep(0.2)
+    assert renderer._fullRedraw
+
+
+def test_headless_builds_nothing():
+    HeadlessRenderer().submit(lambda: 1 / 0)
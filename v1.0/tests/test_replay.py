@@ -0,0 +1,60 @@
+import pytest
+
+import replay
+from eventbus import SessionRenewed
+
+START = 1700000000.0
+URL = 'http://127.0.0.1:8003/'
+INI = """[DEFAULT]
+login = u
+pass = p
+[Captive_portal:LOCAL]
+url = %s
+domain = 127.0.0.1
+port = 8003
+timeout = 60
+[Renewal]
+lead = 5
+jitter = 1
+""" % URL
+
+
+@pytest.fixture
+def trace(tmp_path):
+    """200 s behind a portal whose sessions last 60 s; the connection goes through whenever a session is open."""
+    path = str(tmp_path / 'trace.gz')
+    writer = replay.TraceWriter(path)
+    writer.write({'version': replay.TRACE_VERSION, 'start': START, 'ini': INI, 'session': None, 'netlink': False})
+    writer.write(['race', START, 0.002, 'LOCAL', [['LOCAL', True, None, 0.002]]])
+    writer.write(['reach', START, 0.001, True])
+    writer.write(['portal', START + 0.01, 0.005, URL, 'login', 'ok', ['s0', False], None])
+    # Vérification de la session au premier tour : le portail redonne la même
+    writer.write(['portal', START + 1, 0.005, URL, 'login', 'ok', ['s0', False], None])
+    for i in range(1, 4):
+        writer.write(['portal', START + 54 * i, 0.004, URL, 'logout', 'ok', None, None])
+        writer.write(['portal', START + 54 * i + 0.01, 0.005, URL, 'login', 'ok', ['s%d' % i, False], None])
+    writer.write(['reach', START + 200, 0.001, True])
+    writer.close()
+    return path
+
+
+def test_replay_is_deterministic(insaconnect, trace):
+    reports = [replay.Player(trace).replay(insaconnect.ConnectionModel, insaconnect.ConnectionManager, seed=3) for _ in range(2)]
+    for report in reports:
+        del report['wall_seconds']
+    assert reports[0] == reports[1]
+    report = reports[0]
+    assert report['misses'] == 0
+    assert report['virtual_seconds'] == pytest.approx(200, abs=1)
+    # Une session au départ, puis un renouvellement avant chaque expiration (60 s, moins lead et jitter)
+    renewals = [t for t, event in report['timeline'] if isinstance(event, SessionRenewed)]
+    assert len(renewals) == 4
+    assert all(53 <= b - a <= 56 for a, b in zip(renewals, renewals[1:]))
+    assert len(report['renewal_gaps']) == 3
+
+
+def test_replay_starts_no_thread(insaconnect, trace, monkeypatch):
+    started = []
+    monkeypatch.setattr(replay.threading.Thread, 'start', lambda thread: started.append(thread.name))
+    replay.Player(trace).replay(insaconnect.ConnectionModel, insaconnect.ConnectionManager)
+    assert started == []
@@ -0,0 +1,70 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+import interfaces
+from resolver import DNSCache, _parse_a_answer, _skip_name
+
+
+def _name(host):
+    return b''.join(bytes([len(label)]) + label for label in host.encode('ascii').split(b'.')) + b'\x00'
+
+
+def _response(answers, flags=0x8180):
+    """DNS response to an A question for portail.insa-toulouse.fr, with answers [(name bytes, type, ttl, rdata)]."""
+    data = struct.pack('!HHHHHH', 0x1234, flags, 1, len(answers), 0, 0) + _name('portail.insa-toulouse.fr') + struct.pack('!HH', 1, 1)
+    for name, recordType, ttl, rdata in answers:
+        data += name + struct.pack('!HHIH', recordType, 1, ttl, len(rdata)) + rdata
+    return data
+
+
+POINTER = b'\xc0\x0c'  # Nom compressé : renvoie à la question
+
+
+def test_a_records():
+    data = _response([(POINTER, 1, 300, bytes([10, 0, 0, 1])), (POINTER, 1, 120, bytes([10, 0, 0, 2]))])
+    assert _parse_a_answer(data) == (['10.0.0.1', '10.0.0.2'], 120)
+
+
+def test_cname_chain_keeps_the_smallest_ttl():
+    target = _name('lb.insa-toulouse.fr')
+    data = _response([(POINTER, 5, 60, target), (target, 1, 3600, bytes([193, 52, 94, 1]))])
+    assert _parse_a_answer(data) == (['193.52.94.1'], 60)
+
+
+def test_errors_and_truncation_give_no_answer():
+    assert _parse_a_answer(_response([], flags=0x8183)) is None  # NXDOMAIN
+    assert _parse_a_answer(_response([(POINTER, 1, 300, bytes([10, 0, 0, 1]))], flags=0x8380)) is None  # TC
+    assert _parse_a_answer(_response([])) is None
+
+
+def test_skip_name():
+    data = b'\x00' * 12 + _name('a.bc') + POINTER
+    assert _skip_name(data, 12) == 12 + 6
+    assert _skip_name(data, 18) == 20
+
+
+def test_local_resolver_is_asked_through_the_loopback():
+    names = interfaces.list_interfaces()
+    if not names:
+        pytest.skip("aucune interface hors loopback")
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        server.bind(('127.0.0.53', 53))
+    except OSError:
+        server.close()
+        pytest.skip("impossible d'écouter sur 127.0.0.53:53")
+
+    def answer():
+        with server:
+            query, client = server.recvfrom(512)
+            question = query[12:]
+            server.sendto(query[:2] + struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0) + question
+                          + POINTER + struct.pack('!HHIH', 1, 1, 60, 4) + bytes([10, 0, 0, 7]), client)
+    thread = threading.Thread(target=answer, daemon=True)
+    thread.start()
+    cache = DNSCache(nameservers=['127.0.0.53'], interface=names[0])
+    assert cache.resolve('portail.insa-toulouse.fr', timeout=2) == ['10.0.0.7']
+    thread.join()
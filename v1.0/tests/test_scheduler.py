@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from clock import SystemClock, VirtualClock
+from scheduler import RenewalScheduler
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock(0)
+
+
+def _scheduler(clock, fired, **kwargs):
+    scheduler = RenewalScheduler(clock=clock, **kwargs)
+    scheduler.start(lambda key, kind: fired.append((clock.time(), key, kind)))
+    return scheduler
+
+
+def _run_until(scheduler, clock, t):
+    """Moves the clock from timer to timer up to t, as the replay does."""
+    while True:
+        deadline = scheduler.next_deadline(kind=None)
+        if deadline is None or deadline > t:
+            break
+        clock.advance_to(deadline)
+        scheduler.run_due()
+    clock.advance_to(t)
+
+
+def test_timers_fire_in_deadline_order(clock):
+    fired = []
+    scheduler = _scheduler(clock, fired, lead=60, jitter=0, prewarm_lead=5)
+    scheduler.schedule('B', 1000)
+    scheduler.schedule('A', 500)
+    assert scheduler.next_deadline() == 440
+    _run_until(scheduler, clock, 2000)
+    assert fired == [(435, 'A', 'prewarm'), (440, 'A', 'renew'), (935, 'B', 'prewarm'), (940, 'B', 'renew')]
+
+
+def test_jitter_stays_within_lead(clock):
+    scheduler = RenewalScheduler(lead=60, jitter=10, clock=clock)
+    for seed in range(20):
+        scheduler.random.seed(seed)
+        scheduler.schedule('A', 1000)
+        assert 930 <= scheduler.next_deadline('A') <= 940
+
+
+def test_rescheduling_replaces_the_timers(clock):
+    fired = []
+    scheduler = _scheduler(clock, fired, lead=60, jitter=0, prewarm_lead=0)
+    scheduler.schedule('A', 500)
+    scheduler.schedule('A', 800)
+    _run_until(scheduler, clock, 2000)
+    assert fired == [(740, 'A', 'renew')]
+
+
+def test_cancel(clock):
+    fired = []
+    scheduler = _scheduler(clock, fired, lead=60, jitter=0)
+    scheduler.schedule('A', 500)
+    scheduler.schedule('B', 600)
+    scheduler.cancel('A')
+    assert scheduler.next_deadline('A', kind=None) is None
+    _run_until(scheduler, clock, 2000)
+    assert [key for _, key, _ in fired] == ['B', 'B']
+
+
+def test_failed_renewal_backs_off_until_expiry(clock):
+    fired = []
+
+    def renew(key, kind):
+        fired.append(clock.time())
+        raise OSError("portail injoignable")
+    scheduler = RenewalScheduler(lead=60, jitter=0, prewarm_lead=0, retry_delay=5, max_retry_delay=20, clock=clock)
+    scheduler.random.uniform = lambda a, b: b  # Sans jitter : délais 5, 10, 20, 20...
+    scheduler.start(renew)
+    scheduler.schedule('A', 500)
+    _run_until(scheduler, clock, 2000)
+    assert fired == [440, 445, 455, 475, 495]
+
+
+def test_virtual_clock_starts_no_thread(clock):
+    scheduler = _scheduler(clock, [])
+    assert scheduler._thread is None
+    scheduler.stop()
+
+
+def test_thread_fires_on_time():
+    clock = SystemClock()
+    done = threading.Event()
+    fired = []
+    scheduler = RenewalScheduler(lead=0, jitter=0, prewarm_lead=0, clock=clock)
+    scheduler.start(lambda key, kind: (fired.append((key, kind)), done.set()))
+    scheduler.schedule('A', clock.time() + 0.05)
+    assert done.wait(2)
+    scheduler.stop()
+    assert fired == [('A', 'renew')]
@@ -0,0 +1,52 @@
+import os
+import stat
+
+from session_store import SessionStore
+
+
+def _session(**changes):
+    session = {'captive_portal': 'INSA/Promologis', 'ID': '4f2a9c', 'start_timestamp': 1476684000.0,
+               'end_timestamp': 1476705600.0, 'end_time': '14:00'}
+    session.update(changes)
+    return session
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'session.dat')
+    SessionStore(path).write(_session())
+    stored = SessionStore(path).read()
+    for key in ('captive_portal', 'ID', 'start_timestamp', 'end_timestamp'):
+        assert stored[key] == _session()[key]
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_unknown_start_and_missing_id(tmp_path):
+    path = str(tmp_path / 'session.dat')
+    SessionStore(path).write(_session(start_timestamp=None, ID=None))
+    stored = SessionStore(path).read()
+    assert stored['start_timestamp'] is None and stored['ID'] is None
+
+
+def test_long_values_are_cut_at_a_character_boundary(tmp_path, capsys):
+    path = str(tmp_path / 'session.dat')
+    store = SessionStore(path)
+    store.write(_session(captive_portal='é' * 40))
+    assert store.read()['captive_portal'] == 'é' * 32
+    assert SessionStore(path).read()['captive_portal'] == 'é' * 32
+    assert 'tronqué' in capsys.readouterr().err
+
+
+def test_missing_or_foreign_file(tmp_path):
+    path = tmp_path / 'session.dat'
+    assert SessionStore(str(path)).read() is None
+    path.write_bytes(b'not a session file')
+    assert SessionStore(str(path)).read() is None
+
+
+def test_rewritten_file_is_read_again(tmp_path):
+    path = str(tmp_path / 'session.dat')
+    reader = SessionStore(path)
+    SessionStore(path).write(_session())
+    assert reader.read()['ID'] == '4f2a9c'
+    SessionStore(path).write(_session(ID='77e0d1'))
+    assert reader.read()['ID'] == '77e0d1'